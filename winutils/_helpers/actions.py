@@ -0,0 +1,151 @@
+"""Runs actions requested from keyboard hooks on worker threads, as per their policies."""
+
+import threading
+import time
+import traceback
+import typing as t
+from winutils._helpers import latency
+
+# Every request runs the action once more
+QUEUE = "queue"
+# Requests made while the action is already pending are merged into that run
+COALESCE = "coalesce"
+# Requests made while the action is pending or running are ignored
+DROP = "drop"
+POLICIES = {QUEUE, COALESCE, DROP}
+
+
+class Action:
+    """A registered action, with its pending runs and counters."""
+
+    def __init__(self, name: str, function: t.Callable[[], None], policy: str) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}.")
+        self.name = name
+        self.function = function
+        self.policy = policy
+        self.pending = 0
+        self.running = False
+        self.removed = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failures = 0
+        self.run_times = latency.registry.histogram(f"action {name}")
+        self.condition = threading.Condition()
+
+    def submit(self) -> bool:
+        """Request a run, returning whether it was accepted as per the policy."""
+        with self.condition:
+            self.submitted += 1
+            if self.policy == DROP and (self.pending or self.running):
+                self.dropped += 1
+                return False
+            if self.policy == COALESCE and self.pending:
+                self.coalesced += 1
+                return True
+            self.pending += 1
+            self.condition.notify()
+            return True
+
+    def run_forever(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.removed)
+                if self.removed:
+                    return
+                self.pending -= 1
+                self.running = True
+
+            started = time.perf_counter_ns()
+            try:
+                self.function()
+            except Exception:
+                self.failures += 1
+                traceback.print_exc()
+            finally:
+                self.run_times.record(time.perf_counter_ns() - started)
+                with self.condition:
+                    self.running = False
+
+    def metrics(self) -> dict[str, t.Any]:
+        with self.condition:
+            return {
+                "policy": self.policy,
+                "pending": self.pending,
+                "running": self.running,
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "runs": self.run_times.count,
+                "failures": self.failures,
+                "mean_run_ms": self.run_times.mean / 1e6,
+                "p99_run_ms": self.run_times.percentile(99) / 1e6,
+            }
+
+
+class ActionExecutor:
+    """
+    Runs each registered action on its own worker thread, one run at a time.
+
+    Submitting only updates a counter and notifies the worker, so it's safe to call from a
+    keyboard hook. Different actions run concurrently, so a slow one doesn't hold up others.
+    """
+
+    def __init__(self) -> None:
+        self.actions: dict[str, Action] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, function: t.Callable[[], None], policy: str = QUEUE) -> None:
+        """Register an action, replacing the function and policy of one with the same name."""
+        with self._lock:
+            action = self.actions.get(name)
+            if action is not None:
+                with action.condition:
+                    action.function = function
+                    action.policy = policy
+                return
+            action = Action(name, function, policy)
+            self.actions[name] = action
+        threading.Thread(target=action.run_forever, daemon=True, name=name).start()
+
+    def unregister(self, name: str) -> None:
+        """Remove an action, dropping its pending runs."""
+        with self._lock:
+            action = self.actions.pop(name, None)
+        if action is not None:
+            with action.condition:
+                action.removed = True
+                action.condition.notify()
+
+    def submit(self, name: str) -> bool:
+        """Request a run of an action, returning whether it was accepted."""
+        action = self.actions.get(name)
+        if action is None:
+            return False
+        return action.submit()
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of runs pending across all actions."""
+        return sum(action.pending for action in list(self.actions.values()))
+
+    def metrics(self) -> dict[str, dict[str, t.Any]]:
+        with self._lock:
+            actions = list(self.actions.values())
+        return {action.name: action.metrics() for action in actions}
+
+    def report(self) -> str:
+        """Summarise the counters of every action."""
+        columns = ["policy", "pending", "submitted", "coalesced", "dropped", "runs", "failures"]
+        lines = [
+            f"Pending runs: {self.queue_depth}",
+            f"{'action':<40} " + " ".join(f"{column:>9}" for column in columns),
+        ]
+        for name, metrics in sorted(self.metrics().items()):
+            values = " ".join(f"{metrics[column]:>9}" for column in columns)
+            lines.append(f"{name:<40} {values}")
+        return "\n".join(lines)
+
+
+executor = ActionExecutor()
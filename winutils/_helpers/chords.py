@@ -0,0 +1,96 @@
+"""Matches hotkeys by (modifier mask, scan code), in one lookup however many are registered."""
+
+import typing as t
+import keyboard
+
+CTRL = 1
+SHIFT = 2
+ALT = 4
+WINDOWS = 8
+MODIFIER_BITS = {"ctrl": CTRL, "shift": SHIFT, "alt": ALT, "windows": WINDOWS}
+
+Chord = tuple[int, int]
+
+
+class HotkeyConflict(ValueError):
+    """A hotkey matches a chord which is already taken by another."""
+
+
+def scan_codes(key: t.Union[str, int], backend: t.Any = keyboard) -> tuple[int, ...]:
+    """Resolve a key name to every scan code it may be reported with."""
+    if isinstance(key, int):
+        return (key,)
+    return tuple(backend.key_to_scan_codes(key))
+
+
+def parse_hotkey(hotkey: str, backend: t.Any = keyboard) -> tuple[int, tuple[int, ...]]:
+    """Parse a hotkey like "ctrl+alt+c" into its modifier mask, and the scan codes of its key."""
+    *modifiers, key = hotkey.split("+")
+    mask = 0
+    for modifier in modifiers:
+        name = modifier.strip()
+        if name not in MODIFIER_BITS:
+            raise ValueError(f"{name!r} in {hotkey!r} is not a modifier.")
+        mask |= MODIFIER_BITS[name]
+    return mask, scan_codes(key.strip(), backend)
+
+
+class ChordMatcher:
+    """
+    A table of chords, each mapped to the name of the hotkey it triggers.
+
+    Hotkeys are spelt in any order, like "ctrl+shift+alt+up" or "alt+ctrl+shift+up", and
+    are matched by chord, so two hotkeys taking the same chord are rejected when the second
+    one is added. The table is replaced rather than mutated, so it can be read without locking.
+    """
+
+    def __init__(self, backend: t.Any = keyboard) -> None:
+        self.backend = backend
+        self.table: dict[Chord, str] = {}
+
+    def chords(self, hotkey: str) -> list[Chord]:
+        mask, codes = parse_hotkey(hotkey, self.backend)
+        return [(mask, code) for code in codes]
+
+    def conflicts(self, hotkey: str) -> set[str]:
+        """The registered hotkeys which share a chord with a hotkey."""
+        return {self.table[chord] for chord in self.chords(hotkey) if chord in self.table}
+
+    def check(self, hotkey: str) -> None:
+        """Raise HotkeyConflict if a hotkey shares a chord with a registered one."""
+        taken = self.conflicts(hotkey)
+        if taken:
+            others = ", ".join(map(repr, sorted(taken)))
+            raise HotkeyConflict(f"{hotkey!r} conflicts with {others}.")
+
+    def add(self, hotkey: str) -> list[Chord]:
+        """Add a hotkey, returning its chords. Raises HotkeyConflict if any are taken."""
+        self.check(hotkey)
+        chords = self.chords(hotkey)
+        self.table = {**self.table, **{chord: hotkey for chord in chords}}
+        return chords
+
+    def remove(self, chords: t.Iterable[Chord]) -> set[str]:
+        """Remove chords, returning the hotkeys which no longer have any."""
+        table = dict(self.table)
+        hotkeys = {table.pop(chord) for chord in chords if chord in table}
+        self.table = table
+        return hotkeys - set(table.values())
+
+    def match(self, modifiers: int, code: int) -> t.Optional[str]:
+        return self.table.get((modifiers, code))
+
+    def __len__(self) -> int:
+        return len(set(self.table.values()))
+
+
+def find_conflicts(hotkeys: t.Iterable[str], backend: t.Any = keyboard) -> list[tuple[str, str]]:
+    """Check hotkeys before loading them, returning every pair which share a chord."""
+    matcher = ChordMatcher(backend)
+    conflicts = []
+    for hotkey in hotkeys:
+        taken = matcher.conflicts(hotkey)
+        conflicts.extend((other, hotkey) for other in sorted(taken))
+        if not taken:
+            matcher.add(hotkey)
+    return conflicts
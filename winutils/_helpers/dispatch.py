@@ -0,0 +1,189 @@
+"""A single keyboard hook, routing every event to the tool owning its key by scan code."""
+
+import threading
+import typing as t
+import keyboard
+from winutils._helpers import actions, chords, latency
+
+MODIFIER_NAMES = {
+    "ctrl": chords.CTRL,
+    "left ctrl": chords.CTRL,
+    "right ctrl": chords.CTRL,
+    "shift": chords.SHIFT,
+    "left shift": chords.SHIFT,
+    "right shift": chords.SHIFT,
+    "alt": chords.ALT,
+    "left alt": chords.ALT,
+    "right alt": chords.ALT,
+    "alt gr": chords.ALT,
+    "left windows": chords.WINDOWS,
+    "right windows": chords.WINDOWS,
+}
+
+# Called with the event, whether it's a key down, and the held modifiers.
+# Returns whether the event should be let through when suppressing.
+KeyHandler = t.Callable[[keyboard.KeyboardEvent, bool, int], bool]
+
+
+class KeyDispatcher:
+    """
+    Owns the only keyboard hook, and routes events through tables keyed by scan code.
+
+    Modifiers are tracked as an integer bitmask. Hotkeys are matched by a chords.ChordMatcher,
+    their callbacks are submitted to an action executor so the hook returns immediately.
+    Other keys are routed to the handler registered for them, keys without one to the
+    fallback handler if one is set, and keypad keys, or keys without any handler, are let
+    through untouched. The hook and every key handler are timed in latency.registry.
+
+    The tables are replaced rather than mutated on registration, so the hook reads them
+    without locking. The backend is the keyboard module, or a stand-in with its functions.
+    """
+
+    def __init__(
+        self, backend: t.Any = keyboard, executor: actions.ActionExecutor = actions.executor
+    ) -> None:
+        self.backend = backend
+        self.executor = executor
+        self.modifiers = 0
+        self.suppress = False
+        self._modifier_bits: dict[int, int] = {}
+        self._held_modifiers: dict[int, int] = {}
+        self._keys: dict[int, KeyHandler] = {}
+        # Routed the keys without a handler of their own, while a tool needs to see every key
+        self.fallback: t.Optional[KeyHandler] = None
+        self.hotkeys = chords.ChordMatcher(backend)
+        # Keys whose down event triggered a hotkey, so their up event is swallowed too
+        self._swallowed: set[int] = set()
+        self._lock = threading.Lock()
+        self._hook: t.Optional[t.Callable] = None
+        # Bumped whenever the hook is replaced, so a hook being replaced lets events through
+        self._generation = 0
+
+    def _resolve_modifiers(self) -> None:
+        bits = {}
+        for name, bit in MODIFIER_NAMES.items():
+            try:
+                for code in chords.scan_codes(name, self.backend):
+                    bits[code] = bit
+            except ValueError:
+                continue
+        self._modifier_bits = bits
+
+    def add_key_handler(self, key: t.Union[str, int], handler: KeyHandler) -> tuple[int, ...]:
+        """Route the events of a key to a handler, returning the scan codes routed."""
+        codes = chords.scan_codes(key, self.backend)
+        handler = latency.registry.timed(handler)
+        with self._lock:
+            self._keys = {**self._keys, **{code: handler for code in codes}}
+        return codes
+
+    def remove_key_handler(self, codes: t.Iterable[int]) -> None:
+        self.update_key_handlers({}, codes)
+
+    def update_key_handlers(
+        self, handlers: t.Mapping[int, KeyHandler], removed: t.Iterable[int] = ()
+    ) -> None:
+        """Route and unroute several scan codes at once, so no event sees half of the change."""
+        timed = {code: latency.registry.timed(handler) for code, handler in handlers.items()}
+        with self._lock:
+            keys = dict(self._keys)
+            for code in removed:
+                keys.pop(code, None)
+            keys.update(timed)
+            self._keys = keys
+
+    def add_hotkey(
+        self, hotkey: str, callback: t.Callable[[], None], policy: str = actions.QUEUE
+    ) -> list[chords.Chord]:
+        """
+        Run a callback off the hook when a hotkey is pressed, as per an action policy.
+
+        Returns a handle to remove the hotkey with. Raises chords.HotkeyConflict if another
+        hotkey already takes the same chord.
+        """
+        with self._lock:
+            self.hotkeys.check(hotkey)
+            self.executor.register(f"hotkey {hotkey}", callback, policy)
+            return self.hotkeys.add(hotkey)
+
+    def remove_hotkey(self, handle: t.Iterable[chords.Chord]) -> None:
+        with self._lock:
+            unused = self.hotkeys.remove(handle)
+        for hotkey in unused:
+            self.executor.unregister(f"hotkey {hotkey}")
+
+    def handle(self, event: keyboard.KeyboardEvent) -> bool:
+        """Route a keyboard event, returning whether it should be let through."""
+        code = event.scan_code
+        pressed = event.event_type == self.backend.KEY_DOWN
+
+        bit = self._modifier_bits.get(code)
+        if bit is not None:
+            if pressed:
+                self._held_modifiers[code] = bit
+            else:
+                self._held_modifiers.pop(code, None)
+            mask = 0
+            for held in self._held_modifiers.values():
+                mask |= held
+            self.modifiers = mask
+            return True
+
+        if pressed:
+            hotkey = self.hotkeys.match(self.modifiers, code)
+            if hotkey is not None:
+                self._swallowed.add(code)
+                self.executor.submit(f"hotkey {hotkey}")
+                return False
+        elif code in self._swallowed:
+            self._swallowed.discard(code)
+            return False
+
+        # Keypad keys share scan codes with extended keys, like numpad 0 and insert, and
+        # handlers are only ever routed the extended ones
+        if getattr(event, "is_keypad", False):
+            return True
+        handler = self._keys.get(code) or self.fallback
+        if handler is None:
+            return True
+        return handler(event, pressed, self.modifiers)
+
+    @property
+    def running(self) -> bool:
+        return self._hook is not None
+
+    def start(self, suppress: bool) -> None:
+        """
+        Install the hook, suppressing the events handlers ask to.
+
+        If the hook is already installed, the new one is installed before the old one is
+        removed, and only one of them handles each event, so none are missed or handled twice.
+        """
+        if not self._modifier_bits:
+            self._resolve_modifiers()
+        generation = self._generation + 1
+
+        def hook(event: keyboard.KeyboardEvent) -> bool:
+            if self._generation != generation:
+                return True
+            return self.handle(event)
+
+        installed = self.backend.hook(latency.registry.timed(hook, "hook"), suppress=suppress)
+        previous = self._hook
+        self._hook = installed
+        self.suppress = suppress
+        self._generation = generation
+        if previous is not None:
+            self.backend.unhook(previous)
+
+    def stop(self) -> None:
+        """Remove the hook, keeping the registered keys and hotkeys."""
+        self._generation += 1
+        if self._hook is not None:
+            self.backend.unhook(self._hook)
+            self._hook = None
+        self._held_modifiers.clear()
+        self._swallowed.clear()
+        self.modifiers = 0
+
+dispatcher = KeyDispatcher()
@@ -0,0 +1,125 @@
+"""A stand-in for the keyboard module, which captures output instead of sending it to the OS."""
+
+import typing as t
+
+KEY_DOWN = "down"
+KEY_UP = "up"
+
+# Scan set 1 codes of a US layout, extended keys share the code of their counterpart
+SCAN_CODES: dict[str, tuple[int, ...]] = {
+    **{letter: (code,) for letter, code in zip("qwertyuiop", range(16, 26))},
+    **{letter: (code,) for letter, code in zip("asdfghjkl", range(30, 39))},
+    **{letter: (code,) for letter, code in zip("zxcvbnm", range(44, 51))},
+    **{digit: (code,) for digit, code in zip("1234567890", range(2, 12))},
+    **{f"f{number}": (58 + number,) for number in range(1, 11)},
+    "f11": (87,),
+    "f12": (88,),
+    "esc": (1,),
+    "tab": (15,),
+    "enter": (28,),
+    "space": (57,),
+    "backspace": (14,),
+    "caps lock": (58,),
+    "ctrl": (29,),
+    "left ctrl": (29,),
+    "right ctrl": (29,),
+    "shift": (42, 54),
+    "left shift": (42,),
+    "right shift": (54,),
+    "alt": (56,),
+    "left alt": (56,),
+    "right alt": (56,),
+    "alt gr": (56,),
+    "left windows": (91,),
+    "right windows": (92,),
+    "insert": (82,),
+    "up": (72,),
+    "down": (80,),
+    "left": (75,),
+    "right": (77,),
+    # Keypad keys, reported with is_keypad set
+    "keypad 0": (82,),
+    "keypad 2": (80,),
+    "keypad 4": (75,),
+    "keypad 6": (77,),
+    "keypad 8": (72,),
+    # Media keys have no scan code of their own, these stand in for their virtual keys
+    "select media": (0x1ED,),
+    "volume down": (0x1AE,),
+    "volume up": (0x1AF,),
+    "volume mute": (0x1AD,),
+    "stop media": (0x1B2,),
+    "previous track": (0x1B1,),
+    "play/pause media": (0x1B3,),
+    "next track": (0x1B0,),
+    "start mail": (0x1B4,),
+    "browser start and home": (0x1AC,),
+    "start application 1": (0x1B6,),
+    "start application 2": (0x1B7,),
+}
+
+
+class KeyEvent(t.NamedTuple):
+    """The parts of a keyboard.KeyboardEvent the hooks use."""
+
+    event_type: str
+    scan_code: int
+    name: str
+    time: float = 0
+    is_keypad: bool = False
+
+
+class FakeKeyboard:
+    """
+    Delivers events to hooks like the keyboard module, recording what reaches the OS.
+
+    `output` holds (event type, scan code) for every event let through by the hooks, and
+    every key pressed or released by them, in order. `hook_operations` counts the hooks
+    installed and removed.
+    """
+
+    KEY_DOWN = KEY_DOWN
+    KEY_UP = KEY_UP
+
+    def __init__(self, scan_codes: t.Mapping[str, tuple[int, ...]] = SCAN_CODES) -> None:
+        self.scan_codes = scan_codes
+        self.hooks: list[tuple[t.Callable, bool]] = []
+        self.output: list[tuple[str, int]] = []
+        self.hook_operations = 0
+
+    def key_to_scan_codes(self, name: str) -> tuple[int, ...]:
+        try:
+            return self.scan_codes[name]
+        except KeyError:
+            raise ValueError(f"Key {name!r} is not mapped to any known key.") from None
+
+    def hook(self, callback: t.Callable, suppress: bool = False) -> t.Callable:
+        self.hooks.append((callback, suppress))
+        self.hook_operations += 1
+        return callback
+
+    def unhook(self, callback: t.Callable) -> None:
+        self.hooks = [(hook, suppress) for hook, suppress in self.hooks if hook is not callback]
+        self.hook_operations += 1
+
+    def press(self, scan_code: int) -> None:
+        self.output.append((KEY_DOWN, scan_code))
+
+    def release(self, scan_code: int) -> None:
+        self.output.append((KEY_UP, scan_code))
+
+    def event(self, event_type: str, name: str, time: float = 0) -> KeyEvent:
+        """Create an event for a key, reported with its first scan code."""
+        code = self.key_to_scan_codes(name)[0]
+        return KeyEvent(event_type, code, name, time, name.startswith("keypad "))
+
+    def feed(self, event: KeyEvent) -> bool:
+        """Deliver an event to the hooks, returning whether it reached the OS."""
+        passed = True
+        for hook, suppress in self.hooks:
+            if not hook(event) and suppress:
+                passed = False
+                break
+        if passed:
+            self.output.append((event.event_type, event.scan_code))
+        return passed
@@ -0,0 +1,165 @@
+"""
+Tools declare the hotkeys and keys they want, and a reconciler applies only what changed.
+
+Declaring or retracting doesn't touch the dispatcher until reconcile is called, which checks
+the whole declared state for conflicts first, then adds, removes and replaces the hotkeys
+and keys that differ from what's applied, and swaps the hook if the suppression changed.
+The hook is only installed while anything is declared.
+"""
+
+import threading
+import time
+import typing as t
+from winutils._helpers import actions, chords, dispatch, latency
+
+
+class KeyConflict(ValueError):
+    """Two tools declared the same key."""
+
+
+class Hotkey(t.NamedTuple):
+    callback: t.Callable[[], None]
+    policy: str = actions.QUEUE
+
+
+class Declaration(t.NamedTuple):
+    hotkeys: t.Mapping[str, Hotkey]
+    # Key names or scan codes, to the handler routed their events
+    keys: t.Mapping[t.Union[str, int], dispatch.KeyHandler]
+
+
+class Delta(t.NamedTuple):
+    """The operations applied by a reconciliation."""
+
+    added: int
+    removed: int
+    changed: int
+    rehooked: bool
+
+    @property
+    def operations(self) -> int:
+        return self.added + self.removed + self.changed + self.rehooked
+
+
+class HookRegistry:
+    """
+    The declared hooks of every tool, and the ones applied to a dispatcher.
+
+    Each reconciliation's time is recorded in latency.registry, under "reconcile".
+    """
+
+    def __init__(self, dispatcher: dispatch.KeyDispatcher = dispatch.dispatcher) -> None:
+        self.dispatcher = dispatcher
+        self.declarations: dict[str, Declaration] = {}
+        self.suppress = False
+        self.reconciliations = 0
+        self.operations = 0
+        self.reconcile_times = latency.registry.histogram("reconcile")
+        self._hotkeys: dict[str, Hotkey] = {}
+        self._handles: dict[str, list[chords.Chord]] = {}
+        self._keys: dict[int, dispatch.KeyHandler] = {}
+        self._lock = threading.RLock()
+
+    def declare(
+        self,
+        owner: str,
+        hotkeys: t.Optional[t.Mapping[str, Hotkey]] = None,
+        keys: t.Optional[t.Mapping[t.Union[str, int], dispatch.KeyHandler]] = None,
+    ) -> None:
+        """Replace everything an owner wants hooked."""
+        with self._lock:
+            self.declarations[owner] = Declaration(hotkeys or {}, keys or {})
+
+    def retract(self, owner: str) -> None:
+        with self._lock:
+            self.declarations.pop(owner, None)
+
+    def _desired(self) -> tuple[dict[str, Hotkey], dict[int, dispatch.KeyHandler]]:
+        """Merge the declarations, raising if any of them conflict."""
+        hotkeys: dict[str, Hotkey] = {}
+        keys: dict[int, dispatch.KeyHandler] = {}
+        key_owners: dict[int, str] = {}
+        for owner, declaration in self.declarations.items():
+            hotkeys.update(declaration.hotkeys)
+            for key, handler in declaration.keys.items():
+                for code in chords.scan_codes(key, self.dispatcher.backend):
+                    if code in key_owners and key_owners[code] != owner:
+                        raise KeyConflict(
+                            f"{owner} and {key_owners[code]} both declared scan code {code}."
+                        )
+                    key_owners[code] = owner
+                    keys[code] = handler
+
+        declared = [hotkey for d in self.declarations.values() for hotkey in d.hotkeys]
+        conflicts = chords.find_conflicts(declared, self.dispatcher.backend)
+        if conflicts:
+            first, second = conflicts[0]
+            raise chords.HotkeyConflict(f"{first!r} conflicts with {second!r}.")
+        return hotkeys, keys
+
+    def _apply(
+        self, hotkeys: dict[str, Hotkey], keys: dict[int, dispatch.KeyHandler]
+    ) -> tuple[int, int, int]:
+        """Bring the dispatcher's hotkeys and keys in line, returning the operations made."""
+        added = removed = changed = 0
+        for hotkey in self._hotkeys.keys() - hotkeys.keys():
+            self.dispatcher.remove_hotkey(self._handles.pop(hotkey))
+            del self._hotkeys[hotkey]
+            removed += 1
+        for hotkey, wanted in hotkeys.items():
+            applied = self._hotkeys.get(hotkey)
+            if applied == wanted:
+                continue
+            if applied is None:
+                self._handles[hotkey] = self.dispatcher.add_hotkey(hotkey, *wanted)
+                added += 1
+            else:
+                self.dispatcher.executor.register(f"hotkey {hotkey}", *wanted)
+                changed += 1
+            self._hotkeys[hotkey] = wanted
+
+        unrouted = self._keys.keys() - keys.keys()
+        routed = {
+            code: handler for code, handler in keys.items() if self._keys.get(code) != handler
+        }
+        if unrouted or routed:
+            self.dispatcher.update_key_handlers(routed, unrouted)
+            added += len(routed.keys() - self._keys.keys())
+            changed += len(routed.keys() & self._keys.keys())
+            removed += len(unrouted)
+            self._keys = keys
+        return added, removed, changed
+
+    def reconcile(self) -> Delta:
+        """Apply the difference between the declared and applied hooks."""
+        with self._lock:
+            started = time.perf_counter_ns()
+            hotkeys, keys = self._desired()
+            wanted = bool(hotkeys or keys)
+            rehooked = wanted != self.dispatcher.running or (
+                wanted and self.dispatcher.suppress != self.suppress
+            )
+            # Handlers added for suppression shouldn't see events the old hook can't suppress,
+            # and handlers removed with it shouldn't see events the new hook won't suppress
+            if rehooked and wanted and self.suppress:
+                self.dispatcher.start(self.suppress)
+            added, removed, changed = self._apply(hotkeys, keys)
+            if rehooked and not wanted:
+                self.dispatcher.stop()
+            elif rehooked and not self.suppress:
+                self.dispatcher.start(self.suppress)
+
+            delta = Delta(added, removed, changed, rehooked)
+            self.reconciliations += 1
+            self.operations += delta.operations
+            self.reconcile_times.record(time.perf_counter_ns() - started)
+            return delta
+
+    def report(self) -> str:
+        return (
+            f"Reconciliations: {self.reconciliations}, hook operations: {self.operations}, "
+            f"p99 reconcile time: {self.reconcile_times.percentile(99) / 1e6:.3f}ms"
+        )
+
+
+registry = HookRegistry()
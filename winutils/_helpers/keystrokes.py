@@ -1,15 +1,8 @@
-import keyboard
-import time
+"""Keystrokes recorded from typing, to be replayed."""
 
-from comtypes import CLSCTX_ALL
-from pycaw.pycaw import IAudioEndpointVolume
-from pycaw.utils import AudioUtilities
-import msvcrt
-
-
-# raw_events = [(e.event_type, e.scan_code, e.name, e.time, e.device, e.modifiers, e.is_keypad) for e in keyboard.record(until='esc')]
-# print(raw_events)
-raw_events = [
+# RECORDED_EVENTS = [(e.event_type, e.scan_code, e.name, e.time, e.device, e.modifiers, e.is_keypad) for e in keyboard.record(until='esc')]
+# print(RECORDED_EVENTS)
+RECORDED_EVENTS = [
     ("down", 35, "h", 1694795381.222214, None, None, False),
     ("up", 35, "h", 1694795381.2819862, None, None, False),
     ("down", 23, "i", 1694795381.322605, None, None, False),
@@ -54,71 +47,3 @@ raw_events = [
     ("up", 31, "s", 1694795382.9988995, None, None, False),
     ("down", 1, "esc", 1694795383.1262157, None, None, False),
 ]
-events = [keyboard.KeyboardEvent(*args) for args in raw_events]
-
-
-def alt_tab():
-    """Press and release alt+tab and then wait for a bit"""
-    keyboard.press_and_release("alt+tab")
-    time.sleep(0.1)
-
-
-volume_set = {10: 100, 20: 68, 30: 34, 40: 24, 50: 16, 60: 12, 70: 10, 80: 8, 90: 6, 100: 5}
-volume_set = {step: max(0, min(100, volume * 0.5)) for step, volume in volume_set.items()}
-
-
-devices = AudioUtilities.GetSpeakers()
-interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-volume = interface.QueryInterface(IAudioEndpointVolume)
-
-for session in AudioUtilities.GetAllSessions():
-    if session.Process and session.Process.name() == "MechvibesPlusPlus.exe":
-        break
-else:
-    raise RuntimeError("Could not find a MechvibesPlusPlus.exe session.")
-
-print("CONTROLS: W: 10%+ S: 10%- || A: 2%- D: 2%+ || Z: 1%- X: 1%+")
-
-
-try:
-    while True:
-        for step in [50, 40, 60, 30, 70, 20, 80, 10, 90, 100]:
-            volume.SetMasterVolumeLevelScalar(step / 100, None)
-            app_volume = volume_set.get(step, 100 - step)
-            print(f"System volume: {step}%")
-
-            while True:
-                session.SimpleAudioVolume.SetMasterVolume(app_volume / 100, None)
-                print(f"App volume: {app_volume}%", end="\r")
-
-                alt_tab()
-                keyboard.play(events)
-                alt_tab()
-
-                adjustment = msvcrt.getch().decode().lower()
-                # adjustment = input().lower()
-                if adjustment == "c":
-                    volume_set[step] = app_volume
-                    print()
-                    break
-
-                if adjustment == "w":
-                    app_volume += 10
-                elif adjustment == "s":
-                    app_volume -= 10
-                elif adjustment == "a":
-                    app_volume -= 2
-                elif adjustment == "d":
-                    app_volume += 2
-                elif adjustment == "z":
-                    app_volume -= 1
-                elif adjustment == "x":
-                    app_volume += 1
-
-                app_volume = max(0, min(100, app_volume))
-
-        print("--- Current Volumes ---")
-        for step, app_volume in volume_set.items():
-            print(f"{step}%: {app_volume}%")
-except KeyboardInterrupt:
-    print(volume_set)
@@ -0,0 +1,144 @@
+"""Always-on latency histograms for keyboard hook handlers."""
+
+import array
+import functools
+import pathlib
+import threading
+import time
+import typing as t
+
+# Windows removes low-level hooks whose callbacks take longer than this (LowLevelHooksTimeout)
+HOOK_TIMEOUT_NS = 300_000_000
+# Handlers whose p99 exceeds this fraction of the timeout are flagged
+WARNING_FRACTION = 0.5
+# Each power of two is split into this many linear buckets (as a power of two)
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Durations from 2**MIN_EXPONENT ns (~1µs) up to 2**MAX_EXPONENT ns (~17s) are told apart
+MIN_EXPONENT = 10
+MAX_EXPONENT = 34
+# The first group holds every value below 2**MIN_EXPONENT
+BUCKET_COUNT = (MAX_EXPONENT - MIN_EXPONENT + 2) * SUB_BUCKETS
+
+
+def bucket_index(value: int) -> int:
+    """Find the bucket of a duration in nanoseconds."""
+    exponent = value.bit_length() - 1
+    if exponent < MIN_EXPONENT:
+        return value >> (MIN_EXPONENT - SUB_BUCKET_BITS)
+    if exponent > MAX_EXPONENT:
+        return BUCKET_COUNT - 1
+    sub_bucket = (value >> (exponent - SUB_BUCKET_BITS)) - SUB_BUCKETS
+    return (exponent - MIN_EXPONENT + 1) * SUB_BUCKETS + sub_bucket
+
+
+def bucket_upper_bound(index: int) -> int:
+    """Find the largest duration in nanoseconds counted in a bucket."""
+    group, sub_bucket = divmod(index, SUB_BUCKETS)
+    if group == 0:
+        return ((sub_bucket + 1) << (MIN_EXPONENT - SUB_BUCKET_BITS)) - 1
+    exponent = group + MIN_EXPONENT - 1
+    return ((SUB_BUCKETS + sub_bucket + 1) << (exponent - SUB_BUCKET_BITS)) - 1
+
+
+class Histogram:
+    """
+    A fixed-bucket log-linear histogram of durations in nanoseconds.
+
+    Buckets are at most 1/8 of their value wide, so percentiles are accurate to ~12.5%.
+    Recording only increments preallocated counters.
+    """
+
+    def __init__(self) -> None:
+        self.counts = array.array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        """Find an upper bound of a percentile (0-100) of the durations, in nanoseconds."""
+        if not self.count:
+            return 0
+        threshold = self.count * percentile / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(bucket_upper_bound(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class LatencyRegistry:
+    """Holds a histogram per handler name, and reports on them."""
+
+    def __init__(self, budget: int = HOOK_TIMEOUT_NS) -> None:
+        self.budget = budget
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        """Get the histogram of a handler, creating it if needed."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def timed(self, function: t.Callable, name: t.Optional[str] = None) -> t.Callable:
+        """Wrap a function to record how long each call takes, under its name by default."""
+        histogram = self.histogram(name or function.__qualname__)
+        perf_counter_ns = time.perf_counter_ns
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.record(perf_counter_ns() - started)
+
+        return wrapper
+
+    def is_at_risk(self, histogram: Histogram) -> bool:
+        """Find whether a handler's p99 is close to the hook timeout."""
+        return histogram.percentile(99) >= self.budget * WARNING_FRACTION
+
+    def at_risk(self) -> list[str]:
+        with self._lock:
+            histograms = dict(self.histograms)
+        return [name for name, histogram in histograms.items() if self.is_at_risk(histogram)]
+
+    def report(self) -> str:
+        """Summarise every handler's latencies in milliseconds, flagging those at risk."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        lines = [
+            f"Hook timeout budget: {self.budget / 1e6:.0f}ms, "
+            f"flagged above {self.budget * WARNING_FRACTION / 1e6:.0f}ms at p99",
+            f"{'handler':<40} {'count':>8} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}",
+        ]
+        for name, histogram in histograms:
+            values = [histogram.mean] + [histogram.percentile(p) for p in (50, 90, 99)]
+            values.append(histogram.max)
+            flag = "  AT RISK" if self.is_at_risk(histogram) else ""
+            columns = " ".join(f"{value / 1e6:>9.3f}" for value in values)
+            lines.append(f"{name:<40} {histogram.count:>8} {columns}{flag}")
+        return "\n".join(lines)
+
+    def dump(self, path: pathlib.Path) -> None:
+        """Write the report to a file."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.report() + "\n", encoding="utf-8")
+
+
+registry = LatencyRegistry()
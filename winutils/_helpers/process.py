@@ -1,8 +1,12 @@
 import subprocess
 import pathlib
+import time
+import typing as t
 from winutils._helpers import path
 import shlex
 
+FLUSH_INTERVAL = 1
+
 VIEW_COMMAND_BASE = [
     "wt",
     "--window",
@@ -17,12 +21,27 @@ VIEW_COMMAND_BASE = [
 ]
 
 
-def sync_process_output(process: subprocess.Popen, file: pathlib.Path) -> None:
-    """Sync the outputs of the process with a file."""
+def sync_process_output(
+    process: subprocess.Popen,
+    file: pathlib.Path,
+    on_line: t.Optional[t.Callable[[bytes], None]] = None,
+    flush_interval: float = FLUSH_INTERVAL,
+) -> None:
+    """
+    Sync the outputs of the process with a file, optionally passing each line to a callback.
+
+    Writes are buffered, and flushed at most once every flush_interval seconds.
+    """
+    last_flush = time.monotonic()
     with open(file, "wb") as f:
         for line in process.stdout:
             f.write(line)
-            f.flush()
+            if on_line is not None:
+                on_line(line)
+            now = time.monotonic()
+            if now - last_flush >= flush_interval:
+                f.flush()
+                last_flush = now
 
 
 def spawn_output_view_terminal(file: pathlib.Path) -> subprocess.Popen:
@@ -0,0 +1,196 @@
+"""
+One scheduler thread running every delayed call, instead of a thread per timer.
+
+Timers are kept in a heap by deadline. Callbacks run on the scheduler thread one at a time,
+so they should be short, or hand longer work off. How late each timer fires is recorded in
+latency.registry, under "timer jitter".
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import typing as t
+from winutils._helpers import latency
+
+Callback = t.Callable[[], None]
+
+
+class TimerHandle:
+    """A scheduled call, which can be cancelled until it runs."""
+
+    def __init__(self, deadline: float, callback: Callback, interval: t.Optional[float]) -> None:
+        self.deadline = deadline
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs callbacks at their deadlines, on a thread started with the first timer."""
+
+    def __init__(self, name: str = "timers") -> None:
+        self.name = name
+        self.fired = 0
+        self.jitter = latency.registry.histogram("timer jitter")
+        self._heap: list[tuple[float, int, TimerHandle]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: t.Optional[threading.Thread] = None
+
+    def _push(self, handle: TimerHandle) -> None:
+        with self._condition:
+            heapq.heappush(self._heap, (handle.deadline, next(self._sequence), handle))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+                self._thread.start()
+            elif self._heap[0][2] is handle:
+                self._condition.notify()
+
+    def call_later(self, delay: float, callback: Callback) -> TimerHandle:
+        handle = TimerHandle(time.monotonic() + delay, callback, None)
+        self._push(handle)
+        return handle
+
+    def call_every(self, interval: float, callback: Callback) -> TimerHandle:
+        """Call a callback every interval, without drifting, until the handle is cancelled."""
+        handle = TimerHandle(time.monotonic() + interval, callback, interval)
+        self._push(handle)
+        return handle
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, handle = heapq.heappop(self._heap)
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._condition.wait(timeout)
+            if handle.cancelled:
+                continue
+
+            self.jitter.record(int((now - handle.deadline) * 1e9))
+            self.fired += 1
+            try:
+                handle.callback()
+            except Exception:
+                traceback.print_exc()
+            if handle.interval is not None and not handle.cancelled:
+                # Skips calls missed while the callback overran, rather than bunching them up
+                handle.deadline = max(handle.deadline + handle.interval, time.monotonic())
+                self._push(handle)
+
+    @property
+    def pending(self) -> int:
+        with self._condition:
+            return sum(not handle.cancelled for _, _, handle in self._heap)
+
+    def debounce(self, delay: float, callback: Callback) -> Callback:
+        """Return a function calling a callback once calls to it stop for a delay."""
+        return Debounced(self, delay, callback)
+
+    def throttle(self, interval: float, callback: Callback) -> Callback:
+        """
+        Return a function calling a callback at most once an interval.
+
+        The first call runs straight away, and calls made within the interval are merged
+        into one at its end.
+        """
+        return Throttled(self, interval, callback)
+
+    def coalesce(self, delay: float, callback: Callback) -> Callback:
+        """Return a function calling a callback a delay after the first of a burst of calls."""
+        return Coalesced(self, delay, callback)
+
+
+class Debounced:
+    """A callback which runs once calls stop for a delay."""
+
+    def __init__(self, scheduler: Scheduler, delay: float, callback: Callback) -> None:
+        self.scheduler = scheduler
+        self.delay = delay
+        self.callback = callback
+        self.calls = 0
+        self._deadline = 0.0
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self._deadline = time.monotonic() + self.delay
+            # A pending timer is pushed back when it fires, rather than being replaced
+            if not self._scheduled:
+                self._scheduled = True
+                self.scheduler.call_later(self.delay, self._fire)
+
+    def _fire(self) -> None:
+        with self._lock:
+            remaining = self._deadline - time.monotonic()
+            if remaining > 0:
+                self.scheduler.call_later(remaining, self._fire)
+                return
+            self._scheduled = False
+        self.callback()
+
+
+class Throttled:
+    """A callback which runs at most once an interval, on the leading and trailing edges."""
+
+    def __init__(self, scheduler: Scheduler, interval: float, callback: Callback) -> None:
+        self.scheduler = scheduler
+        self.interval = interval
+        self.callback = callback
+        self.calls = 0
+        self._last_run = -float("inf")
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> None:
+        with self._lock:
+            self.calls += 1
+            if self._scheduled:
+                return
+            self._scheduled = True
+            delay = max(0, self._last_run + self.interval - time.monotonic())
+            self.scheduler.call_later(delay, self._fire)
+
+    def _fire(self) -> None:
+        with self._lock:
+            self._scheduled = False
+            self._last_run = time.monotonic()
+        self.callback()
+
+
+class Coalesced:
+    """A callback which runs a delay after the first call of a burst, once for the burst."""
+
+    def __init__(self, scheduler: Scheduler, delay: float, callback: Callback) -> None:
+        self.scheduler = scheduler
+        self.delay = delay
+        self.callback = callback
+        self.calls = 0
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> None:
+        with self._lock:
+            self.calls += 1
+            if self._scheduled:
+                return
+            self._scheduled = True
+            self.scheduler.call_later(self.delay, self._fire)
+
+    def _fire(self) -> None:
+        with self._lock:
+            self._scheduled = False
+        self.callback()
+
+
+scheduler = Scheduler()
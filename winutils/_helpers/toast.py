@@ -1,9 +1,13 @@
 import asyncio
 import typing as t
-import win11toast
 import threading
 from winutils._helpers.path import ICON_DIR
 
+try:
+    import win11toast
+except ImportError:  # Not on Windows, toasts aren't shown
+    win11toast = None
+
 # Global
 toast_future: t.Optional[asyncio.Handle] = None
 
@@ -18,6 +22,8 @@ def get_icon(icon_name):
 def show_toast(title, body, icon=None):
     """Show a toast notification."""
     global toast_future
+    if win11toast is None:
+        return
     if toast_future:
         toast_future.cancel()
 
@@ -1,5 +1,8 @@
 import keyboard
+from winutils._helpers import hooks
 from winutils.fn_lock import core
 
-keyboard.hook(core.handle_events, suppress=True)
+core.declare()
+hooks.registry.suppress = True
+hooks.registry.reconcile()
 keyboard.wait()
@@ -0,0 +1,192 @@
+"""
+Replays keystrokes through fn-lock and the hotkey routing, with a fake keyboard backend.
+
+Streams are the recorded typing in _helpers.keystrokes, or synthetic mixes of typing,
+function keys (with and without insert held) and hotkey chords. The output captured by the
+fake backend is compared with what fn-lock should produce, and the per-event latency is
+reported. Runs headless, on any platform:
+
+    python -m winutils.fn_lock.benchmark --events 100000
+"""
+
+import argparse
+import collections
+import json
+import pathlib
+import random
+import string
+import time
+import typing as t
+from winutils._helpers import dispatch, fake_keyboard, hooks, keystrokes, latency
+from winutils.fn_lock import core
+
+# The hotkeys routed by the utility manager, besides fn-lock's
+UTILITY_HOTKEYS = [
+    "ctrl+alt+shift+c",
+    "ctrl+alt+shift+r",
+    "ctrl+alt+shift+t",
+    "ctrl+shift+alt+up",
+    "ctrl+shift+alt+down",
+    "ctrl+shift+alt+right",
+    "ctrl+shift+alt+left",
+]
+MODIFIER_KEYS = {"ctrl", "shift", "alt"}
+FUNCTION_KEYS = list(core.FN_KEY_MAPPING)
+# Keypad keys sharing scan codes with insert and the arrows, which fn lock mustn't take
+KEYPAD_KEYS = ["keypad 0", "keypad 2", "keypad 4", "keypad 6", "keypad 8"]
+HOTKEY_WAIT = 5
+
+Stream = list[tuple[str, str]]
+
+
+def recorded_stream(count: int) -> Stream:
+    """Repeat the recorded keystrokes until there are at least count events."""
+    events = [(event_type, name) for event_type, _, name, *_ in keystrokes.RECORDED_EVENTS]
+    repeats = -(-count // len(events))
+    return events * repeats
+
+
+def synthetic_stream(count: int, seed: int = 0) -> Stream:
+    """Create a mix of typing, function keys, fn-held function keys and hotkey chords."""
+    rng = random.Random(seed)
+    events: Stream = []
+
+    def tap(name: str) -> None:
+        events.extend([("down", name), ("up", name)])
+
+    while len(events) < count:
+        kind = rng.random()
+        if kind < 0.7:
+            tap(rng.choice(string.ascii_lowercase))
+        elif kind < 0.85:
+            tap(rng.choice(FUNCTION_KEYS))
+        elif kind < 0.88:
+            tap(rng.choice(KEYPAD_KEYS))
+        elif kind < 0.92:
+            events.append(("down", "insert"))
+            tap(rng.choice(FUNCTION_KEYS + KEYPAD_KEYS))
+            events.append(("up", "insert"))
+        else:
+            *modifiers, key = rng.choice(UTILITY_HOTKEYS).split("+")
+            events.extend(("down", modifier) for modifier in modifiers)
+            tap(key)
+            events.extend(("up", modifier) for modifier in reversed(modifiers))
+    return events
+
+
+def expected_output(
+    stream: Stream, backend: fake_keyboard.FakeKeyboard
+) -> tuple[list[tuple[str, int]], int]:
+    """
+    Work out what should reach the OS for a stream, and how many hotkeys should fire.
+
+    This follows the documented behaviour by key name, independently of the dispatcher.
+    """
+    chords = {}
+    for hotkey in UTILITY_HOTKEYS:
+        *modifiers, key = hotkey.split("+")
+        chords[frozenset(modifiers), key] = hotkey
+
+    output = []
+    held: set[str] = set()
+    swallowed: set[str] = set()
+    insert_held = False
+    fired = 0
+    for event_type, name in stream:
+        code = backend.key_to_scan_codes(name)[0]
+        pressed = event_type == "down"
+        if name in MODIFIER_KEYS:
+            if pressed:
+                held.add(name)
+            else:
+                held.discard(name)
+            output.append((event_type, code))
+        elif pressed and (frozenset(held), name) in chords:
+            swallowed.add(name)
+            fired += 1
+        elif not pressed and name in swallowed:
+            swallowed.discard(name)
+        elif name == "insert":
+            insert_held = pressed
+        elif name in core.FN_KEY_MAPPING and not insert_held:
+            target = backend.key_to_scan_codes(core.FN_KEY_MAPPING[name])[0]
+            output.append((event_type, target))
+        else:
+            output.append((event_type, code))
+    return output, fired
+
+
+def replay(name: str, stream: Stream) -> dict[str, t.Any]:
+    """Replay a stream through a fresh dispatcher, and check and time its output."""
+    backend = fake_keyboard.FakeKeyboard()
+    dispatcher = dispatch.KeyDispatcher(backend)
+    registry = hooks.HookRegistry(dispatcher)
+    fired = collections.Counter()
+    registry.declare(
+        "benchmark",
+        hotkeys={
+            hotkey: hooks.Hotkey(lambda hotkey=hotkey: fired.update([hotkey]))
+            for hotkey in UTILITY_HOTKEYS
+        },
+    )
+    core.State.enabled = True
+    core.declare(registry)
+    registry.suppress = True
+    registry.reconcile()
+
+    events = [backend.event(event_type, key) for event_type, key in stream]
+    histogram = latency.Histogram()
+    perf_counter_ns = time.perf_counter_ns
+    started = perf_counter_ns()
+    for event in events:
+        event_started = perf_counter_ns()
+        backend.feed(event)
+        histogram.record(perf_counter_ns() - event_started)
+    elapsed = perf_counter_ns() - started
+
+    output, expected_fired = expected_output(stream, backend)
+    deadline = time.monotonic() + HOTKEY_WAIT
+    while sum(fired.values()) < expected_fired and time.monotonic() < deadline:
+        time.sleep(0.01)
+    core.retract(registry)
+    registry.retract("benchmark")
+    registry.reconcile()
+
+    mismatches = sum(actual != expected for actual, expected in zip(backend.output, output))
+    mismatches += abs(len(backend.output) - len(output))
+    return {
+        "stream": name,
+        "events": len(events),
+        "events_per_second": len(events) / (elapsed / 1e9),
+        "p50_us": histogram.percentile(50) / 1e3,
+        "p99_us": histogram.percentile(99) / 1e3,
+        "max_us": histogram.max / 1e3,
+        "hotkeys_fired": sum(fired.values()),
+        "hotkeys_expected": expected_fired,
+        "mismatches": mismatches,
+        "correct": not mismatches and sum(fired.values()) == expected_fired,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=100_000, help="events per stream")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic stream")
+    parser.add_argument("--output", type=pathlib.Path, help="JSON file, stdout if omitted")
+    arguments = parser.parse_args()
+
+    results = [
+        replay("recorded", recorded_stream(arguments.events)),
+        replay("synthetic", synthetic_stream(arguments.events, arguments.seed)),
+    ]
+    output = json.dumps(results, indent=2)
+    if arguments.output is None:
+        print(output)
+    else:
+        arguments.output.write_text(output + "\n")
+    if not all(result["correct"] for result in results):
+        raise SystemExit("The replayed output didn't match the expected output.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 """The core functionality for handling key presses."""
 
+import typing as t
 import keyboard
-from winutils._helpers import toast
+from winutils._helpers import hooks, toast
+from winutils.fn_lock import keymap
 
 ICON_NAME = "function.ico"
+TOGGLE_HOTKEY = "ctrl+alt+insert"
 FN_KEY_MAPPING = {
     "f1": "select media",
     "f2": "volume down",
@@ -20,13 +23,51 @@ FN_KEY_MAPPING = {
 }
 
 
+# Function keys send their media keys while fn-lock is enabled, unless insert is held
+DEFAULT_KEYMAP = {
+    "layers": [
+        {"name": keymap.TOGGLED_LAYER, "keys": FN_KEY_MAPPING},
+        {"name": "fn", "keys": {key: None for key in FN_KEY_MAPPING}},
+    ],
+    "holds": {"insert": "fn"},
+}
+DEFAULT_KEYMAP_CASES = [
+    {
+        "name": "remapped when enabled",
+        "events": [["down", "f7"], ["up", "f7"]],
+        "expect": [["down", "play/pause media"], ["up", "play/pause media"]],
+    },
+    {
+        "name": "untouched when disabled",
+        "enabled": False,
+        "events": [["down", "f7"], ["up", "f7"]],
+        "expect": [["down", "f7"], ["up", "f7"]],
+    },
+    {
+        "name": "untouched while insert is held",
+        "events": [["down", "insert"], ["down", "f2"], ["up", "f2"], ["up", "insert"]],
+        "expect": [["down", "f2"], ["up", "f2"]],
+    },
+    {
+        "name": "released as pressed",
+        "events": [["down", "f3"], ["down", "insert"], ["up", "f3"], ["up", "insert"]],
+        "expect": [["down", "volume up"], ["up", "volume up"]],
+    },
+    {
+        "name": "other keys untouched",
+        "events": [["down", "a"], ["up", "a"]],
+        "expect": [["down", "a"], ["up", "a"]],
+    },
+]
+
+
 class State:
     """Holds application global state."""
 
     enabled = True
-    insert_held = False
-    ctrl_held = False
-    alt_held = False
+    active_keymap: dict = DEFAULT_KEYMAP
+    engine: t.Optional[keymap.KeymapEngine] = None
+    registry: t.Optional[hooks.HookRegistry] = None
 
 
 def toggle_enabled():
@@ -38,34 +79,61 @@ def toggle_enabled():
     )
 
 
-def handle_events(e):
-    """
-    Handle keypresses and releases to emulate fn-lock behaviour.
+def handle_key(e: keyboard.KeyboardEvent, pressed: bool, modifiers: int) -> bool:
+    """Step the keymap, which only remaps keys while fn-lock is enabled or a layer is held."""
+    engine = State.engine
+    passed = engine.step(e.scan_code, pressed, modifiers, State.enabled, e.time)
+    registry = State.registry
+    if registry is not None:
+        # Any key pressed while a tap-hold key is pending decides it's held
+        registry.dispatcher.fallback = handle_key if engine.pending_tap is not None else None
+    return passed
+
+
+def show_keymap_error(error: ValueError) -> None:
+    """Notify the user a keymap wasn't loaded, and the current one is kept."""
+    toast.show_toast("Keymap not loaded.", str(error), toast.get_icon(ICON_NAME))
+
 
-    If fn-lock is enabled, the function keys will be remapped to their
-    media key counterparts, unless the insert key is held.
+def invoke_toggle() -> None:
+    # Looked up on each press, as toggle_enabled may be reassigned
+    toggle_enabled()
+
+
+def declare(registry: hooks.HookRegistry = hooks.registry) -> None:
+    """
+    Declare the keys of the keymap as routed to fn-lock, once the registry is reconciled.
 
     ctrl+alt+insert will toggle the enabled state.
     """
-    pressed = e.event_type == keyboard.KEY_DOWN
-
-    if e.name == "insert":
-        State.insert_held = pressed
-        if State.alt_held and State.ctrl_held and State.insert_held:
-            toggle_enabled()
-        return False
-    if e.name == "ctrl":
-        State.ctrl_held = pressed
-    elif e.name == "alt":
-        State.alt_held = pressed
-
-    if State.enabled and e.name in FN_KEY_MAPPING and not State.insert_held:
-        target = FN_KEY_MAPPING[e.name]
+    State.registry = registry
+    engine = State.engine
+    # Reloaded in place, so keys held across the reload still release what they sent
+    if engine is not None and engine.backend is registry.dispatcher.backend:
+        engine.load(State.active_keymap)
     else:
-        return True
+        State.engine = keymap.KeymapEngine(State.active_keymap, registry.dispatcher.backend)
+    registry.dispatcher.fallback = None
+    registry.declare(
+        "fn lock",
+        hotkeys={TOGGLE_HOTKEY: hooks.Hotkey(invoke_toggle)},
+        keys={code: handle_key for code in State.engine.compiled.codes},
+    )
+
+
+def retract(registry: hooks.HookRegistry = hooks.registry) -> None:
+    """Let the keys of the keymap through untouched, once the registry is reconciled."""
+    registry.retract("fn lock")
+    registry.dispatcher.fallback = None
+    State.registry = None
+
 
-    if pressed:
-        keyboard.press(target)
-    elif e.event_type == keyboard.KEY_UP:
-        keyboard.release(target)
-    return False
+def load_keymap(new_keymap: dict) -> None:
+    """Switch to a new keymap, taking effect immediately if fn-lock is declared."""
+    registry = State.registry
+    # Checked before switching, so an invalid keymap leaves the current one in place
+    keymap.compile_keymap(new_keymap, registry.dispatcher.backend if registry else keyboard)
+    State.active_keymap = new_keymap
+    if registry is not None:
+        declare(registry)
+        registry.reconcile()
@@ -0,0 +1,369 @@
+"""
+A layered keymap, compiled into a flat transition table.
+
+A keymap is a JSON object of ordered layers, keys which activate a layer while held, and
+tap-hold keys which send a key when tapped but activate a layer when held:
+
+    {
+        "layers": [
+            {"name": "fn-lock", "keys": {"f7": "play/pause media", "ctrl+f7": "next track"}},
+            {"name": "fn", "keys": {"f7": null}}
+        ],
+        "holds": {"insert": "fn"},
+        "taps": {"caps lock": {"tap": "esc", "hold": "fn"}}
+    }
+
+Later layers take precedence over earlier ones. A key maps to the key to send instead, or
+null to send itself, which hides the layers below. Chords like "ctrl+f7" only match when
+exactly those modifiers are held, and take precedence over the plain key in their layer.
+The layer named "fn-lock" is active while fn-lock is enabled, others while they're held.
+
+Cases to check a keymap headlessly are JSON lists of objects like:
+
+    {"name": "f7 plays", "enabled": true, "events": [["down", "f7"], ["up", "f7"]],
+     "expect": [["down", "play/pause media"], ["up", "play/pause media"]]}
+
+with an optional event time in seconds as the third element of an event, and are run with
+
+    python -m winutils.fn_lock.keymap [--keymap keymap.json] [cases.json]
+
+which also checks MALFORMED_KEYMAPS are rejected with a KeymapError.
+"""
+
+import argparse
+import json
+import pathlib
+import traceback
+import typing as t
+from winutils._helpers import chords, dispatch, fake_keyboard, timers
+
+TOGGLED_LAYER = "fn-lock"
+MAX_LAYERS = 4
+# Scan codes at or above this aren't routed through the keymap
+TABLE_WIDTH = 512
+MODIFIER_STATES = 16
+# Tap-hold keys released within this many seconds, with no other key pressed, are taps
+TAP_TIMEOUT = 0.2
+WATCH_INTERVAL = 1
+
+# Kinds of table entries, which are (kind, value) tuples or None to let the key through
+REMAP = 0
+PASS = 1
+HOLD = 2
+TAP = 3
+NOTHING_SENT = -1
+
+# Valid JSON of the wrong shape, which compiling should reject with a KeymapError
+MALFORMED_KEYMAPS = [
+    [],
+    {"layers": "abc"},
+    {"layers": [{"name": "x", "keys": []}]},
+    {"layers": [{"name": ["x"], "keys": {}}]},
+    {"holds": ["insert"]},
+    {"taps": {"caps lock": "esc"}},
+]
+
+
+class KeymapError(ValueError):
+    """A keymap couldn't be compiled."""
+
+
+class CompiledKeymap(t.NamedTuple):
+    """A keymap as a flat table indexed by (layer state, modifier mask, scan code)."""
+
+    table: list[t.Optional[tuple[int, int]]]
+    # (tap scan code, layer bit) of each tap-hold key, indexed by their TAP entries
+    taps: list[tuple[int, int]]
+    toggled_bit: int
+    codes: tuple[int, ...]
+
+
+def table_index(state: int, modifiers: int, code: int) -> int:
+    return (state * MODIFIER_STATES + modifiers) * TABLE_WIDTH + code
+
+
+def compile_keymap(keymap: dict, backend: t.Any = chords.keyboard) -> CompiledKeymap:
+    """Resolve every key name in a keymap to scan codes, and fill the transition table."""
+    try:
+        layers = keymap.get("layers", [])
+        if len(layers) > MAX_LAYERS:
+            raise KeymapError(f"At most {MAX_LAYERS} layers are supported.")
+        bits = {layer["name"]: 1 << number for number, layer in enumerate(layers)}
+
+        # Per layer, (modifier mask or None for any, scan code): entry
+        layer_entries: list[dict[tuple[t.Optional[int], int], tuple[int, int]]] = []
+        for layer in layers:
+            entries = {}
+            for source, target in layer["keys"].items():
+                if "+" in source:
+                    mask, codes = chords.parse_hotkey(source, backend)
+                else:
+                    mask, codes = None, chords.scan_codes(source, backend)
+                if target is None:
+                    entry = (PASS, 0)
+                else:
+                    entry = (REMAP, chords.scan_codes(target, backend)[0])
+                for code in codes:
+                    entries[mask, code] = entry
+            layer_entries.append(entries)
+
+        global_entries = {}
+        for key, layer in keymap.get("holds", {}).items():
+            for code in chords.scan_codes(key, backend):
+                global_entries[code] = (HOLD, bits[layer])
+        taps = []
+        for key, tap in keymap.get("taps", {}).items():
+            tap_code = chords.scan_codes(tap["tap"], backend)[0]
+            for code in chords.scan_codes(key, backend):
+                global_entries[code] = (TAP, len(taps))
+            taps.append((tap_code, bits[tap["hold"]]))
+    except KeyError as error:
+        raise KeymapError(f"Unknown or missing {error} in the keymap.") from None
+    except (TypeError, AttributeError):  # A value of the wrong JSON type
+        raise KeymapError("The keymap isn't shaped as described in keymap.py.") from None
+
+    codes = {code for entries in layer_entries for _, code in entries} | set(global_entries)
+    if any(code >= TABLE_WIDTH for code in codes):
+        raise KeymapError(f"Only keys with scan codes below {TABLE_WIDTH} can be mapped.")
+
+    states = 1 << len(layers)
+    table: list[t.Optional[tuple[int, int]]] = [None] * (states * MODIFIER_STATES * TABLE_WIDTH)
+    for state in range(states):
+        active = [entries for bit, entries in enumerate(layer_entries) if state & (1 << bit)]
+        for modifiers in range(MODIFIER_STATES):
+            for code in codes:
+                entry = global_entries.get(code)
+                for entries in reversed(active):
+                    if entry is not None:
+                        break
+                    entry = entries.get((modifiers, code)) or entries.get((None, code))
+                table[table_index(state, modifiers, code)] = entry
+    return CompiledKeymap(table, taps, bits.get(TOGGLED_LAYER, 0), tuple(sorted(codes)))
+
+
+class KeymapEngine:
+    """
+    Steps through a compiled keymap, one table lookup per event.
+
+    Keys are released as they were pressed, even if the layers or the keymap changed in
+    between. A new keymap can be loaded at any time, which resets the held layers.
+
+    While a tap-hold key is pending, any key pressed decides it's held, so every key's
+    events should be routed to step until pending_tap is None again.
+    """
+
+    def __init__(self, keymap: dict, backend: t.Any = chords.keyboard) -> None:
+        self.backend = backend
+        self.sent = [NOTHING_SENT] * TABLE_WIDTH
+        self.load(keymap)
+
+    def load(self, keymap: dict) -> None:
+        """
+        Compile and switch to a keymap, raising KeymapError if it's invalid.
+
+        Keys held down keep what they sent, to release it when they're released. Keys the new
+        keymap doesn't map won't be routed here anymore, so what they sent is released now.
+        """
+        compiled = compile_keymap(keymap, self.backend)
+        mapped = set(compiled.codes)
+        for code, target in enumerate(self.sent):
+            if target != NOTHING_SENT and code not in mapped:
+                self.sent[code] = NOTHING_SENT
+                self.backend.release(target)
+        self.held_layers = 0
+        self.pending_tap: t.Optional[tuple[int, float, int]] = None
+        self.compiled = compiled
+
+    def _resolve_hold(self) -> None:
+        """Turn the pending tap-hold key into a held layer."""
+        _, _, tap = self.pending_tap
+        self.held_layers |= self.compiled.taps[tap][1]
+        self.pending_tap = None
+
+    def step(self, code: int, pressed: bool, modifiers: int, toggled: bool, time: float) -> bool:
+        """Process an event, sending keys as needed. Returns whether to let the event through."""
+        if code >= TABLE_WIDTH:
+            return True
+        compiled = self.compiled
+        pending = self.pending_tap
+        if pending is not None and pressed:
+            if pending[0] != code or time - pending[1] >= TAP_TIMEOUT:
+                self._resolve_hold()
+
+        state = self.held_layers | (compiled.toggled_bit if toggled else 0)
+        entry = compiled.table[table_index(state, modifiers & (MODIFIER_STATES - 1), code)]
+
+        if entry is not None and entry[0] == HOLD:
+            if pressed:
+                self.held_layers |= entry[1]
+            else:
+                self.held_layers &= ~entry[1]
+            return False
+        if entry is not None and entry[0] == TAP:
+            tap_code, bit = compiled.taps[entry[1]]
+            if pressed:
+                if pending is None or pending[0] != code:
+                    self.pending_tap = (code, time, entry[1])
+            elif self.pending_tap is not None and self.pending_tap[0] == code:
+                self.pending_tap = None
+                if time - pending[1] < TAP_TIMEOUT:
+                    self.backend.press(tap_code)
+                    self.backend.release(tap_code)
+                else:
+                    self.held_layers &= ~bit
+            else:
+                self.held_layers &= ~bit
+            return False
+
+        if not pressed:
+            target = self.sent[code]
+            if target == NOTHING_SENT:
+                return True
+            self.sent[code] = NOTHING_SENT
+            self.backend.release(target)
+            return False
+        if entry is None or entry[0] == PASS:
+            return True
+        self.sent[code] = entry[1]
+        self.backend.press(entry[1])
+        return False
+
+
+def load_keymap(path: pathlib.Path, default: dict) -> dict:
+    """Read a keymap file, falling back to a default if it doesn't exist."""
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return default
+
+
+class KeymapWatcher:
+    """
+    Reloads a keymap file into a callback whenever it's modified.
+
+    A file that can't be parsed, or a keymap the callback rejects with a ValueError like
+    KeymapError, is passed to on_error instead, printing the traceback if there's none.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        on_change: t.Callable[[dict], None],
+        on_error: t.Optional[t.Callable[[ValueError], None]] = None,
+    ) -> None:
+        self.path = path
+        self.on_change = on_change
+        self.on_error = on_error
+        self._mtime = self._stat()
+        self._timer: t.Optional[timers.TimerHandle] = None
+
+    def _stat(self) -> t.Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def check(self) -> None:
+        mtime = self._stat()
+        if mtime == self._mtime or mtime is None:
+            return
+        self._mtime = mtime
+        try:
+            keymap = json.loads(self.path.read_text(encoding="utf-8"))
+            self.on_change(keymap)
+        except ValueError as error:  # Including json.JSONDecodeError and KeymapError
+            if self.on_error is None:
+                traceback.print_exc()
+            else:
+                self.on_error(error)
+
+    def start(self) -> None:
+        self._timer = timers.scheduler.call_every(WATCH_INTERVAL, self.check)
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def run_case(engine: KeymapEngine, backend: fake_keyboard.FakeKeyboard, case: dict) -> list[str]:
+    """Feed a case's events through an engine, returning a description of any mismatch."""
+    dispatcher = dispatch.KeyDispatcher(backend)
+    toggled = case.get("enabled", True)
+
+    def handle_key(event: fake_keyboard.KeyEvent, pressed: bool, modifiers: int) -> bool:
+        passed = engine.step(event.scan_code, pressed, modifiers, toggled, event.time)
+        dispatcher.fallback = handle_key if engine.pending_tap is not None else None
+        return passed
+
+    for code in engine.compiled.codes:
+        dispatcher.add_key_handler(code, handle_key)
+    dispatcher.start(suppress=True)
+    backend.output.clear()
+    for event_type, name, *time in case["events"]:
+        backend.feed(backend.event(event_type, name, time[0] if time else 0))
+    dispatcher.stop()
+
+    expected = [
+        (event_type, backend.key_to_scan_codes(name)[0]) for event_type, name in case["expect"]
+    ]
+    if backend.output == expected:
+        return []
+    return [f"{case['name']}: expected {expected}, got {backend.output}"]
+
+
+def check(keymap: dict, cases: list[dict]) -> list[str]:
+    """Run cases against a keymap with a fake keyboard, returning the failures."""
+    failures = []
+    for case in cases:
+        backend = fake_keyboard.FakeKeyboard()
+        engine = KeymapEngine(keymap, backend)
+        failures.extend(run_case(engine, backend, case))
+    return failures
+
+
+def check_malformed(keymaps: list = MALFORMED_KEYMAPS) -> list[str]:
+    """Compile keymaps of the wrong shape, returning those not rejected with a KeymapError."""
+    failures = []
+    for malformed in keymaps:
+        try:
+            compile_keymap(malformed, fake_keyboard.FakeKeyboard())
+        except KeymapError:
+            continue
+        except Exception as error:
+            failures.append(f"{json.dumps(malformed)}: raised {error!r}")
+        else:
+            failures.append(f"{json.dumps(malformed)}: compiled")
+    return failures
+
+
+def main() -> None:
+    from winutils.fn_lock import core
+
+    parser = argparse.ArgumentParser(description="Check a keymap against cases, headlessly.")
+    parser.add_argument("cases", type=pathlib.Path, nargs="?", help="defaults to the built-in")
+    parser.add_argument("--keymap", type=pathlib.Path, help="defaults to the built-in keymap")
+    arguments = parser.parse_args()
+
+    keymap = core.DEFAULT_KEYMAP
+    if arguments.keymap is not None:
+        keymap = json.loads(arguments.keymap.read_text(encoding="utf-8"))
+    cases = core.DEFAULT_KEYMAP_CASES
+    if arguments.cases is not None:
+        cases = json.loads(arguments.cases.read_text(encoding="utf-8"))
+
+    failures = check(keymap, cases)
+    for failure in failures:
+        print(failure)
+    print(f"{len(cases) - len(failures)}/{len(cases)} cases passed")
+    rejected = check_malformed()
+    for failure in rejected:
+        print(failure)
+    total = len(MALFORMED_KEYMAPS)
+    print(f"{total - len(rejected)}/{total} malformed keymaps rejected")
+    if failures or rejected:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
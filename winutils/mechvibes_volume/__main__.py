@@ -1,27 +1,27 @@
-import keyboard
-import typing as t
 from winutils.mechvibes_volume import core
-from winutils._helpers import overlay
-
-
-class Hotkeys:
-    increase: t.Optional[t.Callable] = None
-    decrease: t.Optional[t.Callable] = None
+from winutils._helpers import hooks, overlay
 
 
 def register_hotkeys() -> None:
     """Register the hotkeys for increasing/decreasing the scaling."""
-    Hotkeys.increase = keyboard.add_hotkey(core.INCREASE_HOTKEY, core.Handler.increment_scaling)
-    Hotkeys.decrease = keyboard.add_hotkey(core.DECREASE_HOTKEY, core.Handler.decrement_scaling)
+    hooks.registry.declare(
+        "mechvibes",
+        hotkeys={
+            core.INCREASE_HOTKEY: hooks.Hotkey(core.Handler.increment_scaling),
+            core.DECREASE_HOTKEY: hooks.Hotkey(core.Handler.decrement_scaling),
+        },
+    )
+    hooks.registry.reconcile()
 
 
 def unregister_hotkeys() -> None:
     """Unregister the hotkeys for increasing/decreasing the scaling."""
-    keyboard.remove_hotkey(Hotkeys.increase)
-    keyboard.remove_hotkey(Hotkeys.decrease)
+    hooks.registry.retract("mechvibes")
+    hooks.registry.reconcile()
 
 
 core.Handler.start_hook = register_hotkeys
 core.Handler.stop_hook = unregister_hotkeys
+# Installs the keyboard hook along with the hotkeys
 core.Handler.start()
 overlay.root.mainloop()
@@ -0,0 +1,418 @@
+"""
+Times the lookups made on each volume adjustment, against how they used to be made.
+
+App volumes come from the curve tables, against bisecting the curve's points, and the
+linear table is checked against the bisect path at every whole percent. The Mechvibes
+session comes from the session index, against enumerating every session, with sessions
+created and expired between lookups and each result checked. Passes over dozens of target
+sessions are timed as the system volume changes, checking every session ends up at its
+target's volume. Generated captures are calibrated with each loudness measure, checking
+the fitted curve against the one they were generated with. Device notifications go
+through the endpoint tracker, counting the refreshes it avoids and checking it follows the
+default device. Bursts of device notifications
+are debounced through the shared scheduler, against a thread per notification, reporting
+the threads used and how late the debounced calls ran. Runs headless, on any platform:
+
+    python -m winutils.mechvibes_volume.benchmark --lookups 1000000
+"""
+
+import argparse
+import bisect
+import json
+import math
+import pathlib
+import random
+import tempfile
+import threading
+import time
+import typing as t
+from winutils._helpers import latency, timers
+from winutils.mechvibes_volume import calibrate, curve, endpoints, fakes, sessions, targets
+
+SYSTEM_VOLUMES = list(curve.VOLUME_MAPPING.keys())
+APP_VOLUMES = list(curve.VOLUME_MAPPING.values())
+SCALE_FACTORS = [step / 10 for step in range(21)]
+TOLERANCE = 1e-9
+MECHVIBES_PROCESS = "MechvibesPlusPlus.exe"
+# Sessions of other processes, like a typical desktop's
+OTHER_SESSIONS = 40
+# Apps normalized at once, and the sessions each has
+TARGET_APPS = 8
+SESSIONS_PER_TARGET = 6
+VOLUME_CHANGES = 2000
+# Captures recorded for calibration
+CAPTURE_APP_VOLUMES = [5, 10, 20, 40, 70, 100]
+# How far a fitted point's loudness can be from the target
+CALIBRATION_TOLERANCE_DB = 0.1
+# Output devices, and the device changes made between them
+DEVICES = 4
+DEVICE_EVENTS = 10_000
+# Notifications debounced like device property changes, in bursts a few milliseconds apart
+DEBOUNCE_DELAY = 0.1
+BURST_EVENTS = 50
+EVENT_SPACING = 0.002
+
+
+def bisect_volume(system_volume: float, scale_factor: float) -> float:
+    """Round to a whole percent, bisect the points, and interpolate between them."""
+    system_volume = round(system_volume * 100)
+    index = bisect.bisect_left(SYSTEM_VOLUMES, system_volume)
+    if index == 0:
+        # Only reached at 0%, which the runtime never looks up
+        return max(0, min(100, APP_VOLUMES[0] * scale_factor)) / 100
+    l_app_vol = APP_VOLUMES[index - 1]
+    l_sys_vol = SYSTEM_VOLUMES[index - 1]
+    u_app_vol = APP_VOLUMES[index]
+    u_sys_vol = SYSTEM_VOLUMES[index]
+    app_vol_diff = u_app_vol - l_app_vol
+    sys_vol_diff = u_sys_vol - l_sys_vol
+    app_volume = l_app_vol + (system_volume - l_sys_vol) * app_vol_diff / sys_vol_diff
+    return max(0, min(100, app_volume * scale_factor)) / 100
+
+
+def time_lookups(
+    lookup: t.Callable[[float, float], float], volumes: list[float], scale_factor: float
+) -> float:
+    """Time looking up every volume, returning the nanoseconds per lookup."""
+    started = time.perf_counter_ns()
+    for volume in volumes:
+        lookup(volume, scale_factor)
+    return (time.perf_counter_ns() - started) / len(volumes)
+
+
+def time_builds(mode: str, repeats: int = 20) -> dict[str, float]:
+    """Time evaluating the curve, and building the table of each scale factor from it."""
+    started = time.perf_counter_ns()
+    for _ in range(repeats):
+        volume_curve = curve.VolumeCurve(curve.VOLUME_MAPPING, mode)
+    evaluate_ns = (time.perf_counter_ns() - started) / repeats
+
+    started = time.perf_counter_ns()
+    for scale_factor in SCALE_FACTORS:
+        volume_curve.table(scale_factor)
+    scale_ns = (time.perf_counter_ns() - started) / len(SCALE_FACTORS)
+    return {"evaluate_us": evaluate_ns / 1e3, "table_per_scale_us": scale_ns / 1e3}
+
+
+def max_difference(volume_curve: curve.VolumeCurve) -> float:
+    """The largest difference from the bisect path, at every whole percent and scale factor."""
+    return max(
+        abs(volume_curve.volume(percent / 100, scale) - bisect_volume(percent / 100, scale))
+        for percent in range(1, 101)
+        for scale in SCALE_FACTORS
+    )
+
+
+def curve_benchmark(lookups: int, seed: int = 0) -> dict[str, t.Any]:
+    rng = random.Random(seed)
+    volumes = [rng.uniform(0.01, 1) for _ in range(lookups)]
+    linear = curve.VolumeCurve(curve.VOLUME_MAPPING, curve.LINEAR)
+    cubic = curve.VolumeCurve(curve.VOLUME_MAPPING, curve.MONOTONE_CUBIC)
+    # Built upfront, as they would be by the time the runtime looks volumes up repeatedly
+    linear.table(1)
+    cubic.table(1)
+
+    bisect_ns = time_lookups(bisect_volume, volumes, 1)
+    linear_ns = time_lookups(linear.volume, volumes, 1)
+    cubic_ns = time_lookups(cubic.volume, volumes, 1)
+    difference = max_difference(linear)
+    return {
+        "lookups": lookups,
+        "bisect_ns": bisect_ns,
+        "linear_table_ns": linear_ns,
+        "monotone_cubic_table_ns": cubic_ns,
+        "speedup": bisect_ns / linear_ns,
+        "builds": {mode: time_builds(mode) for mode in sorted(curve.MODES)},
+        "max_linear_difference": difference,
+        "correct": difference <= TOLERANCE,
+    }
+
+
+def enumerate_session(backend: fakes.FakeSessions, name: str) -> t.Optional[sessions.Session]:
+    """Find a session by going through every one, like adjustments used to."""
+    for session in backend.enumerate():
+        if session.name == name:
+            return session
+    return None
+
+
+def session_benchmark(lookups: int, seed: int = 0) -> dict[str, t.Any]:
+    rng = random.Random(seed)
+    backend = fakes.FakeSessions()
+    for pid in range(OTHER_SESSIONS):
+        backend.create(1000 + pid, f"app {pid}.exe")
+    mechvibes: t.Optional[sessions.Session] = backend.create(99, MECHVIBES_PROCESS)
+    index = sessions.SessionIndex(backend)
+    index.start()
+
+    # Mechvibes restarts, and other apps come and go, every so often
+    mismatches = 0
+    churn_every = max(1, lookups // 100)
+    index_ns = enumerate_ns = 0
+    for lookup in range(lookups):
+        if lookup % churn_every == churn_every - 1:
+            if mechvibes is not None:
+                backend.expire(mechvibes)
+            mechvibes = None
+            if rng.random() < 0.8:
+                mechvibes = backend.create(rng.randrange(100, 1000), MECHVIBES_PROCESS)
+            other = rng.choice([s for s in backend.sessions.values() if s is not mechvibes])
+            backend.expire(other)
+            backend.create(other.pid, other.name)
+
+        started = time.perf_counter_ns()
+        found = index.find(MECHVIBES_PROCESS)
+        index_ns += time.perf_counter_ns() - started
+        started = time.perf_counter_ns()
+        expected = enumerate_session(backend, MECHVIBES_PROCESS)
+        enumerate_ns += time.perf_counter_ns() - started
+        mismatches += found != expected
+
+    index.stop()
+    return {
+        "lookups": lookups,
+        "sessions": OTHER_SESSIONS + 1,
+        "index_ns": index_ns / lookups,
+        "enumerate_ns": enumerate_ns / lookups,
+        "speedup": enumerate_ns / index_ns,
+        "name_lookups_per_enumeration": backend.name_lookups / backend.enumerations,
+        "mismatches": mismatches,
+        "correct": not mismatches,
+    }
+
+
+def normalization_benchmark(seed: int = 0) -> dict[str, t.Any]:
+    """Time passes over every target's sessions, as the system volume moves around."""
+    rng = random.Random(seed)
+    backend = fakes.FakeSessions()
+    for pid in range(OTHER_SESSIONS):
+        backend.create(1000 + pid, f"app {pid}.exe")
+    volume_targets = []
+    for number in range(TARGET_APPS):
+        points = {0: 100, 50: rng.uniform(20, 80), 100: rng.uniform(5, 20)}
+        mode = curve.MONOTONE_CUBIC if number % 2 else curve.LINEAR
+        volume_targets.append(
+            targets.Target(f"target {number}.exe", curve.VolumeCurve(points, mode), 1)
+        )
+        for session in range(SESSIONS_PER_TARGET):
+            backend.create(2000 + number * SESSIONS_PER_TARGET + session, f"target {number}.exe")
+
+    index = sessions.SessionIndex(backend)
+    engine = targets.NormalizationEngine(index, volume_targets)
+    index.on_added = engine.add_session
+    index.on_removed = engine.remove_session
+    index.start()
+
+    # Small steps, like scrolling or a volume key, most of which don't change every app
+    system_volume = 0.5
+    histogram = latency.Histogram()
+    for _ in range(VOLUME_CHANGES):
+        system_volume = min(1, max(0.01, system_volume + rng.choice([-2, -1, 1, 2]) * 0.0005))
+        result = engine.update(system_volume)
+        histogram.record(int(result.seconds * 1e9))
+
+    mismatches = sum(
+        session.volume.levels[-1] != target.volume(system_volume)
+        for target in volume_targets
+        for session in index.find_all(target.process)
+    )
+    index.stop()
+    return {
+        "targets": TARGET_APPS,
+        "target_sessions": TARGET_APPS * SESSIONS_PER_TARGET,
+        "passes": engine.passes,
+        "updated": engine.updated,
+        "skipped": engine.skipped,
+        "p50_pass_us": histogram.percentile(50) / 1e3,
+        "p99_pass_us": histogram.percentile(99) / 1e3,
+        "mismatches": mismatches,
+        "correct": not mismatches,
+    }
+
+
+def calibration_benchmark(seed: int = 0) -> dict[str, t.Any]:
+    """Calibrate generated captures, checking the curve fitted reaches the target loudness."""
+    recorder = fakes.FakeRecorder(seed=seed)
+    system_volumes = SYSTEM_VOLUMES[1:]
+    result: dict[str, t.Any] = {"captures": len(system_volumes) * len(CAPTURE_APP_VOLUMES)}
+    with tempfile.TemporaryDirectory() as directory:
+        for system_volume in system_volumes:
+            for app_volume in CAPTURE_APP_VOLUMES:
+                recorder.record(pathlib.Path(directory), system_volume, app_volume)
+
+        for method in calibrate.MEASURES:
+            started = time.perf_counter()
+            calibration = calibrate.calibrate(pathlib.Path(directory), method)
+            elapsed = time.perf_counter() - started
+            # The target is full app volume at the lowest system volume
+            target_gain = recorder.gain(system_volumes[0], 100)
+            errors = [
+                20 * math.log10(recorder.gain(system_volume, app_volume) / target_gain)
+                for system_volume, app_volume in calibration.points.items()
+            ]
+            max_error = max(abs(error) for error in errors)
+            result[method] = {
+                "seconds": elapsed,
+                "residual_db": calibration.residual,
+                "max_error_db": max_error,
+                "correct": max_error <= CALIBRATION_TOLERANCE_DB,
+            }
+    return result
+
+
+def endpoint_benchmark(events: int, seed: int = 0) -> dict[str, t.Any]:
+    """
+    Send volume and default device changes through the tracker, checking it follows them.
+
+    Each change used to end in a refresh, activating the default device's interface again,
+    where the tracker only rebuilds its state for default device changes. The refreshes
+    avoided are counted in changes, the notifications dropped separately, as each change
+    sends several notifications.
+    """
+    rng = random.Random(seed)
+    backend = fakes.FakeEndpoints()
+    device_ids = [f"device {number}" for number in range(DEVICES)]
+    for device_id in device_ids:
+        backend.add_device(device_id)
+    calls = {"volume": 0, "default": 0}
+    tracker = endpoints.EndpointTracker(
+        backend,
+        on_volume_changed=lambda: calls.update(volume=calls["volume"] + 1),
+        on_default_changed=lambda: calls.update(default=calls["default"] + 1),
+    )
+    tracker.start()
+
+    expected = {"volume": 0, "default": 0}
+    mistakes = 0
+    started = time.perf_counter()
+    for _ in range(events):
+        roll = rng.random()
+        if roll < 0.05:
+            device_id = rng.choice(device_ids)
+            expected["default"] += device_id != backend.default
+            backend.set_default(device_id)
+        else:
+            # Mostly the default device's volume, sometimes another's
+            device_id = backend.default if roll < 0.85 else rng.choice(device_ids)
+            expected["volume"] += device_id == backend.default
+            backend.set_volume(device_id, rng.random())
+        mistakes += tracker.system_volume() != backend.devices[backend.default].level
+    elapsed = time.perf_counter() - started
+    tracker.stop()
+
+    return {
+        "events": events,
+        "notifications": tracker.notifications,
+        "refreshes_before": events,
+        "rebuilds": tracker.rebuilds,
+        "avoided_refreshes": events - tracker.rebuilds,
+        "dropped_notifications": tracker.dropped,
+        "activations": backend.activations,
+        "ns_per_notification": elapsed * 1e9 / tracker.notifications,
+        "correct": not mistakes and calls == expected,
+    }
+
+
+def timer_debounce(delay: float, callback: t.Callable[[], None]) -> t.Callable[[], None]:
+    """Debounce by starting a threading.Timer on every call, like notifications used to."""
+    timer: t.Optional[threading.Timer] = None
+
+    def debounced() -> None:
+        nonlocal timer
+        if timer:
+            timer.cancel()
+        timer = threading.Timer(delay, callback)
+        timer.start()
+
+    return debounced
+
+
+def storm(
+    debounce: t.Callable[[float, t.Callable[[], None]], t.Callable[[], None]], bursts: int
+) -> dict[str, t.Any]:
+    """Send bursts of notifications through a debounce, timing when the callback runs."""
+    fired: list[float] = []
+    done = threading.Event()
+
+    def callback() -> None:
+        fired.append(time.monotonic())
+        done.set()
+
+    debounced = debounce(DEBOUNCE_DELAY, callback)
+    jitter = latency.Histogram()
+    baseline = set(threading.enumerate())
+    # Thread objects rather than idents, which are reused once a thread ends
+    started: set[threading.Thread] = set()
+    peak_threads = 0
+    for _ in range(bursts):
+        done.clear()
+        for _ in range(BURST_EVENTS):
+            debounced()
+            last_call = time.monotonic()
+            extra = set(threading.enumerate()) - baseline
+            started |= extra
+            peak_threads = max(peak_threads, len(extra))
+            time.sleep(EVENT_SPACING)
+        done.wait(DEBOUNCE_DELAY * 10)
+        if fired:
+            jitter.record(int((fired[-1] - last_call - DEBOUNCE_DELAY) * 1e9))
+
+    return {
+        "notifications": bursts * BURST_EVENTS,
+        "callbacks": len(fired),
+        "threads_started": len(started),
+        "peak_extra_threads": peak_threads,
+        "p50_jitter_ms": jitter.percentile(50) / 1e6,
+        "p99_jitter_ms": jitter.percentile(99) / 1e6,
+        "max_jitter_ms": jitter.max / 1e6,
+        "correct": len(fired) == bursts,
+    }
+
+
+def notification_benchmark(bursts: int) -> dict[str, t.Any]:
+    # Started beforehand, as it is by the time notifications arrive in the tool
+    timers.scheduler.call_later(0, lambda: None)
+    return {
+        "threading_timer": storm(timer_debounce, bursts),
+        "scheduler": storm(timers.scheduler.debounce, bursts),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lookups", type=int, default=1_000_000, help="volumes to look up")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the volumes and sessions")
+    parser.add_argument("--bursts", type=int, default=10, help="bursts of notifications")
+    parser.add_argument("--output", type=pathlib.Path, help="JSON file, stdout if omitted")
+    arguments = parser.parse_args()
+
+    result = {
+        "curve": curve_benchmark(arguments.lookups, arguments.seed),
+        # Enumerating is far slower, so fewer lookups give as stable a result
+        "sessions": session_benchmark(max(1, arguments.lookups // 100), arguments.seed),
+        "normalization": normalization_benchmark(arguments.seed),
+        "calibration": calibration_benchmark(arguments.seed),
+        "endpoints": endpoint_benchmark(DEVICE_EVENTS, arguments.seed),
+        "notifications": notification_benchmark(arguments.bursts),
+    }
+    output = json.dumps(result, indent=2)
+    if arguments.output is None:
+        print(output)
+    else:
+        arguments.output.write_text(output + "\n")
+    if not result["curve"]["correct"]:
+        raise SystemExit("The linear table didn't match the bisect path.")
+    if not result["sessions"]["correct"]:
+        raise SystemExit("The session index didn't match enumerating the sessions.")
+    if not result["normalization"]["correct"]:
+        raise SystemExit("A session didn't end up at its target's volume.")
+    if not all(result["calibration"][method]["correct"] for method in calibrate.MEASURES):
+        raise SystemExit("A calibrated curve didn't reach the target loudness.")
+    if not result["endpoints"]["correct"]:
+        raise SystemExit("The endpoint tracker didn't follow the default device.")
+    if not all(result["correct"] for result in result["notifications"].values()):
+        raise SystemExit("A burst of notifications didn't call back exactly once.")
+
+
+if __name__ == "__main__":
+    main()
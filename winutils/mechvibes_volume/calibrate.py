@@ -0,0 +1,266 @@
+"""
+Fits an app's volume curve from recordings, instead of adjusting it by ear.
+
+Record the app's sound (Mechvibes' keypresses, say) at several app volumes for each system
+volume, saving each as a WAV file named like `system50_app16.wav`. Every capture is measured
+in one batch, either as RMS or as an approximation of LUFS (K-weighted, without gating).
+For each system volume, loudness is fitted against app volume in decibels by least squares,
+and the app volume which reaches the target loudness becomes that system volume's point.
+Runs headless, on any platform:
+
+    python -m winutils.mechvibes_volume.calibrate captures --output volume_targets.json
+
+The curve is written as a target for targets.load_targets, replacing any other curve for
+the same process in the file.
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import sys
+import typing as t
+import wave
+import numpy as np
+from winutils.mechvibes_volume import curve
+
+CAPTURE_NAME = re.compile(r"system(\d+(?:\.\d+)?)_app(\d+(?:\.\d+)?)\.wav", re.IGNORECASE)
+# Added to mean squares, so silence measures very quiet instead of -inf
+SILENCE = 1e-20
+MECHVIBES_PROCESS = "MechvibesPlusPlus.exe"
+
+
+class Capture(t.NamedTuple):
+    """A recording of the app, at a system and app volume percentage."""
+
+    system_volume: float
+    app_volume: float
+    path: pathlib.Path
+
+
+class Calibration(t.NamedTuple):
+    # System volume percentages to app volume percentages
+    points: dict[float, float]
+    target: float
+    # Root mean square of the fits' residuals, in dB
+    residual: float
+
+
+def find_captures(directory: pathlib.Path) -> list[Capture]:
+    captures = []
+    for path in sorted(directory.iterdir()):
+        match = CAPTURE_NAME.fullmatch(path.name)
+        if match is None:
+            continue
+        system_volume, app_volume = float(match[1]), float(match[2])
+        if app_volume <= 0:
+            raise ValueError(f"{path.name}: captures need an app volume above 0%.")
+        captures.append(Capture(system_volume, app_volume, path))
+    if not captures:
+        raise ValueError(f"No captures named like system50_app16.wav in {directory}.")
+    return captures
+
+
+def read_wav(path: pathlib.Path) -> tuple[np.ndarray, int]:
+    """Read a PCM WAV file into samples from -1 to 1, shaped (channels, frames)."""
+    with wave.open(str(path), "rb") as file:
+        channels, width, rate = file.getnchannels(), file.getsampwidth(), file.getframerate()
+        data = file.readframes(file.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(data, np.uint8).astype(float) - 128) / 128
+    elif width == 3:
+        # Sign-extend each 3 byte sample into 4 bytes
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view("<i4").ravel() / 2**31
+    elif width in (2, 4):
+        samples = np.frombuffer(data, f"<i{width}") / 2 ** (8 * width - 1)
+    else:
+        raise ValueError(f"{path.name}: unsupported sample width of {width} bytes.")
+    return samples.reshape(-1, channels).T, rate
+
+
+def load_batch(paths: t.Sequence[pathlib.Path]) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Read captures into one zero padded array shaped (captures, channels, frames).
+
+    Returns it with each capture's length in frames, and the sample rate they share.
+    """
+    recordings = [read_wav(path) for path in paths]
+    rates = {rate for _, rate in recordings}
+    channels = {samples.shape[0] for samples, _ in recordings}
+    if len(rates) > 1 or len(channels) > 1:
+        raise ValueError("Captures need the same sample rate and number of channels.")
+
+    lengths = np.array([samples.shape[1] for samples, _ in recordings])
+    batch = np.zeros((len(recordings), channels.pop(), lengths.max()))
+    for index, (samples, _) in enumerate(recordings):
+        batch[index, :, : samples.shape[1]] = samples
+    return batch, lengths, rates.pop()
+
+
+def rms(batch: np.ndarray, lengths: np.ndarray, rate: int) -> np.ndarray:
+    """The RMS level of each capture in dBFS, averaged over its channels."""
+    mean_squares = (batch**2).sum(axis=-1) / lengths[:, None]
+    return 10 * np.log10(mean_squares.mean(axis=-1) + SILENCE)
+
+
+def biquad_response(
+    frequencies: np.ndarray, rate: int, b: t.Sequence[float], a: t.Sequence[float]
+) -> np.ndarray:
+    """The power response of a biquad filter at each frequency."""
+    z = np.exp(-1j * 2 * np.pi * frequencies / rate)
+    numerator = b[0] + b[1] * z + b[2] * z**2
+    denominator = a[0] + a[1] * z + a[2] * z**2
+    return np.abs(numerator / denominator) ** 2
+
+
+def k_weighting(frequencies: np.ndarray, rate: int) -> np.ndarray:
+    """The power response of BS.1770's K-weighting, a high shelf then a high pass."""
+    # The shelf boosts by 4 dB above ~1.5 kHz, like the head's effect on sound
+    gain = 10 ** (4 / 40)
+    w0 = 2 * np.pi * 1500 / rate
+    alpha = np.sin(w0) / (2 / np.sqrt(2))
+    cos, root = np.cos(w0), 2 * np.sqrt(gain) * alpha
+    shelf = biquad_response(
+        frequencies,
+        rate,
+        (
+            gain * ((gain + 1) + (gain - 1) * cos + root),
+            -2 * gain * ((gain - 1) + (gain + 1) * cos),
+            gain * ((gain + 1) + (gain - 1) * cos - root),
+        ),
+        (
+            (gain + 1) - (gain - 1) * cos + root,
+            2 * ((gain - 1) - (gain + 1) * cos),
+            (gain + 1) - (gain - 1) * cos - root,
+        ),
+    )
+
+    # The high pass rolls off below ~38 Hz
+    w0 = 2 * np.pi * 38 / rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos = np.cos(w0)
+    high_pass = biquad_response(
+        frequencies,
+        rate,
+        ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2),
+        (1 + alpha, -2 * cos, 1 - alpha),
+    )
+    return shelf * high_pass
+
+
+def lufs(batch: np.ndarray, lengths: np.ndarray, rate: int) -> np.ndarray:
+    """
+    The loudness of each capture, in LUFS without gating.
+
+    K-weighting is applied to each capture's spectrum rather than filtering it sample by
+    sample, so the whole batch is weighted at once.
+    """
+    frames = batch.shape[-1]
+    spectrum = np.abs(np.fft.rfft(batch, axis=-1)) ** 2
+    frequencies = np.fft.rfftfreq(frames, 1 / rate)
+    # Bins other than DC and Nyquist stand for their negative frequency too (Parseval)
+    bins = np.full(len(frequencies), 2.0)
+    bins[0] = 1
+    if frames % 2 == 0:
+        bins[-1] = 1
+    energies = (spectrum * (bins * k_weighting(frequencies, rate))).sum(axis=-1) / frames
+    # Front channels are weighted equally, and summed rather than averaged
+    mean_squares = energies / lengths[:, None]
+    return -0.691 + 10 * np.log10(mean_squares.sum(axis=-1) + SILENCE)
+
+
+MEASURES = {"rms": rms, "lufs": lufs}
+
+
+def measure(captures: t.Sequence[Capture], method: str = "lufs") -> np.ndarray:
+    """Measure the loudness of every capture, in dB."""
+    batch, lengths, rate = load_batch([capture.path for capture in captures])
+    return MEASURES[method](batch, lengths, rate)
+
+
+def fit_curve(
+    captures: t.Sequence[Capture], loudness: np.ndarray, target: t.Optional[float] = None
+) -> Calibration:
+    """
+    Fit the app volume which reaches a target loudness at each system volume.
+
+    The target defaults to the loudest capture at the lowest system volume, so the app
+    sounds as loud at every system volume as it does there at full volume.
+    """
+    system_volumes = np.array([capture.system_volume for capture in captures])
+    gains = 20 * np.log10(np.array([capture.app_volume for capture in captures]) / 100)
+    if target is None:
+        target = float(loudness[system_volumes == system_volumes.min()].max())
+
+    points = {}
+    residuals = []
+    for system_volume in np.unique(system_volumes):
+        selected = system_volumes == system_volume
+        x, y = gains[selected], loudness[selected]
+        if np.ptp(x) > 0:
+            design = np.column_stack([x, np.ones_like(x)])
+            (slope, intercept), *_ = np.linalg.lstsq(design, y, rcond=None)
+        else:
+            # A single app volume, so loudness is assumed to follow the app's gain
+            slope, intercept = 1.0, float(np.mean(y - x))
+        if slope <= 0:
+            raise ValueError(f"Loudness doesn't rise with app volume at {system_volume:g}%.")
+        residuals.extend(y - (slope * x + intercept))
+        app_volume = 100 * 10 ** ((target - intercept) / slope / 20)
+        points[float(system_volume)] = round(float(np.clip(app_volume, 0, 100)), 2)
+
+    residual = float(np.sqrt(np.mean(np.square(residuals))))
+    return Calibration(points, target, residual)
+
+
+def calibrate(
+    directory: pathlib.Path, method: str = "lufs", target: t.Optional[float] = None
+) -> Calibration:
+    captures = find_captures(directory)
+    return fit_curve(captures, measure(captures, method), target)
+
+
+def write_target(
+    path: pathlib.Path, process: str, points: dict[float, float], mode: str = curve.LINEAR
+) -> None:
+    """Write a curve into a targets file, replacing the process' target if it has one."""
+    entries = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+    entries = [entry for entry in entries if entry["process"] != process]
+    entry = {"process": process, "points": {f"{key:g}": value for key, value in points.items()}}
+    if mode != curve.LINEAR:
+        entry["mode"] = mode
+    entries.insert(0, entry)
+    path.write_text(json.dumps(entries, indent=4) + "\n", encoding="utf-8")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("captures", type=pathlib.Path, help="folder of WAV captures")
+    parser.add_argument("--measure", choices=MEASURES, default="lufs", help="loudness measure")
+    parser.add_argument("--target", type=float, help="loudness to reach, in dB")
+    parser.add_argument("--process", default=MECHVIBES_PROCESS, help="process of the app")
+    parser.add_argument("--mode", choices=sorted(curve.MODES), default=curve.LINEAR)
+    parser.add_argument("--output", type=pathlib.Path, help="targets file, stdout if omitted")
+    arguments = parser.parse_args()
+
+    try:
+        calibration = calibrate(arguments.captures, arguments.measure, arguments.target)
+        # Checks the points make a curve before writing them
+        curve.VolumeCurve(calibration.points, arguments.mode)
+    except (OSError, ValueError, wave.Error) as error:
+        raise SystemExit(str(error))
+
+    print(f"Target: {calibration.target:.2f} dB", file=sys.stderr)
+    print(f"Fit residual: {calibration.residual:.3f} dB", file=sys.stderr)
+    if arguments.output is None:
+        print(json.dumps({f"{key:g}": value for key, value in calibration.points.items()}))
+    else:
+        write_target(arguments.output, arguments.process, calibration.points, arguments.mode)
+
+
+if __name__ == "__main__":
+    main()
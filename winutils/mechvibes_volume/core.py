@@ -1,36 +1,25 @@
-import threading
-import bisect
 import functools
 import typing as t
-from comtypes import CLSCTX_ALL, COMObject
-from pycaw.pycaw import IAudioEndpointVolume, IAudioEndpointVolumeCallback
-from pycaw.callbacks import MMNotificationClient
-from pycaw.utils import AudioUtilities
-from winutils._helpers import overlay
+from comtypes import COMObject
+from pycaw.pycaw import IAudioEndpointVolumeCallback
+from winutils._helpers import overlay, timers
+from winutils.mechvibes_volume import curve, endpoints, sessions, targets
 import customtkinter as ctk
 
 DEBUGGING = False
-VOLUME_MAPPING = {
-    0: 100,
-    10: 100,
-    20: 68,
-    30: 34,
-    40: 24,
-    50: 16,
-    60: 12,
-    70: 10,
-    80: 8,
-    90: 6,
-    100: 5,
-}
-SYSTEM_VOLUMES = list(VOLUME_MAPPING.keys())
-APP_VOLUMES = list(VOLUME_MAPPING.values())
+MECHVIBES_PROCESS = "MechvibesPlusPlus.exe"
+# The app whose scale factor the hotkeys change
+HOTKEY_TARGET = MECHVIBES_PROCESS
+# Set to curve.MONOTONE_CUBIC for a smooth curve through the same points
+CURVE_MODE = curve.LINEAR
 INCREASE_HOTKEY = "ctrl+shift+alt+up"
 DECREASE_HOTKEY = "ctrl+shift+alt+down"
 MIN_SCALE_FACTOR = 0
 MAX_SCALE_FACTOR = 2
 SCALE_FACTOR_STEP = 0.1
 OVERLAY_TIMEOUT = 2.5
+# How long device notifications must stop for before they're acted on
+NOTIFICATION_DEBOUNCE = 0.1
 
 vol_overlay = overlay.BottomOverlay()
 vol_overlay.frame.rowconfigure(0, weight=1, uniform="a")
@@ -55,29 +44,25 @@ def get_fg_slider_colour() -> str:
     return "#000000" if mode == "Dark" else "#FFFFFF"
 
 
-def debounce(callback: t.Callable, fire_after: int) -> t.Callable:
+def debounce(callback: t.Callable, fire_after: float) -> t.Callable:
     """
     A decorator to implement debouncing.
 
     Whenever the function is called, after fire_after period passes, the
     callback is called. If within the period the function is called again,
-    the previous timer is discared.
+    the callback is pushed back instead.
 
-    The original function is still called each time.
+    The original function is still called each time. The callback runs on the
+    shared timers.scheduler thread, rather than a thread per call.
     """
 
     def decorator(function: t.Callable) -> t.Callable:
-        timer = None
+        debounced = timers.scheduler.debounce(fire_after, callback)
 
         @functools.wraps(function)
         def wrapper(*args, **kwargs):
             function(*args, **kwargs)
-
-            nonlocal timer
-            if timer:
-                timer.cancel()
-            timer = threading.Timer(fire_after, callback)
-            timer.start()
+            debounced()
 
         return wrapper
 
@@ -87,13 +72,13 @@ def debounce(callback: t.Callable, fire_after: int) -> t.Callable:
 class Handler:
     """Handles the entire application logic, and houses global instances."""
 
-    devices: t.Any
-    interface: t.Any
-    volume: t.Any
-    notif_client: t.Any
-    enumerator: t.Any
-    app_volume: t.Optional[int] = None
-    session: t.Any = None
+    endpoint_tracker: t.Optional[endpoints.EndpointTracker] = None
+    session_index: t.Optional[sessions.SessionIndex] = None
+    engine: t.Optional[targets.NormalizationEngine] = None
+    # The apps to normalize, meant to be reassigned before starting
+    volume_targets = [
+        targets.Target(MECHVIBES_PROCESS, curve.VolumeCurve(curve.VOLUME_MAPPING, CURVE_MODE))
+    ]
     state_refresh_count = 0
     adjust_app_volume_count = 0
     scale_factor: float = 1
@@ -124,6 +109,7 @@ class Handler:
         Handler.scale_factor = max(MIN_SCALE_FACTOR, min(MAX_SCALE_FACTOR, Handler.scale_factor))
         if DEBUGGING:
             print(f"Incremented scaling factor to {Handler.scale_factor}")
+        Handler.engine.set_scale_factor(HOTKEY_TARGET, Handler.scale_factor)
         Handler.adjust_app_volume()
         Handler.display_scaling()
 
@@ -138,58 +124,34 @@ class Handler:
         Handler.scale_factor = max(MIN_SCALE_FACTOR, min(MAX_SCALE_FACTOR, Handler.scale_factor))
         if DEBUGGING:
             print(f"Decremented scaling factor to {Handler.scale_factor}")
+        Handler.engine.set_scale_factor(HOTKEY_TARGET, Handler.scale_factor)
         Handler.adjust_app_volume()
         Handler.display_scaling()
 
     @staticmethod
     def refresh_state() -> None:
         """
-        Refresh the pycaw interfaces being used.
+        Follow a new default device, watching its sessions instead.
 
-        This also calls adjust_app_volume subsequently.
+        The endpoint tracker has already switched to its volume interface. This also calls
+        adjust_app_volume subsequently, setting every target's volume again.
         """
         if DEBUGGING:
             Handler.state_refresh_count += 1
             print(f"--- Refreshing state({Handler.state_refresh_count}) ---")
+            print(Handler.endpoint_tracker.report())
 
-        Handler.devices = AudioUtilities.GetSpeakers()
-        Handler.interface = Handler.devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        Handler.volume = Handler.interface.QueryInterface(IAudioEndpointVolume)
+        Handler.session_index.stop()
+        Handler.engine.forget()
+        Handler.session_index.start()
         # Uncomment the next line to also register volume change notifiers (should be unnecessary)
-        # Handler.volume.RegisterControlChangeNotify(AudioEndpointVolumeCallback())
+        # Handler.endpoint_tracker.volume.RegisterControlChangeNotify(AudioEndpointVolumeCallback())
         Handler.adjust_app_volume()
 
-    @staticmethod
-    def get_appropriate_app_volume(system_volume: float) -> float:
-        """
-        Get the appropriate app volume based on the system volume.
-
-        This function linerally interpolates the current system volume.
-        This function accounts for the current scale factor being used.
-        """
-        system_volume = round(system_volume * 100)
-        index = bisect.bisect_left(SYSTEM_VOLUMES, system_volume)
-        if index == 0:
-            l_app_vol = 0
-            l_sys_vol = 0
-        else:
-            l_app_vol = APP_VOLUMES[index - 1]
-            l_sys_vol = SYSTEM_VOLUMES[index - 1]
-
-        u_app_vol = APP_VOLUMES[index]
-        u_sys_vol = SYSTEM_VOLUMES[index]
-
-        app_vol_diff = u_app_vol - l_app_vol
-        sys_vol_diff = u_sys_vol - l_sys_vol
-        app_volume = l_app_vol + (system_volume - l_sys_vol) * app_vol_diff / sys_vol_diff
-
-        scaled_volume = max(0, min(100, app_volume * Handler.scale_factor))
-        return scaled_volume / 100
-
     @staticmethod
     def adjust_app_volume() -> None:
         """
-        Change the app volume based on the current system volume.
+        Change the volume of every target app based on the current system volume.
 
         The app and system volumes are inversely proportional.
         """
@@ -197,43 +159,46 @@ class Handler:
             Handler.adjust_app_volume_count += 1
             print(f"--- Adjusting app volume ({Handler.adjust_app_volume_count}) ---")
 
-        if Handler.session and not Handler.session.Process.is_running():
-            Handler.session = None
-
-        if Handler.session is None:
-            for session in AudioUtilities.GetAllSessions():
-                if session.Process and session.Process.name() == "MechvibesPlusPlus.exe":
-                    Handler.session = session
-                    break
-
-        if Handler.session is not None:
-            system_volume = Handler.volume.GetMasterVolumeLevelScalar()
-            if system_volume == 0:
-                return
-
-            new_volume = Handler.get_appropriate_app_volume(system_volume)
-            if new_volume == Handler.app_volume:
-                return
-            if DEBUGGING:
-                print(f"App volume changed, sys: {system_volume:%}, app: {new_volume:%}")
-            Handler.session.SimpleAudioVolume.SetMasterVolume(new_volume, None)
-            Handler.app_volume = new_volume
+        system_volume = Handler.endpoint_tracker.system_volume()
+        if system_volume == 0:
+            return
+        result = Handler.engine.update(system_volume)
+        if DEBUGGING:
+            print(f"Updated {result.updated} of {result.sessions} sessions, sys: {system_volume:%}")
 
     @staticmethod
     def start() -> None:
         """Listen to property changes, and hook the keyboard hotkey."""
         Handler.running = True
-        Handler.notif_client = NotificationClient()
-        Handler.enumerator = AudioUtilities.GetDeviceEnumerator()
-        Handler.enumerator.RegisterEndpointNotificationCallback(Handler.notif_client)
-        Handler.refresh_state()
+        Handler.endpoint_tracker = endpoints.EndpointTracker(
+            endpoints.PycawEndpoints(),
+            on_volume_changed=timers.scheduler.debounce(
+                NOTIFICATION_DEBOUNCE, Handler.adjust_app_volume
+            ),
+            on_default_changed=timers.scheduler.debounce(
+                NOTIFICATION_DEBOUNCE, Handler.refresh_state
+            ),
+        )
+        Handler.session_index = sessions.SessionIndex(sessions.PycawSessions())
+        Handler.engine = targets.NormalizationEngine(Handler.session_index, Handler.volume_targets)
+        # The hotkeys adjust the target's own scale factor, which starts as it was loaded
+        hotkey_target = Handler.engine.targets.get(HOTKEY_TARGET)
+        if hotkey_target is not None:
+            Handler.scale_factor = hotkey_target.scale_factor
+        # New sessions of target apps get their volume set as soon as they start
+        Handler.session_index.on_added = Handler.engine.add_session
+        Handler.session_index.on_removed = Handler.engine.remove_session
+        Handler.endpoint_tracker.start()
+        Handler.session_index.start()
+        Handler.adjust_app_volume()
         Handler.start_hook()
 
     @staticmethod
     def stop() -> None:
         """Stop listening to property changes, and unhook the keyboard hotkey."""
         Handler.running = False
-        Handler.enumerator.UnregisterEndpointNotificationCallback(Handler.notif_client)
+        Handler.endpoint_tracker.stop()
+        Handler.session_index.stop()
         Handler.stop_hook()
 
     @staticmethod
@@ -253,21 +218,6 @@ class Handler:
         """Perform post-teardown actions, meant to be reassigned."""
 
 
-class NotificationClient(MMNotificationClient):
-    """Sends events for device property changes."""
-
-    @debounce(Handler.refresh_state, 0.1)
-    def on_property_value_changed(self, *args, **kwargs):
-        """
-        This method runs whenever the property of a device changes.
-
-        When this method fires, the volume handler should be refreshed.
-        This method is debounced to prevent frequent refreshes.
-        """
-        if DEBUGGING:
-            print("Property changed", args, kwargs)
-
-
 class AudioEndpointVolumeCallback(COMObject):
     """
     Calls adjust_app_volume upon volume changes.
@@ -0,0 +1,136 @@
+"""
+Volume curves, compiled into dense lookup tables.
+
+A curve maps system volume percentages to app volume percentages through a few points.
+It's evaluated once for every tenth of a percent of system volume, so finding the app
+volume is a single list index instead of a bisect and an interpolation.
+"""
+
+import typing as t
+import numpy as np
+
+# System volume percentages to app volume percentages
+VOLUME_MAPPING = {
+    0: 100,
+    10: 100,
+    20: 68,
+    30: 34,
+    40: 24,
+    50: 16,
+    60: 12,
+    70: 10,
+    80: 8,
+    90: 6,
+    100: 5,
+}
+# Tenths of a percent, so tables have 1001 entries
+RESOLUTION = 1000
+
+# Straight lines between points
+LINEAR = "linear"
+# Piecewise cubic Hermite (PCHIP), smooth without overshooting between points
+MONOTONE_CUBIC = "monotone cubic"
+MODES = {LINEAR, MONOTONE_CUBIC}
+
+
+def pchip_slopes(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """The slopes at each point which keep a cubic Hermite spline monotone between points."""
+    widths = np.diff(x)
+    secants = np.diff(y) / widths
+    slopes = np.zeros_like(y)
+    if len(x) == 2:
+        slopes[:] = secants[0]
+        return slopes
+
+    # Weighted harmonic mean of the neighbouring secants, or flat at a local extremum
+    left, right = secants[:-1], secants[1:]
+    w1 = 2 * widths[1:] + widths[:-1]
+    w2 = widths[1:] + 2 * widths[:-1]
+    same_sign = left * right > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        harmonic = (w1 + w2) / (w1 / left + w2 / right)
+    slopes[1:-1] = np.where(same_sign, harmonic, 0)
+
+    for end, (h0, h1, d0, d1) in (
+        (0, (widths[0], widths[1], secants[0], secants[1])),
+        (-1, (widths[-1], widths[-2], secants[-1], secants[-2])),
+    ):
+        slope = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        if np.sign(slope) != np.sign(d0):
+            slope = 0
+        elif np.sign(d0) != np.sign(d1) and abs(slope) > abs(3 * d0):
+            slope = 3 * d0
+        slopes[end] = slope
+    return slopes
+
+
+def evaluate(points: t.Mapping[float, float], mode: str = LINEAR) -> np.ndarray:
+    """Evaluate a curve at every step of the system volume, from 0 to 100 percent."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown curve mode {mode!r}.")
+    x = np.array(sorted(points), dtype=float)
+    y = np.array([points[key] for key in sorted(points)], dtype=float)
+    if len(x) < 2:
+        raise ValueError("A curve needs at least 2 points.")
+    system_volumes = np.linspace(0, 100, RESOLUTION + 1)
+
+    if mode == LINEAR:
+        return np.interp(system_volumes, x, y)
+
+    slopes = pchip_slopes(x, y)
+    # Outside the points, the curve stays at the nearest point like np.interp
+    clipped = np.clip(system_volumes, x[0], x[-1])
+    segment = np.clip(np.searchsorted(x, clipped, side="right") - 1, 0, len(x) - 2)
+    width = x[segment + 1] - x[segment]
+    s = (clipped - x[segment]) / width
+    h00 = (1 + 2 * s) * (1 - s) ** 2
+    h10 = s * (1 - s) ** 2
+    h01 = s**2 * (3 - 2 * s)
+    h11 = s**2 * (s - 1)
+    return (
+        h00 * y[segment]
+        + h10 * width * slopes[segment]
+        + h01 * y[segment + 1]
+        + h11 * width * slopes[segment + 1]
+    )
+
+
+class VolumeCurve:
+    """
+    A curve, with a lookup table of app volumes (from 0 to 1) for each scale factor used.
+
+    The unscaled curve is evaluated when the points or mode change, and scaled tables are
+    built from it the first time each scale factor is used.
+    """
+
+    def __init__(self, points: t.Mapping[float, float], mode: str = LINEAR) -> None:
+        self.builds = 0
+        self.set_curve(points, mode)
+
+    def set_curve(self, points: t.Mapping[float, float], mode: str = LINEAR) -> None:
+        self.base = evaluate(points, mode)
+        self.points = dict(points)
+        self.mode = mode
+        self._tables: dict[float, list[float]] = {}
+        # The table of the last scale factor looked up, which rarely changes
+        self._current: tuple[t.Optional[float], list[float]] = (None, [])
+
+    def table(self, scale_factor: float) -> list[float]:
+        # Scale factors are changed in steps of 0.1, so drift from the additions is rounded off
+        key = round(scale_factor, 6)
+        table = self._tables.get(key)
+        if table is None:
+            table = (np.clip(self.base * key, 0, 100) / 100).tolist()
+            self._tables[key] = table
+            self.builds += 1
+        return table
+
+    def volume(self, system_volume: float, scale_factor: float) -> float:
+        """Look up the app volume (from 0 to 1) for a system volume (from 0 to 1)."""
+        current_scale, table = self._current
+        if scale_factor != current_scale:
+            table = self.table(scale_factor)
+            self._current = (scale_factor, table)
+        if 0 <= system_volume <= 1:
+            return table[int(system_volume * RESOLUTION + 0.5)]
+        return table[0 if system_volume < 0 else RESOLUTION]
@@ -0,0 +1,175 @@
+"""
+The default output device's volume interface, rebuilt only when the default device changes.
+
+Windows sends a notification for every property change of every audio device, in bursts.
+They're filtered by device id and property key as they arrive: a volume change of the
+default device only reads the volume again, through the IAudioEndpointVolume already
+activated, and a notification for another device, or another property, does nothing. The
+interface is only looked up again when the default device really changes, and each
+device's is kept, so switching back to a device doesn't activate it again.
+
+A backend has:
+    default_id(): the id of the default output device
+    activate(device_id): the device's IAudioEndpointVolume
+    watch(tracker): send device notifications to a tracker's handlers
+    unwatch(): stop sending notifications
+"""
+
+import threading
+import typing as t
+
+try:
+    from comtypes import CLSCTX_ALL
+    from pycaw.callbacks import MMNotificationClient
+    from pycaw.pycaw import IAudioEndpointVolume
+    from pycaw.utils import AudioUtilities
+except ImportError:  # Not on Windows, only fake backends can be used
+    AudioUtilities = None
+
+# The data flow and role of the device the volume is followed on, like GetSpeakers
+RENDER = 0
+MULTIMEDIA = 1
+# Sent, undocumented, when an endpoint's volume or mute changes
+VOLUME_PROPERTY = ("{9855C4CD-DF8C-449C-A181-8191B68BD06C}", 0)
+VOLUME_PROPERTIES = {VOLUME_PROPERTY}
+
+Callback = t.Callable[[], None]
+
+
+class EndpointTracker:
+    """
+    Tracks the default output device and its volume interface, from notifications.
+
+    Volume changes and default device changes are passed on to callbacks, which should be
+    quick, like debounced functions. `dropped` counts notifications dropped without doing
+    anything, where each used to look the interface up again.
+    """
+
+    def __init__(
+        self, backend: t.Any, on_volume_changed: Callback, on_default_changed: Callback
+    ) -> None:
+        self.backend = backend
+        self.on_volume_changed = on_volume_changed
+        self.on_default_changed = on_default_changed
+        self.default_id: t.Optional[str] = None
+        # The default device's IAudioEndpointVolume
+        self.volume: t.Any = None
+        self.notifications = 0
+        self.volume_changes = 0
+        self.rebuilds = 0
+        self.dropped = 0
+        self.activations = 0
+        self._volumes: dict[str, t.Any] = {}
+        self._lock = threading.Lock()
+
+    def _select(self, device_id: str) -> None:
+        volume = self._volumes.get(device_id)
+        if volume is None:
+            volume = self.backend.activate(device_id)
+            self._volumes[device_id] = volume
+            self.activations += 1
+        self.default_id = device_id
+        self.volume = volume
+        self.rebuilds += 1
+
+    def refresh(self) -> None:
+        """Look the default device up again, activating its interface if it's new."""
+        with self._lock:
+            self._select(self.backend.default_id())
+
+    def system_volume(self) -> float:
+        """Read the default device's volume, refreshing once if its interface has gone."""
+        try:
+            return self.volume.GetMasterVolumeLevelScalar()
+        except Exception:  # The device went away without a notification
+            with self._lock:
+                self._volumes.pop(self.default_id, None)
+            self.refresh()
+            return self.volume.GetMasterVolumeLevelScalar()
+
+    def start(self) -> None:
+        self.refresh()
+        self.backend.watch(self)
+
+    def stop(self) -> None:
+        self.backend.unwatch()
+
+    def default_changed(self, flow_id: int, role_id: int, device_id: t.Optional[str]) -> None:
+        """Handle a new default device, sent once for each role and data flow."""
+        self.notifications += 1
+        if flow_id != RENDER or role_id != MULTIMEDIA or device_id in (None, self.default_id):
+            self.dropped += 1
+            return
+        with self._lock:
+            self._select(device_id)
+        self.on_default_changed()
+
+    def property_changed(self, device_id: str, fmtid: t.Any, pid: int) -> None:
+        self.notifications += 1
+        if device_id != self.default_id or (str(fmtid).upper(), pid) not in VOLUME_PROPERTIES:
+            self.dropped += 1
+            return
+        self.volume_changes += 1
+        self.on_volume_changed()
+
+    def device_changed(self, device_id: str) -> None:
+        """Forget the interface of a device which was removed, or changed state."""
+        self.notifications += 1
+        with self._lock:
+            self._volumes.pop(device_id, None)
+            if device_id == self.default_id:
+                # So it's activated again if it comes back as the default device
+                self.default_id = None
+
+    def report(self) -> dict[str, int]:
+        return {
+            "notifications": self.notifications,
+            "volume changes": self.volume_changes,
+            "rebuilds": self.rebuilds,
+            "dropped notifications": self.dropped,
+            "activations": self.activations,
+        }
+
+
+class PycawEndpoints:
+    """Output devices, from pycaw's device enumerator."""
+
+    def __init__(self) -> None:
+        self.enumerator = AudioUtilities.GetDeviceEnumerator()
+        self._client: t.Any = None
+
+    def default_id(self) -> str:
+        return self.enumerator.GetDefaultAudioEndpoint(RENDER, MULTIMEDIA).GetId()
+
+    def activate(self, device_id: str) -> t.Any:
+        device = self.enumerator.GetDevice(device_id)
+        interface = device.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        return interface.QueryInterface(IAudioEndpointVolume)
+
+    def watch(self, tracker: EndpointTracker) -> None:
+        class NotificationClient(MMNotificationClient):
+            def on_default_device_changed(
+                self, flow: str, flow_id: int, role: str, role_id: int, device_id: str
+            ) -> None:
+                tracker.default_changed(flow_id, role_id, device_id)
+
+            def on_property_value_changed(
+                self, device_id: str, property_struct: t.Any, fmtid: t.Any, pid: int
+            ) -> None:
+                tracker.property_changed(device_id, fmtid, pid)
+
+            def on_device_removed(self, removed_device_id: str) -> None:
+                tracker.device_changed(removed_device_id)
+
+            def on_device_state_changed(
+                self, device_id: str, new_state: str, new_state_id: int
+            ) -> None:
+                tracker.device_changed(device_id)
+
+        self._client = NotificationClient()
+        self.enumerator.RegisterEndpointNotificationCallback(self._client)
+
+    def unwatch(self) -> None:
+        if self._client is not None:
+            self.enumerator.UnregisterEndpointNotificationCallback(self._client)
+            self._client = None
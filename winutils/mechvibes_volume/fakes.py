@@ -0,0 +1,172 @@
+"""
+Stand-ins for pycaw's sessions and device enumerator, so the session index and endpoint
+tracker can be driven without Windows, and for recording the app, so calibration can be
+run on generated captures.
+"""
+
+import pathlib
+import typing as t
+import wave
+import numpy as np
+from winutils.mechvibes_volume import endpoints, sessions
+
+
+class FakeVolume:
+    """An ISimpleAudioVolume recording the levels set."""
+
+    def __init__(self) -> None:
+        self.levels: list[float] = []
+
+    def SetMasterVolume(self, level: float, event_context: t.Any) -> None:
+        self.levels.append(level)
+
+
+class FakeSessions:
+    """
+    A session backend whose sessions are created and expired by hand.
+
+    `name_lookups` counts the process names read, which is what makes enumerating costly.
+    """
+
+    def __init__(self) -> None:
+        self.sessions: dict[str, sessions.Session] = {}
+        self.enumerations = 0
+        self.name_lookups = 0
+        self._on_added: t.Optional[sessions.SessionCallback] = None
+        self._on_removed: t.Optional[sessions.SessionCallback] = None
+        self._next_key = 0
+
+    def create(self, pid: int, name: str) -> sessions.Session:
+        """Start a session for a process, notifying the watcher."""
+        self._next_key += 1
+        session = sessions.Session(f"session {self._next_key}", pid, name, FakeVolume())
+        self.sessions[session.key] = session
+        if self._on_added is not None:
+            self._on_added(session)
+        return session
+
+    def expire(self, session: sessions.Session) -> None:
+        """End a session, notifying the watcher."""
+        del self.sessions[session.key]
+        if self._on_removed is not None:
+            self._on_removed(session)
+
+    def enumerate(self) -> list[sessions.Session]:
+        self.enumerations += 1
+        self.name_lookups += len(self.sessions)
+        return list(self.sessions.values())
+
+    def watch(
+        self, on_added: sessions.SessionCallback, on_removed: sessions.SessionCallback
+    ) -> None:
+        self._on_added = on_added
+        self._on_removed = on_removed
+        for session in self.enumerate():
+            on_added(session)
+
+    def unwatch(self) -> None:
+        self._on_added = None
+        self._on_removed = None
+
+
+class FakeEndpointVolume:
+    """An IAudioEndpointVolume holding a level."""
+
+    def __init__(self, level: float) -> None:
+        self.level = level
+
+    def GetMasterVolumeLevelScalar(self) -> float:
+        return self.level
+
+    def SetMasterVolumeLevelScalar(self, level: float, event_context: t.Any) -> None:
+        self.level = level
+
+
+class FakeEndpoints:
+    """
+    A device enumerator whose devices are changed by hand, notifying like Windows does.
+
+    Each change sends the notifications Windows sends for it, to every role and on unrelated
+    properties too. `activations` counts the interfaces activated, which is what makes
+    refreshing costly.
+    """
+
+    # Properties which change along with the volume, like the endpoint's state and format
+    OTHER_PROPERTIES = [
+        ("{F19F064D-082C-4E27-BC73-6882A1BB8E4C}", 0),
+        ("{1DA5D803-D492-4EDD-8C23-E0C0FFEE7F0E}", 5),
+        ("{B3F8FA53-0004-438E-9003-51A46E139BFC}", 2),
+    ]
+
+    def __init__(self) -> None:
+        self.devices: dict[str, FakeEndpointVolume] = {}
+        self.default: t.Optional[str] = None
+        self.activations = 0
+        self._tracker: t.Optional[endpoints.EndpointTracker] = None
+
+    def add_device(self, device_id: str, level: float = 0.5) -> None:
+        self.devices[device_id] = FakeEndpointVolume(level)
+        if self.default is None:
+            self.default = device_id
+
+    def default_id(self) -> str:
+        return self.default
+
+    def activate(self, device_id: str) -> FakeEndpointVolume:
+        self.activations += 1
+        return self.devices[device_id]
+
+    def set_default(self, device_id: str) -> None:
+        """Make a device the default, for every role."""
+        self.default = device_id
+        if self._tracker is not None:
+            for role_id in range(3):
+                self._tracker.default_changed(endpoints.RENDER, role_id, device_id)
+
+    def set_volume(self, device_id: str, level: float) -> None:
+        self.devices[device_id].level = level
+        if self._tracker is not None:
+            self._tracker.property_changed(device_id, *endpoints.VOLUME_PROPERTY)
+            for fmtid, pid in self.OTHER_PROPERTIES:
+                self._tracker.property_changed(device_id, fmtid, pid)
+
+    def watch(self, tracker: endpoints.EndpointTracker) -> None:
+        self._tracker = tracker
+
+    def unwatch(self) -> None:
+        self._tracker = None
+
+
+class FakeRecorder:
+    """
+    Writes captures of keypresses as if recorded at a system and app volume.
+
+    Keypresses are bursts of decaying noise, the same in every capture. The system volume
+    scales them by its square, roughly like Windows' volume taper, and the app volume
+    scales them linearly, so the app volume reaching any loudness is known exactly.
+    """
+
+    def __init__(self, rate: int = 48000, seconds: float = 1, seed: int = 0) -> None:
+        self.rate = rate
+        rng = np.random.default_rng(seed)
+        frames = int(rate * seconds)
+        clicks = np.zeros((2, frames))
+        click = int(rate * 0.02)
+        decay = np.exp(-np.arange(click) / (click / 5))
+        for start in range(0, frames - click, int(rate * 0.125)):
+            clicks[:, start : start + click] = rng.uniform(-0.8, 0.8, (2, click)) * decay
+        self.clicks = clicks
+
+    @staticmethod
+    def gain(system_volume: float, app_volume: float) -> float:
+        return (system_volume / 100) ** 2 * app_volume / 100
+
+    def record(self, directory: pathlib.Path, system_volume: float, app_volume: float) -> None:
+        samples = self.clicks * self.gain(system_volume, app_volume)
+        pcm = np.round(samples.T * 2**15).clip(-(2**15), 2**15 - 1).astype("<i2")
+        path = directory / f"system{system_volume:g}_app{app_volume:g}.wav"
+        with wave.open(str(path), "wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(self.rate)
+            file.writeframes(pcm.tobytes())
@@ -0,0 +1,223 @@
+"""
+An index of the audio sessions of running processes, kept up to date from notifications.
+
+Backends report every existing session and each one created later, and each one which
+expires, so finding the session of a process is a dict lookup. PycawSessions is the real
+backend, fakes.FakeSessions stands in for it where pycaw isn't available.
+
+A backend has:
+    watch(on_added, on_removed): report sessions from now on, starting with existing ones
+    unwatch(): stop reporting sessions
+    enumerate(): list every current session, without watching
+"""
+
+import threading
+import traceback
+import typing as t
+
+try:
+    import comtypes
+    from pycaw.callbacks import AudioSessionEvents, AudioSessionNotification
+    from pycaw.utils import AudioSession, AudioUtilities
+except ImportError:  # Not on Windows, only fake backends can be used
+    comtypes = None
+
+
+class Session(t.NamedTuple):
+    """An audio session, with its process' name looked up once."""
+
+    # Unique per session, even between sessions of the same process
+    key: str
+    pid: int
+    name: str
+    # The session's ISimpleAudioVolume
+    volume: t.Any
+
+
+SessionCallback = t.Callable[[Session], None]
+
+
+class SessionIndex:
+    """
+    Sessions indexed by process name and PID, for lookups without enumerating.
+
+    The indexes are replaced rather than mutated, so lookups don't need locking.
+    """
+
+    def __init__(
+        self,
+        backend: t.Any,
+        on_added: t.Optional[SessionCallback] = None,
+        on_removed: t.Optional[SessionCallback] = None,
+    ) -> None:
+        self.backend = backend
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.by_name: dict[str, dict[str, Session]] = {}
+        self.by_pid: dict[int, dict[str, Session]] = {}
+        self.lookups = 0
+        self.added = 0
+        self.removed = 0
+        self._lock = threading.Lock()
+
+    def add(self, session: Session) -> None:
+        with self._lock:
+            self.by_name = {
+                **self.by_name,
+                session.name: {**self.by_name.get(session.name, {}), session.key: session},
+            }
+            self.by_pid = {
+                **self.by_pid,
+                session.pid: {**self.by_pid.get(session.pid, {}), session.key: session},
+            }
+            self.added += 1
+        if self.on_added is not None:
+            self.on_added(session)
+
+    def remove(self, session: Session) -> None:
+        with self._lock:
+            if session.key not in self.by_name.get(session.name, {}):
+                return
+            self.by_name = _without(self.by_name, session.name, session.key)
+            self.by_pid = _without(self.by_pid, session.pid, session.key)
+            self.removed += 1
+        if self.on_removed is not None:
+            self.on_removed(session)
+
+    def find(self, name: str) -> t.Optional[Session]:
+        """The newest session of a process with the given name, if it has any."""
+        self.lookups += 1
+        sessions = self.by_name.get(name)
+        return next(reversed(sessions.values())) if sessions else None
+
+    def find_all(self, name: str) -> list[Session]:
+        """Every session of processes with the given name."""
+        self.lookups += 1
+        return list(self.by_name.get(name, {}).values())
+
+    def find_pid(self, pid: int) -> t.Optional[Session]:
+        """The newest session of a process, if it has any."""
+        self.lookups += 1
+        sessions = self.by_pid.get(pid)
+        return next(reversed(sessions.values())) if sessions else None
+
+    def start(self) -> None:
+        self.backend.watch(self.add, self.remove)
+
+    def stop(self) -> None:
+        self.backend.unwatch()
+        with self._lock:
+            self.by_name = {}
+            self.by_pid = {}
+
+    def __len__(self) -> int:
+        return sum(len(sessions) for sessions in self.by_pid.values())
+
+
+def _without(index: dict, value: t.Any, key: str) -> dict:
+    """Copy an index without a session, dropping its value if it has no sessions left."""
+    sessions = {other: session for other, session in index[value].items() if other != key}
+    index = dict(index)
+    if sessions:
+        index[value] = sessions
+    else:
+        del index[value]
+    return index
+
+
+def to_session(audio_session: t.Any) -> t.Optional[Session]:
+    """Wrap a pycaw AudioSession, or None if it has no process (like system sounds)."""
+    try:
+        process = audio_session.Process
+        if process is None:
+            return None
+        return Session(
+            audio_session.InstanceIdentifier,
+            audio_session.ProcessId,
+            process.name(),
+            audio_session.SimpleAudioVolume,
+        )
+    except Exception:  # The process or session went away while being read
+        return None
+
+
+class PycawSessions:
+    """
+    Sessions of the default output device, from pycaw.
+
+    Session notifications need COM in a multithreaded apartment, so they're registered and
+    received on a thread of their own.
+    """
+
+    def __init__(self) -> None:
+        self._stopped = threading.Event()
+        self._thread: t.Optional[threading.Thread] = None
+        # AudioSessions with registered events, to unregister when unwatching
+        self._watched: list[t.Any] = []
+
+    def enumerate(self) -> list[Session]:
+        sessions = (to_session(session) for session in AudioUtilities.GetAllSessions())
+        return [session for session in sessions if session is not None]
+
+    def _watch_session(
+        self, audio_session: t.Any, on_added: SessionCallback, on_removed: SessionCallback
+    ) -> None:
+        session = to_session(audio_session)
+        if session is None:
+            return
+
+        class Events(AudioSessionEvents):
+            def on_state_changed(self, new_state: str, new_state_id: int) -> None:
+                if new_state == "Expired":
+                    on_removed(session)
+
+            def on_session_disconnected(self, disconnect_reason: str, reason_id: int) -> None:
+                on_removed(session)
+
+        audio_session.register_notification(Events())
+        self._watched.append(audio_session)
+        on_added(session)
+
+    def _run(self, on_added: SessionCallback, on_removed: SessionCallback) -> None:
+        comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+        backend = self
+        self._watched = []
+
+        class Notification(AudioSessionNotification):
+            def on_session_created(self, new_session: AudioSession) -> None:
+                backend._watch_session(new_session, on_added, on_removed)
+
+        manager = AudioUtilities.GetAudioSessionManager()
+        if manager is None:  # No output device, so no sessions to watch
+            comtypes.CoUninitialize()
+            return
+        notification = Notification()
+        registered = False
+        try:
+            manager.RegisterSessionNotification(notification)
+            registered = True
+            # Notifications only start once the sessions have been enumerated
+            for audio_session in AudioUtilities.GetAllSessions():
+                self._watch_session(audio_session, on_added, on_removed)
+            self._stopped.wait()
+        except Exception:  # The device went away, sessions stop being watched
+            traceback.print_exc()
+        finally:
+            if registered:
+                manager.UnregisterSessionNotification(notification)
+            for audio_session in self._watched:
+                audio_session.unregister_notification()
+            comtypes.CoUninitialize()
+
+    def watch(self, on_added: SessionCallback, on_removed: SessionCallback) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(on_added, on_removed), daemon=True, name="audio sessions"
+        )
+        self._thread.start()
+
+    def unwatch(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
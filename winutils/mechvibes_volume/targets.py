@@ -0,0 +1,140 @@
+"""
+Normalizes the volume of several apps at once, each through its own curve and scale factor.
+
+A pass looks up every target's sessions in the session index, and only sets the volume of
+sessions whose volume would change. Each pass's time is recorded in latency.registry,
+under "volume pass".
+
+Targets can be loaded from a JSON list like:
+
+    [
+        {"process": "MechvibesPlusPlus.exe"},
+        {"process": "Discord.exe", "points": {"0": 100, "100": 40}, "mode": "monotone cubic",
+         "scale_factor": 0.8}
+    ]
+
+where points default to curve.VOLUME_MAPPING, the mode to linear and the scale factor to 1.
+"""
+
+import json
+import pathlib
+import threading
+import time
+import typing as t
+from winutils._helpers import latency
+from winutils.mechvibes_volume import curve, sessions
+
+
+class Target:
+    """An app to normalize, by process name."""
+
+    def __init__(
+        self, process: str, volume_curve: curve.VolumeCurve, scale_factor: float = 1
+    ) -> None:
+        self.process = process
+        self.curve = volume_curve
+        self.scale_factor = scale_factor
+
+    def volume(self, system_volume: float) -> float:
+        return self.curve.volume(system_volume, self.scale_factor)
+
+
+class PassResult(t.NamedTuple):
+    sessions: int
+    updated: int
+    # Sessions whose volume was already what it would have been set to
+    skipped: int
+    seconds: float
+
+
+class NormalizationEngine:
+    """Keeps the volume of every target's sessions in line with the system volume."""
+
+    def __init__(self, index: sessions.SessionIndex, targets: t.Iterable[Target]) -> None:
+        self.index = index
+        self.targets = {target.process: target for target in targets}
+        self.system_volume: t.Optional[float] = None
+        self.passes = 0
+        self.updated = 0
+        self.skipped = 0
+        self.pass_times = latency.registry.histogram("volume pass")
+        # The volume last set on each session, by session key
+        self._applied: dict[str, float] = {}
+        # Reentrant, as removing a session that failed notifies the engine
+        self._lock = threading.RLock()
+
+    def _apply(self, session: sessions.Session, volume: float) -> bool:
+        """Set a session's volume if it changed, returning whether it was set."""
+        if self._applied.get(session.key) == volume:
+            return False
+        try:
+            session.volume.SetMasterVolume(volume, None)
+        except Exception:  # The session ended without a notification
+            self._applied.pop(session.key, None)
+            self.index.remove(session)
+            return False
+        self._applied[session.key] = volume
+        return True
+
+    def update(self, system_volume: float) -> PassResult:
+        """Make one pass over every target's sessions, for a system volume."""
+        with self._lock:
+            started = time.perf_counter()
+            self.system_volume = system_volume
+            found = updated = 0
+            for target in self.targets.values():
+                target_sessions = self.index.find_all(target.process)
+                if not target_sessions:
+                    continue
+                volume = target.volume(system_volume)
+                for session in target_sessions:
+                    found += 1
+                    updated += self._apply(session, volume)
+
+            elapsed = time.perf_counter() - started
+            self.passes += 1
+            self.updated += updated
+            self.skipped += found - updated
+            self.pass_times.record(int(elapsed * 1e9))
+            return PassResult(found, updated, found - updated, elapsed)
+
+    def add_session(self, session: sessions.Session) -> None:
+        """Set a new session's volume straight away, if it belongs to a target."""
+        target = self.targets.get(session.name)
+        if target is None or self.system_volume is None:
+            return
+        with self._lock:
+            self._applied.pop(session.key, None)
+            self._apply(session, target.volume(self.system_volume))
+
+    def remove_session(self, session: sessions.Session) -> None:
+        with self._lock:
+            self._applied.pop(session.key, None)
+
+    def set_scale_factor(self, process: str, scale_factor: float) -> None:
+        """Change a target's scale factor, taking effect from the next pass."""
+        target = self.targets.get(process)
+        if target is not None:
+            target.scale_factor = scale_factor
+
+    def forget(self) -> None:
+        """Forget the volumes set, so the next pass sets every session's volume."""
+        with self._lock:
+            self._applied.clear()
+
+
+def parse_targets(data: list[dict], mode: str = curve.LINEAR) -> list[Target]:
+    targets = []
+    for entry in data:
+        points = {float(key): value for key, value in entry.get("points", {}).items()}
+        volume_curve = curve.VolumeCurve(points or curve.VOLUME_MAPPING, entry.get("mode", mode))
+        targets.append(Target(entry["process"], volume_curve, entry.get("scale_factor", 1)))
+    return targets
+
+
+def load_targets(path: pathlib.Path, default: list[Target]) -> list[Target]:
+    """Read targets from a file, falling back to a default if it doesn't exist or is invalid."""
+    try:
+        return parse_targets(json.loads(path.read_text(encoding="utf-8")))
+    except (FileNotFoundError, ValueError, KeyError):
+        return default
@@ -1,5 +1,6 @@
 from winutils.monitor_brightness import core
 from winutils._helpers import overlay
 
-core.Handler.start(suppress=False)
+# Installs the keyboard hook along with the hotkeys
+core.Handler.start()
 overlay.root.mainloop()
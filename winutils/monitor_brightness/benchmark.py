@@ -0,0 +1,224 @@
+"""
+Times finding the monitor on the first keypress, and holding a brightness hotkey.
+
+The first keypress probes the monitors one by one like it used to, against the registry
+scanning them in parallel, and against a registry scanned in the background beforehand.
+Later keypresses are checked to find the monitor without scanning, until a display change.
+
+Key repeats arrive at the typematic rate, each asking for the next brightness. Writing
+synchronously holds the hotkey callback for a whole DDC/CI write, so repeats fall behind.
+The writer returns straight away and only writes the latest value. Reports how long each
+keypress took to return, the writes made, and how long after the last keypress the monitor
+showed its brightness, checking the monitor ends at the last value and writes were spaced.
+Runs headless, on any platform, with a fake monitor:
+
+    python -m winutils.monitor_brightness.benchmark --presses 60 --write-latency 0.04
+"""
+
+import argparse
+import json
+import pathlib
+import time
+import typing as t
+from winutils._helpers import latency
+from winutils.monitor_brightness import fakes, monitors, writer
+
+# Windows' default key repeat rate is about 30 a second
+REPEAT_INTERVAL = 1 / 30
+BRIGHTNESS_STEP = 5
+# Slack for sleep's resolution when checking writes were spaced
+SPACING_TOLERANCE = 0.002
+# Keypresses after the first, which shouldn't scan again
+LATER_PRESSES = 100
+
+
+def fake_monitors(read_latency: float) -> list[fakes.FakeMonitor]:
+    """A laptop panel without DDC/CI, a monitor showing another device, then two in use."""
+    return [
+        fakes.FakeMonitor(ddc=False, read_latency=read_latency),
+        fakes.FakeMonitor(input_source=fakes.InputSource.OFF, read_latency=read_latency),
+        fakes.FakeMonitor(luminance=70, read_latency=read_latency),
+        fakes.FakeMonitor(luminance=30, read_latency=read_latency),
+    ]
+
+
+def sequential_probe(backend: fakes.FakeMonitorControl) -> t.Optional[fakes.FakeMonitor]:
+    """Find the first monitor in use one by one, like obtain_monitor used to on each start."""
+    for monitor in backend.get_monitors():
+        try:
+            monitor.__enter__()
+        except OSError:
+            continue
+        if monitor.get_input_source() != backend.InputSource.OFF:
+            monitor.get_luminance()
+            return monitor
+        monitor.__exit__()
+    return None
+
+
+def discovery_benchmark(read_latency: float) -> dict[str, t.Any]:
+    """Time the first keypress finding the monitor, and check later ones don't scan."""
+    result: dict[str, t.Any] = {}
+
+    backend = fakes.FakeMonitorControl(fake_monitors(read_latency))
+    started = time.perf_counter()
+    found = sequential_probe(backend)
+    result["sequential_ms"] = (time.perf_counter() - started) * 1e3
+    correct = found is backend.monitors[2]
+
+    backend = fakes.FakeMonitorControl(fake_monitors(read_latency))
+    # Whatever lets the monitor go mustn't be able to find the old, soon closed, entries
+    forgotten = []
+    registry = monitors.MonitorRegistry(
+        backend, on_invalidated=lambda: forgotten.append(registry.entries is None)
+    )
+    started = time.perf_counter()
+    entry = registry.active()
+    result["parallel_ms"] = (time.perf_counter() - started) * 1e3
+    correct &= entry is not None and entry.monitor is backend.monitors[2] and entry.luminance == 70
+
+    # Later keypresses, then a display change which needs the monitors scanned again
+    histogram = latency.Histogram()
+    for _ in range(LATER_PRESSES):
+        pressed = time.perf_counter_ns()
+        registry.active()
+        histogram.record(time.perf_counter_ns() - pressed)
+    result["p99_cached_us"] = histogram.percentile(99) / 1e3
+    correct &= registry.scans == 1 and backend.listings == 1
+    registry.invalidate()
+    correct &= not any(monitor.entered for monitor in backend.monitors) and forgotten == [True]
+    correct &= registry.active() is not None and registry.scans == 2
+
+    # Scanned in the background when the tool starts, well before the first keypress
+    backend = fakes.FakeMonitorControl(fake_monitors(read_latency))
+    registry = monitors.MonitorRegistry(backend)
+    registry.prewarm()
+    while registry.entries is None:
+        time.sleep(0.01)
+    started = time.perf_counter()
+    entry = registry.active()
+    result["prewarmed_us"] = (time.perf_counter() - started) * 1e6
+    correct &= entry is not None and entry.monitor is backend.monitors[2]
+    registry.invalidate()
+
+    result["correct"] = bool(correct)
+    return result
+
+
+def requested_values(presses: int) -> list[int]:
+    """
+    Brightnesses asked for by holding a hotkey, switching hotkeys at the limits.
+
+    Each value differs from the last, so the last one always needs writing.
+    """
+    brightness, direction = 50, 1
+    values = []
+    for _ in range(presses):
+        if not 0 <= brightness + direction * BRIGHTNESS_STEP <= 100:
+            direction = -direction
+        brightness += direction * BRIGHTNESS_STEP
+        values.append(brightness)
+    return values
+
+
+def hold(
+    values: list[int], press: t.Callable[[int], None], repeat_interval: float
+) -> tuple[latency.Histogram, float]:
+    """
+    Press at the repeat rate, or as soon as the last press returned if it's behind.
+
+    Returns how long presses took to return, and when the last one was due.
+    """
+    histogram = latency.Histogram()
+    started = time.monotonic()
+    for index, value in enumerate(values):
+        delay = started + index * repeat_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        pressed = time.perf_counter_ns()
+        press(value)
+        histogram.record(time.perf_counter_ns() - pressed)
+    return histogram, started + (len(values) - 1) * repeat_interval
+
+
+def summarize(
+    histogram: latency.Histogram,
+    monitor: fakes.FakeMonitor,
+    last_due: float,
+    values: list[int],
+    min_interval: float,
+) -> dict[str, t.Any]:
+    _, shown, final = monitor.writes[-1]
+    spaced = monitor.min_gap() >= min_interval - SPACING_TOLERANCE
+    return {
+        "p50_return_us": histogram.percentile(50) / 1e3,
+        "p99_return_us": histogram.percentile(99) / 1e3,
+        "max_return_us": histogram.max / 1e3,
+        "writes": len(monitor.writes),
+        "lag_after_last_press_ms": (shown - last_due) * 1e3,
+        "min_gap_ms": monitor.min_gap() * 1e3,
+        "correct": final == values[-1] and spaced,
+    }
+
+
+def synchronous_benchmark(
+    values: list[int], write_latency: float, repeat_interval: float
+) -> dict[str, t.Any]:
+    """Write each value from the hotkey callback, waiting out the gap like a DDC/CI driver."""
+    monitor = fakes.FakeMonitor(write_latency=write_latency)
+    last_write = -float("inf")
+
+    def press(value: int) -> None:
+        nonlocal last_write
+        time.sleep(max(0, last_write + writer.MIN_INTERVAL - time.monotonic()))
+        monitor.set_luminance(value)
+        last_write = time.monotonic()
+
+    histogram, last_due = hold(values, press, repeat_interval)
+    return summarize(histogram, monitor, last_due, values, writer.MIN_INTERVAL)
+
+
+def writer_benchmark(
+    values: list[int], write_latency: float, repeat_interval: float
+) -> dict[str, t.Any]:
+    monitor = fakes.FakeMonitor(write_latency=write_latency)
+    brightness_writer = writer.BrightnessWriter(monitor)
+    histogram, last_due = hold(values, brightness_writer.request, repeat_interval)
+    brightness_writer.flush()
+    brightness_writer.stop()
+    result = summarize(histogram, monitor, last_due, values, brightness_writer.min_interval)
+    result["superseded"] = brightness_writer.superseded
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--presses", type=int, default=60, help="key repeats while held")
+    parser.add_argument("--write-latency", type=float, default=0.04, help="seconds per write")
+    parser.add_argument("--repeat-interval", type=float, default=REPEAT_INTERVAL)
+    parser.add_argument("--read-latency", type=float, default=0.1, help="seconds per read")
+    parser.add_argument("--output", type=pathlib.Path, help="JSON file, stdout if omitted")
+    arguments = parser.parse_args()
+
+    values = requested_values(arguments.presses)
+    args = (values, arguments.write_latency, arguments.repeat_interval)
+    result = {
+        "presses": arguments.presses,
+        "write_latency_ms": arguments.write_latency * 1e3,
+        "first_keypress": discovery_benchmark(arguments.read_latency),
+        "synchronous": synchronous_benchmark(*args),
+        "writer": writer_benchmark(*args),
+    }
+    output = json.dumps(result, indent=2)
+    if arguments.output is None:
+        print(output)
+    else:
+        arguments.output.write_text(output + "\n")
+    if not result["first_keypress"]["correct"]:
+        raise SystemExit("The registry didn't find the monitor in use, or scanned too often.")
+    if not all(result[mode]["correct"] for mode in ("synchronous", "writer")):
+        raise SystemExit("The monitor didn't end at the last brightness, or writes weren't spaced.")
+
+
+if __name__ == "__main__":
+    main()
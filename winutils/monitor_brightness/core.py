@@ -1,14 +1,16 @@
+import threading
 import typing as t
 import monitorcontrol
-import sys
-from winutils._helpers import overlay
+from winutils._helpers import hooks, overlay, timers
+from winutils.monitor_brightness import monitors, writer
 import customtkinter as ctk
-import keyboard
 
 INCREASE_HOTKEY = "ctrl+shift+alt+right"
 DECREASE_HOTKEY = "ctrl+shift+alt+left"
 BRIGHTNESS_STEP = 5
 OVERLAY_TIMEOUT = 2.5
+# How long displays are given to settle after a change, before they're scanned again
+DISPLAY_SETTLE = 2
 
 info_overlay = overlay.BottomOverlay()
 info_overlay.frame.rowconfigure(0, weight=1, uniform="a")
@@ -43,15 +45,22 @@ def get_fg_slider_colour() -> str:
 class Handler:
     """Handles the entire application logic, and houses global instances."""
 
-    monitor: t.Optional[monitorcontrol.Monitor] = None
+    # The monitor being controlled, from the registry
+    monitor: t.Optional[monitors.MonitorEntry] = None
+    monitor_registry: t.Optional[monitors.MonitorRegistry] = None
+    display_listener: t.Optional[monitors.DisplayChangeListener] = None
+    # Writes the monitor's brightness, so hotkeys don't wait on DDC/CI
+    brightness_writer: t.Optional[writer.BrightnessWriter] = None
     brightness: t.Optional[int] = None
+    # Held by hotkeys while using the monitor, so a display change can't release it midway
+    monitor_lock = threading.RLock()
     running = False
-    increase_hotkey = None
-    decrease_hotkey = None
 
     @staticmethod
     def set_brightness(new_brightness: int) -> None:
         Handler.brightness = new_brightness
+        if Handler.monitor is not None:
+            Handler.monitor.luminance = new_brightness
         brightness_double.set(new_brightness / 100)
         brightness_int.set(new_brightness)
 
@@ -63,23 +72,49 @@ class Handler:
 
     @staticmethod
     def obtain_monitor() -> None:
+        """Take the first monitor showing this device from the registry, scanning if needed."""
         if Handler.monitor is not None:
             return
 
-        monitors = monitorcontrol.get_monitors()
-        for monitor in monitors:
-            monitor.__enter__()
-            if monitor.get_input_source() != monitorcontrol.InputSource.OFF:
-                Handler.monitor = monitor
-                brightness = monitor.get_luminance()
-                brightness = round(brightness / BRIGHTNESS_STEP) * BRIGHTNESS_STEP
-                Handler.set_brightness(brightness)
+        entry = Handler.monitor_registry.active()
+        if entry is None:
+            error_overlay.display(OVERLAY_TIMEOUT)
+            return
+        Handler.monitor = entry
+        Handler.brightness_writer = writer.BrightnessWriter(entry.monitor)
+        Handler.set_brightness(round(entry.luminance / BRIGHTNESS_STEP) * BRIGHTNESS_STEP)
 
-                return
-            else:
-                monitor.__exit__(*sys.exc_info())
+    @staticmethod
+    def release_monitor() -> None:
+        """Stop writing to the monitor, before the registry closes it."""
+        with Handler.monitor_lock:
+            if Handler.brightness_writer is not None:
+                Handler.brightness_writer.stop()
+            Handler.brightness_writer = None
+            Handler.monitor = None
+            Handler.brightness = None
+
+    @staticmethod
+    def prewarm_monitors() -> None:
+        """Scan the monitors in the background, so the next keypress doesn't wait on DDC/CI."""
+        if Handler.running:
+            Handler.monitor_registry.prewarm()
+
+    @staticmethod
+    def rescan_monitors() -> None:
+        """Forget the monitors found, and scan them again in the background."""
+        if Handler.running:
+            Handler.monitor_registry.rescan()
+
+    @staticmethod
+    def on_display_change() -> None:
+        """Forget the monitors straight away, and scan them again once displays settle."""
+        Handler.monitor_registry.invalidate()
+        Handler.prewarm_later()
 
-        error_overlay.display(OVERLAY_TIMEOUT)
+    @staticmethod
+    def prewarm_later() -> None:
+        """Call prewarm_monitors once display changes stop, set up when starting."""
 
     @staticmethod
     def increment_brightness() -> None:
@@ -88,12 +123,13 @@ class Handler:
 
         Also notify the user of the new scaling factor.
         """
-        Handler.obtain_monitor()
-        if Handler.monitor is None:
-            return
-        new_brightness = Handler.brightness + BRIGHTNESS_STEP
-        Handler.set_brightness(max(0, min(100, new_brightness)))
-        Handler.adjust_monitor_brightness()
+        with Handler.monitor_lock:
+            Handler.obtain_monitor()
+            if Handler.monitor is None:
+                return
+            new_brightness = Handler.brightness + BRIGHTNESS_STEP
+            Handler.set_brightness(max(0, min(100, new_brightness)))
+            Handler.adjust_monitor_brightness()
         Handler.display_brightness()
 
     @staticmethod
@@ -103,65 +139,73 @@ class Handler:
 
         Also notify the user of the new scaling factor.
         """
-        Handler.obtain_monitor()
-        if Handler.monitor is None:
-            return
-        new_brightness = Handler.brightness - BRIGHTNESS_STEP
-        Handler.set_brightness(max(0, min(100, new_brightness)))
-        Handler.adjust_monitor_brightness()
+        with Handler.monitor_lock:
+            Handler.obtain_monitor()
+            if Handler.monitor is None:
+                return
+            new_brightness = Handler.brightness - BRIGHTNESS_STEP
+            Handler.set_brightness(max(0, min(100, new_brightness)))
+            Handler.adjust_monitor_brightness()
         Handler.display_brightness()
 
     @staticmethod
     def adjust_monitor_brightness() -> None:
         """
-        Change the app volume based on the current system volume.
+        Request the monitor's brightness be changed to the current brightness.
 
-        The app and system volumes are inversely proportional.
+        This returns straight away, the brightness is written on the writer's thread.
         """
-        Handler.obtain_monitor()
-        if Handler.monitor is None:
-            return
-        Handler.monitor.set_luminance(Handler.brightness)
+        with Handler.monitor_lock:
+            Handler.obtain_monitor()
+            if Handler.monitor is None:
+                return
+            Handler.brightness_writer.request(Handler.brightness)
 
     @staticmethod
-    def start(suppress: bool) -> None:
-        """Listen to property changes, and hook the keyboard hotkey."""
+    def start() -> None:
+        """Watch for display changes, find the monitors, and hook the keyboard hotkey."""
         Handler.running = True
-        Handler.sync_hooks(suppress)
+        Handler.monitor_registry = monitors.MonitorRegistry(
+            monitorcontrol, on_invalidated=Handler.release_monitor
+        )
+        Handler.prewarm_later = timers.scheduler.debounce(
+            DISPLAY_SETTLE, Handler.prewarm_monitors
+        )
+        Handler.display_listener = monitors.DisplayChangeListener(Handler.on_display_change)
+        Handler.display_listener.start()
+        Handler.monitor_registry.prewarm()
+        Handler.sync_hooks()
 
     @staticmethod
     def stop() -> None:
-        """Stop listening to property changes, and unhook the keyboard hotkey."""
+        """Stop watching for display changes, close the monitors, and unhook the hotkey."""
         Handler.running = False
-        if Handler.monitor is not None:
-            Handler.monitor.__exit__(*sys.exc_info())
-        Handler.monitor = None
-        Handler.brightness = None
+        Handler.display_listener.stop()
+        Handler.monitor_registry.invalidate()
         Handler.cleanup_hooks()
 
     @staticmethod
     def cleanup_hooks() -> None:
         """Remove all exisiting keyboard hotkeys being used."""
-        if Handler.increase_hotkey is not None:
-            keyboard.remove_hotkey(Handler.increase_hotkey)
-        if Handler.decrease_hotkey is not None:
-            keyboard.remove_hotkey(Handler.decrease_hotkey)
+        hooks.registry.retract("monitor brightness")
+        hooks.registry.reconcile()
 
     @staticmethod
-    def sync_hooks(suppress: bool) -> None:
-        """Refresh the keyboard hotkeys being used."""
-        Handler.cleanup_hooks()
-        Handler.increase_hotkey = keyboard.add_hotkey(
-            INCREASE_HOTKEY, Handler.increment_brightness, suppress=suppress
-        )
-        Handler.decrease_hotkey = keyboard.add_hotkey(
-            DECREASE_HOTKEY, Handler.decrement_brightness, suppress=suppress
+    def sync_hooks() -> None:
+        """Declare the keyboard hotkeys being used, and apply them."""
+        hooks.registry.declare(
+            "monitor brightness",
+            hotkeys={
+                INCREASE_HOTKEY: hooks.Hotkey(Handler.increment_brightness),
+                DECREASE_HOTKEY: hooks.Hotkey(Handler.decrement_brightness),
+            },
         )
+        hooks.registry.reconcile()
 
     @staticmethod
-    def toggle(suppress: bool) -> None:
+    def toggle() -> None:
         """Toggle the state of the application."""
         if Handler.running:
             Handler.stop()
         else:
-            Handler.start(suppress)
+            Handler.start()
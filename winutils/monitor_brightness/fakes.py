@@ -0,0 +1,94 @@
+"""
+Stand-ins for monitorcontrol and its monitors, so monitors can be found and brightness
+written without DDC/CI.
+"""
+
+import enum
+import threading
+import time
+import typing as t
+
+
+class InputSource(enum.Enum):
+    """Some of monitorcontrol's input sources."""
+
+    OFF = 0x00
+    DP1 = 0x0F
+    HDMI1 = 0x11
+
+
+class FakeMonitor:
+    """
+    A monitor whose reads and writes take a set time, like DDC/CI commands.
+
+    Each write's start and end are recorded, so the gaps between commands can be checked.
+    A monitor without DDC/CI, like a laptop's panel, fails to open.
+    """
+
+    def __init__(
+        self,
+        luminance: int = 50,
+        write_latency: float = 0.04,
+        read_latency: float = 0.1,
+        input_source: InputSource = InputSource.DP1,
+        ddc: bool = True,
+    ) -> None:
+        self.luminance = luminance
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.input_source = input_source
+        self.ddc = ddc
+        self.reads = 0
+        self.writes: list[tuple[float, float, int]] = []
+        self.entered = False
+        self._busy = threading.Lock()
+
+    def __enter__(self) -> "FakeMonitor":
+        if not self.ddc:
+            raise OSError("no physical monitor found")
+        self.entered = True
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        self.entered = False
+
+    def _read(self, value: t.Any) -> t.Any:
+        with self._busy:
+            time.sleep(self.read_latency)
+            self.reads += 1
+            return value
+
+    def get_input_source(self) -> InputSource:
+        return self._read(self.input_source)
+
+    def get_luminance(self) -> int:
+        return self._read(self.luminance)
+
+    def set_luminance(self, value: int) -> None:
+        with self._busy:
+            started = time.monotonic()
+            time.sleep(self.write_latency)
+            self.luminance = value
+            self.writes.append((started, time.monotonic(), value))
+
+    def min_gap(self) -> float:
+        """The shortest time between one write ending and the next starting."""
+        gaps = [
+            started - ended
+            for (_, ended, _), (started, _, _) in zip(self.writes, self.writes[1:])
+        ]
+        return min(gaps, default=float("inf"))
+
+
+class FakeMonitorControl:
+    """The monitorcontrol module, listing a set of fake monitors."""
+
+    InputSource = InputSource
+
+    def __init__(self, monitors: list[FakeMonitor]) -> None:
+        self.monitors = monitors
+        self.listings = 0
+
+    def get_monitors(self) -> list[FakeMonitor]:
+        self.listings += 1
+        return list(self.monitors)
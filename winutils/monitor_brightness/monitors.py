@@ -0,0 +1,210 @@
+"""
+A registry of the connected monitors, scanned once and kept until the displays change.
+
+Finding a monitor to control means reading each monitor's input source and luminance over
+DDC/CI, which can take 100ms or more per read. Scans probe every monitor at once, and what
+they find is kept, including there being no monitor to control, until Windows broadcasts
+WM_DISPLAYCHANGE or a rescan is asked for. How long each scan takes is recorded in
+latency.registry, under "monitor scan".
+
+A backend is monitorcontrol, or fakes.FakeMonitorControl, with:
+    get_monitors(): every monitor, closed
+    InputSource: with OFF, the input source of a monitor showing another device
+"""
+
+import concurrent.futures
+import sys
+import threading
+import time
+import typing as t
+from winutils._helpers import latency
+
+try:
+    import win32api
+    import win32con
+    import win32gui
+except ImportError:  # Not on Windows, display changes can only be simulated
+    win32gui = None
+
+# Probing threads, which is how many monitors are probed at once
+MAX_PROBES = 8
+
+
+class MonitorEntry:
+    """A monitor found by a scan, open, with what was read from it."""
+
+    def __init__(self, index: int, monitor: t.Any) -> None:
+        self.index = index
+        self.monitor = monitor
+        # The logical monitor handle, which changes with the display layout
+        self.identity = getattr(getattr(monitor, "vcp", None), "hmonitor", index)
+        self.input_source: t.Any = None
+        # The last luminance read or written
+        self.luminance: t.Optional[int] = None
+        self.error: t.Optional[Exception] = None
+        self.opened = False
+        self.active = False
+
+    def probe(self, off: t.Any) -> "MonitorEntry":
+        """Open the monitor and read its input source and luminance."""
+        try:
+            self.monitor.__enter__()
+        except Exception as error:  # No DDC/CI, like a laptop's panel
+            self.error = error
+            return self
+        self.opened = True
+        try:
+            try:
+                self.input_source = self.monitor.get_input_source()
+            except ValueError as error:  # Inputs outside the spec, like USB-C
+                self.input_source = getattr(error, "value", None)
+            self.active = self.input_source != off
+            if self.active:
+                self.luminance = self.monitor.get_luminance()
+        except Exception as error:  # The monitor stopped responding mid-probe
+            self.error = error
+            self.active = False
+        return self
+
+    def close(self) -> None:
+        if not self.opened:
+            return
+        self.opened = False
+        try:
+            self.monitor.__exit__(*sys.exc_info())
+        except Exception:  # Already gone with the display change
+            pass
+
+
+class MonitorRegistry:
+    """
+    The monitors from the last scan, rescanning only after being invalidated.
+
+    `on_invalidated` is called once the monitors are forgotten but before they're closed,
+    so anything using one can let it go first, and can't find it again meanwhile.
+    """
+
+    def __init__(
+        self,
+        backend: t.Any,
+        on_invalidated: t.Optional[t.Callable[[], None]] = None,
+        max_probes: int = MAX_PROBES,
+    ) -> None:
+        self.backend = backend
+        self.on_invalidated = on_invalidated
+        self.max_probes = max_probes
+        self.entries: t.Optional[list[MonitorEntry]] = None
+        self.scans = 0
+        self.hits = 0
+        self.invalidations = 0
+        self.scan_times = latency.registry.histogram("monitor scan")
+        # Held while scanning, so a keypress during a background scan waits for it
+        self._scan_lock = threading.Lock()
+
+    def _scan(self) -> list[MonitorEntry]:
+        started = time.perf_counter_ns()
+        monitors = self.backend.get_monitors()
+        entries = [MonitorEntry(index, monitor) for index, monitor in enumerate(monitors)]
+        if entries:
+            off = self.backend.InputSource.OFF
+            with concurrent.futures.ThreadPoolExecutor(
+                min(len(entries), self.max_probes), thread_name_prefix="monitor probe"
+            ) as executor:
+                list(executor.map(lambda entry: entry.probe(off), entries))
+        self.entries = entries
+        self.scans += 1
+        self.scan_times.record(time.perf_counter_ns() - started)
+        return entries
+
+    def monitors(self) -> list[MonitorEntry]:
+        """The entries of the last scan, scanning if there wasn't one since invalidating."""
+        entries = self.entries
+        if entries is None:
+            with self._scan_lock:
+                # Another thread, like a background scan, may have scanned while waiting
+                if self.entries is None:
+                    return self._scan()
+                entries = self.entries
+        self.hits += 1
+        return entries
+
+    def active(self) -> t.Optional[MonitorEntry]:
+        """The first monitor showing this device, if any."""
+        return next((entry for entry in self.monitors() if entry.active), None)
+
+    def prewarm(self) -> None:
+        """Scan in the background if needed, so the next keypress finds the monitors."""
+        if self.entries is None:
+            threading.Thread(target=self.monitors, daemon=True, name="monitor scan").start()
+
+    def invalidate(self) -> None:
+        """Forget the monitors, closing them, so they're scanned again when next needed."""
+        self.invalidations += 1
+        with self._scan_lock:
+            entries, self.entries = self.entries, None
+        if self.on_invalidated is not None:
+            self.on_invalidated()
+        for entry in entries or []:
+            entry.close()
+
+    def rescan(self) -> None:
+        self.invalidate()
+        self.prewarm()
+
+    def report(self) -> dict[str, int]:
+        return {
+            "scans": self.scans,
+            "cache hits": self.hits,
+            "invalidations": self.invalidations,
+        }
+
+
+class DisplayChangeListener:
+    """
+    Calls back when the display layout or resolution changes.
+
+    WM_DISPLAYCHANGE is only broadcast to top-level windows, so a hidden one is created
+    and pumped on a thread of its own.
+    """
+
+    def __init__(self, on_change: t.Callable[[], None]) -> None:
+        self.on_change = on_change
+        self._hwnd: t.Optional[int] = None
+        self._thread: t.Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    def _window_procedure(self, hwnd: int, message: int, wparam: int, lparam: int) -> int:
+        if message == win32con.WM_DISPLAYCHANGE:
+            self.on_change()
+        elif message == win32con.WM_DESTROY:
+            win32gui.PostQuitMessage(0)
+        return 0
+
+    def _run(self) -> None:
+        window_class = win32gui.WNDCLASS()
+        window_class.lpszClassName = "WinutilsDisplayChange"
+        window_class.hInstance = win32api.GetModuleHandle(None)
+        window_class.lpfnWndProc = {
+            win32con.WM_DISPLAYCHANGE: self._window_procedure,
+            win32con.WM_DESTROY: self._window_procedure,
+        }
+        atom = win32gui.RegisterClass(window_class)
+        self._hwnd = win32gui.CreateWindow(
+            atom, "Winutils display change", 0, 0, 0, 0, 0, 0, 0, window_class.hInstance, None
+        )
+        self._ready.set()
+        win32gui.PumpMessages()
+        win32gui.UnregisterClass(atom, window_class.hInstance)
+
+    def start(self) -> None:
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="display change")
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._ready.wait()
+        win32gui.PostMessage(self._hwnd, win32con.WM_CLOSE, 0, 0)
+        self._thread.join()
+        self._thread = None
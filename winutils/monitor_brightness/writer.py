@@ -0,0 +1,98 @@
+"""
+Writes monitor brightness off the hotkey thread, only ever the latest value asked for.
+
+DDC/CI writes take tens of milliseconds, and monitors need a gap between commands. Each
+monitor gets a writer thread, so requesting a brightness returns straight away, and values
+requested while a write is in flight or spaced out replace each other, rather than queueing
+up. How long each write takes is recorded in latency.registry, under "brightness write".
+"""
+
+import threading
+import time
+import traceback
+import typing as t
+from winutils._helpers import latency
+
+# DDC/CI asks hosts to wait 50ms between commands
+MIN_INTERVAL = 0.05
+
+
+class BrightnessWriter:
+    """A thread writing a monitor's brightness, at most once every interval."""
+
+    def __init__(self, monitor: t.Any, min_interval: float = MIN_INTERVAL) -> None:
+        self.monitor = monitor
+        self.min_interval = min_interval
+        self.written: t.Optional[int] = None
+        self.requests = 0
+        self.writes = 0
+        # Requests replaced by a later one before being written
+        self.superseded = 0
+        self.failures = 0
+        self.write_times = latency.registry.histogram("brightness write")
+        self._pending: t.Optional[int] = None
+        self._writing = False
+        self._stopped = False
+        self._last_write = -float("inf")
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="brightness writer")
+        self._thread.start()
+
+    def request(self, brightness: int) -> None:
+        """Ask for a brightness to be written, replacing any still waiting."""
+        with self._condition:
+            self.requests += 1
+            if self._pending is not None:
+                self.superseded += 1
+            self._pending = brightness
+            self._condition.notify_all()
+
+    def _next(self) -> t.Optional[int]:
+        """Wait for a request and for the monitor to be ready, then take the latest one."""
+        with self._condition:
+            while True:
+                if self._pending is None:
+                    if self._stopped:
+                        return None
+                    self._condition.wait()
+                    continue
+                remaining = self._last_write + self.min_interval - time.monotonic()
+                # Pending writes are finished before stopping, without waiting to space them
+                if remaining > 0 and not self._stopped:
+                    self._condition.wait(remaining)
+                    continue
+                brightness, self._pending = self._pending, None
+                self._writing = True
+                return brightness
+
+    def _run(self) -> None:
+        while (brightness := self._next()) is not None:
+            if brightness != self.written:
+                started = time.perf_counter_ns()
+                try:
+                    self.monitor.set_luminance(brightness)
+                    self.written = brightness
+                    self.writes += 1
+                except Exception:  # The monitor was unplugged or stopped responding
+                    self.failures += 1
+                    traceback.print_exc()
+                self.write_times.record(time.perf_counter_ns() - started)
+            with self._condition:
+                # Spaced from the end of the write, as the monitor is busy until then
+                self._last_write = time.monotonic()
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self, timeout: t.Optional[float] = None) -> bool:
+        """Wait until every request has been written, returning False on timing out."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._pending is None and not self._writing, timeout
+            )
+
+    def stop(self) -> None:
+        """Write any pending request, then end the thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
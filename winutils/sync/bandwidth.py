@@ -0,0 +1,220 @@
+"""Adapts the bandwidth and concurrency of running rclone processes to the foreground load."""
+
+import json
+import socket
+import threading
+import typing as t
+import urllib.error
+import urllib.request
+from loguru import logger
+import psutil
+
+CONTROL_INTERVAL = 2
+RC_TIMEOUT = 1
+# Weight of the newest reading in the smoothed foreground load
+LOAD_SMOOTHING = 0.5
+# Disk throughput (bytes/s) by other processes that counts as a fully loaded disk
+DISK_BUSY_RATE = 100 * 1024**2
+
+# (highest foreground load %, total bandwidth in bytes/s or None for unlimited, transfers, checkers)
+LOAD_LEVELS = [
+    (20, None, 8, 16),
+    (50, 10 * 1024**2, 4, 8),
+    (80, 2 * 1024**2, 2, 4),
+    (100, 512 * 1024, 1, 2),
+]
+
+
+class Limits(t.NamedTuple):
+    bandwidth: t.Optional[int]
+    transfers: int
+    checkers: int
+
+
+def limits_for(load: float) -> Limits:
+    """Find the limits to apply at a foreground load percentage."""
+    for highest, bandwidth, transfers, checkers in LOAD_LEVELS:
+        if load <= highest:
+            return Limits(bandwidth, transfers, checkers)
+    return Limits(*LOAD_LEVELS[-1][1:])
+
+
+def free_port() -> int:
+    """Find a free local port for an rclone remote control server."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rc_arguments(address: str) -> list[str]:
+    """Create the arguments enabling rclone's remote control API at an address."""
+    return ["--rc", f"--rc-addr={address}", "--rc-no-auth"]
+
+
+class RcClient:
+    """A minimal client for rclone's remote control API."""
+
+    def __init__(self, address: str) -> None:
+        self.address = address
+        # The limits and share last applied successfully
+        self.applied: t.Optional[tuple[Limits, int]] = None
+
+    def call(self, command: str, parameters: dict) -> t.Optional[dict]:
+        """Call an rc command, returning None if the server couldn't be reached."""
+        request = urllib.request.Request(
+            f"http://{self.address}/{command}",
+            data=json.dumps(parameters).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=RC_TIMEOUT) as response:
+                return json.load(response)
+        except (urllib.error.URLError, OSError, ValueError) as error:
+            logger.debug("rc call {} to {} failed: {}", command, self.address, error)
+            return None
+
+    def apply(self, limits: Limits, share: int) -> bool:
+        """Apply limits, with the bandwidth divided between `share` processes."""
+        if self.applied == (limits, share):
+            return True
+        if limits.bandwidth is None:
+            rate = "off"
+        else:
+            rate = f"{max(1, limits.bandwidth // share // 1024)}K"
+        options = {"main": {"Transfers": limits.transfers, "Checkers": limits.checkers}}
+        if self.call("core/bwlimit", {"rate": rate}) is None:
+            return False
+        if self.call("options/set", options) is None:
+            return False
+        self.applied = (limits, share)
+        return True
+
+
+class ForegroundLoad:
+    """
+    Measures the load put on the machine by everything except the tracked processes.
+
+    The load is the higher of the CPU usage and the disk throughput (relative to
+    DISK_BUSY_RATE) of other processes, as a percentage.
+    """
+
+    def __init__(self) -> None:
+        self.processes: dict[int, psutil.Process] = {}
+        self._disk_bytes: t.Optional[int] = None
+        self._own_disk_bytes: dict[int, int] = {}
+        psutil.cpu_percent(interval=None)
+
+    def track(self, pid: int) -> None:
+        try:
+            process = psutil.Process(pid)
+            process.cpu_percent(interval=None)
+            self.processes[pid] = process
+        except psutil.Error:
+            pass
+
+    def untrack(self, pid: int) -> None:
+        self.processes.pop(pid, None)
+        self._own_disk_bytes.pop(pid, None)
+
+    def _own_disk_delta(self) -> int:
+        delta = 0
+        for pid, process in list(self.processes.items()):
+            try:
+                counters = process.io_counters()
+            except (psutil.Error, AttributeError):
+                continue
+            total = counters.read_bytes + counters.write_bytes
+            delta += total - self._own_disk_bytes.get(pid, total)
+            self._own_disk_bytes[pid] = total
+        return delta
+
+    def __call__(self, interval: float) -> float:
+        cpu = psutil.cpu_percent(interval=None)
+        own_cpu = 0.0
+        for process in list(self.processes.values()):
+            try:
+                own_cpu += process.cpu_percent(interval=None)
+            except psutil.Error:
+                continue
+        cpu = max(0.0, cpu - own_cpu / (psutil.cpu_count() or 1))
+
+        counters = psutil.disk_io_counters()
+        disk = 0.0
+        if counters is not None:
+            total = counters.read_bytes + counters.write_bytes
+            own = self._own_disk_delta()
+            if self._disk_bytes is not None:
+                others = max(0, total - self._disk_bytes - own)
+                disk = min(100.0, others / interval / DISK_BUSY_RATE * 100)
+            self._disk_bytes = total
+        return max(cpu, disk)
+
+
+class BandwidthController:
+    """
+    Periodically adjusts every attached rclone process to the smoothed foreground load.
+
+    Limits are only sent to a process when they, or the number of processes sharing the
+    bandwidth, change. Processes whose rc server isn't up yet are retried on the next step.
+    """
+
+    def __init__(
+        self,
+        load_probe: t.Optional[t.Callable[[float], float]] = None,
+        interval: float = CONTROL_INTERVAL,
+    ) -> None:
+        self.load_probe = load_probe if load_probe is not None else ForegroundLoad()
+        self.interval = interval
+        self.load = 0.0
+        self.limits = limits_for(0)
+        self.adjustments = 0
+        self.clients: dict[int, RcClient] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: t.Optional[threading.Thread] = None
+
+    def attach(self, pid: int, address: str) -> None:
+        """Start controlling an rclone process serving the rc API at an address."""
+        with self._lock:
+            self.clients[pid] = RcClient(address)
+            if isinstance(self.load_probe, ForegroundLoad):
+                self.load_probe.track(pid)
+
+    def detach(self, pid: int) -> None:
+        with self._lock:
+            self.clients.pop(pid, None)
+            if isinstance(self.load_probe, ForegroundLoad):
+                self.load_probe.untrack(pid)
+
+    def step(self) -> None:
+        """Measure the load once, and bring every process up to date with the limits."""
+        reading = self.load_probe(self.interval)
+        self.load += LOAD_SMOOTHING * (reading - self.load)
+        limits = limits_for(self.load)
+        if limits != self.limits:
+            logger.debug("Foreground load {:.0f}%, applying {}", self.load, limits)
+            self.limits = limits
+            self.adjustments += 1
+
+        with self._lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            client.apply(limits, len(clients))
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.step()
+            except Exception:  # Keep adjusting, a later step may succeed
+                logger.exception("Error adjusting the bandwidth limits")
+
+    def start(self) -> None:
+        """Start adjusting on a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread = None
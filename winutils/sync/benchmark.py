@@ -0,0 +1,415 @@
+"""
+Benchmarks the sync end to end on a synthetic tree, with a fake rclone and fake probes.
+
+Runs are triggered through the scheduler like in normal operation, and timed from the
+moment they're requested. The index is also checked to keep files of failed shards dirty,
+the bandwidth controller to follow a load ramp on fake rclone rc servers, and the last
+sync times from before the journal to be migrated.
+Results are written as JSON, to be compared across commits:
+
+    python -m winutils.sync.benchmark --directories 8 --files 50 --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from loguru import logger
+from winutils.sync import bandwidth, core, fakes, index, journal, sampler
+
+JOB = "regular"
+REMOTE = "benchmark:Data"
+# Foreground load at each controller step, rising to full load and back
+LOAD_RAMP = [0, 0, 100, 100, 100, 100, 100, 60, 60, 60, 60, 0, 0, 0, 0, 0, 0, 0]
+# The step at which the second rclone's rc server comes up
+LATE_SERVER_STEP = 3
+# Far enough that jobs only run when the benchmark asks for it
+NEVER = 10 * 365 * 24 * 60 * 60
+RUN_TIMEOUT = 10 * 60
+
+
+class TreeShape(t.NamedTuple):
+    directories: int
+    depth: int
+    files: int
+    file_size: int
+    packed: int
+
+
+def generate_tree(root: pathlib.Path, shape: TreeShape, seed: int = 0) -> list[pathlib.Path]:
+    """
+    Create a tree of `directories` top-level directories, each nested `depth` levels deep.
+
+    Every directory holds `files` files of about `file_size` bytes, and `packed` of the
+    top-level directories also hold a node_modules directory, to be packed into an archive.
+    Returns the files synced individually.
+    """
+    rng = random.Random(seed)
+    files = []
+
+    def fill(directory: pathlib.Path, count: int) -> list[pathlib.Path]:
+        directory.mkdir(parents=True, exist_ok=True)
+        created = []
+        for number in range(count):
+            size = rng.randint(shape.file_size // 2, shape.file_size * 3 // 2)
+            path = directory / f"file{number}.bin"
+            path.write_bytes(rng.randbytes(size))
+            created.append(path)
+        return created
+
+    for top in range(shape.directories):
+        directory = root / f"dir{top}"
+        for level in range(shape.depth):
+            files.extend(fill(directory, shape.files))
+            directory /= f"level{level + 1}"
+        if top < shape.packed:
+            fill(root / f"dir{top}" / "node_modules" / "package", shape.files)
+    return files
+
+
+def modify_files(files: t.Sequence[pathlib.Path], fraction: float, seed: int) -> int:
+    """Append to a fraction of the files, so their sizes change. Returns the number modified."""
+    rng = random.Random(seed)
+    chosen = rng.sample(list(files), max(1, round(len(files) * fraction)))
+    for path in chosen:
+        with open(path, "ab") as f:
+            f.write(rng.randbytes(16))
+    return len(chosen)
+
+
+def configure(tree: pathlib.Path, rclone_script: pathlib.Path) -> None:
+    """
+    Point the sync at the synthetic tree, and swap in the fake rclone and load probe.
+
+    The tree is laid out like FILES_HOME, with the sync's own state in it, and synced with
+    the regular job's excludes, so an unchanged tree only stays clean if they're excluded.
+    """
+    _, _, excludes = core.SYNC_TARGETS[JOB]
+    core.SYNC_TARGETS = {JOB: (tree, REMOTE, excludes)}
+    core.SYNC_JOBS = {JOB: (NEVER, 0, None)}
+    state = tree / core.SCRIPT_FILES.relative_to(core.FILES_HOME)
+    core.INDEX_FILE = state / core.INDEX_FILE.name
+    core.LOGS_DIR = state / core.LOGS_DIR.name
+    core.IDLE_MODEL_FILE = state / core.IDLE_MODEL_FILE.name
+    # A single sample decides idleness, instead of waiting for a full minute of them
+    core.IDLE_WINDOW = sampler.SAMPLE_INTERVAL
+    core.BackgroundSyncHandler.run_journal = journal.Journal(state / core.JOURNAL_FILE.name)
+    core.BackgroundSyncHandler.rclone_command = fakes.FAKE_RCLONE_COMMAND
+    core.BackgroundSyncHandler.load_probe = lambda interval: 0.0
+    os.environ["FAKE_RCLONE_SCRIPT"] = str(rclone_script)
+
+
+def idle_resources() -> list[sampler.Resource]:
+    """Create resources whose probes always report an idle machine."""
+    return [
+        sampler.Resource(
+            "CPU", fakes.ScriptedProbe([0]), core.CPU_USAGE_THRESHOLD, below=True, bound=0
+        ),
+        sampler.Resource(
+            "RAM",
+            fakes.ScriptedProbe([core.RAM_NEEDED * 2]),
+            core.RAM_NEEDED,
+            below=False,
+            bound=core.RAM_NEEDED * 2,
+        ),
+    ]
+
+
+class RunTimer:
+    """Times the stages of runs by wrapping BackgroundSyncHandler.perform_sync."""
+
+    def __init__(self) -> None:
+        self.requested = 0.0
+        self.started = 0.0
+        self.finished: queue.Queue[tuple[float, journal.RunRecord]] = queue.Queue()
+        self._perform_sync = core.BackgroundSyncHandler.perform_sync
+
+    def perform_sync(self, name: str) -> journal.RunRecord:
+        self.started = time.monotonic()
+        record = self._perform_sync(name)
+        self.finished.put((time.monotonic(), record))
+        return record
+
+    def install(self) -> None:
+        core.BackgroundSyncHandler.perform_sync = staticmethod(self.perform_sync)
+
+    def uninstall(self) -> None:
+        core.BackgroundSyncHandler.perform_sync = staticmethod(self._perform_sync)
+
+    def request(self) -> None:
+        """Mark the time a run is requested, and forget the previous run's executor."""
+        core.Threads.shard_executor = None
+        self.requested = time.monotonic()
+
+    def wait(self, scenario: str) -> dict[str, t.Any]:
+        """Wait for the requested run to finish, and collect its measurements."""
+        finished, record = self.finished.get(timeout=RUN_TIMEOUT)
+        scan = core.BackgroundSyncHandler.last_scan
+        shard_executor = core.Threads.shard_executor
+        first_transfer = None
+        if shard_executor is not None and shard_executor.progress.first_transfer is not None:
+            first_transfer = shard_executor.progress.first_transfer - self.requested
+        return {
+            "scenario": scenario,
+            "scheduler_overhead": self.started - self.requested,
+            "time_to_first_transfer": first_transfer,
+            "scan_duration": scan.duration,
+            "scanned_files": len(scan.entries),
+            "dirty_files": len(scan.dirty),
+            "wall_time": finished - self.requested,
+            "bytes": record.bytes,
+            "files": record.files,
+            "exit_code": record.exit_code,
+        }
+
+
+def git_commit() -> t.Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=pathlib.Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def index_check() -> dict[str, bool]:
+    """
+    Commit a scan as if one shard failed, checking its modified file is still dirty after.
+
+    A file whose mtime changed without its contents changing is checked to be refreshed
+    when hashing, even outside the synced paths. A .git file, like a worktree's, is checked
+    to be indexed although .git directories are excluded by name.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as workspace:
+        workspace = pathlib.Path(workspace)
+        for hash_files in (False, True):
+            tree = workspace / f"hashed {hash_files}"
+            (tree / "A").mkdir(parents=True)
+            (tree / "B").mkdir()
+            modified, touched = tree / "A" / "f", tree / "B" / "g"
+            modified.write_bytes(b"before")
+            touched.write_bytes(b"same")
+            (tree / "B" / ".git").write_text("gitdir: ../.git/worktrees/B")
+            file_index = index.FileIndex(
+                workspace / f"index {hash_files}.sqlite3",
+                tree,
+                excluded_names=core.COMPRESSION_TARGETS,
+                hash_files=hash_files,
+            )
+            file_index.commit(file_index.scan())
+
+            modified.write_bytes(b"after, and longer")
+            stat = touched.stat()
+            os.utime(touched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            # Only shard B synced, shard A failed
+            scan = file_index.scan()
+            file_index.commit(scan, [path for path in scan.dirty if path.startswith("B/")])
+
+            rescan = file_index.scan()
+            correct = "A/f" in rescan.dirty and "B/.git" in rescan.entries
+            if hash_files:
+                stored = file_index.stored()["B/g"]
+                correct &= stored[1] == touched.stat().st_mtime_ns
+            results["hashed" if hash_files else "unhashed"] = correct
+    results["correct"] = all(results.values())
+    return results
+
+
+def migration_check() -> dict[str, bool]:
+    """
+    Start from a legacy last sync file as the old sync wrote it, checking the journal is seeded.
+
+    The regular sync is a day old, written without its hour, and the large sync was never
+    done. An existing journal is checked to be left alone.
+    """
+    previous_journal = core.BackgroundSyncHandler.run_journal
+    with tempfile.TemporaryDirectory() as workspace:
+        workspace = pathlib.Path(workspace)
+        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+        legacy_format = "%d %b %Y, %:%M:%S %z"
+        core.LEGACY_SYNC_FILE = workspace / ".last_sync"
+        core.LEGACY_SYNC_FILE.write_text(
+            f"Regular: {yesterday.strftime(legacy_format)}\n"
+            f"Large: {datetime.datetime.min.strftime(legacy_format)}\n"
+        )
+        core.BackgroundSyncHandler.run_journal = journal.Journal(workspace / "journal.jsonl")
+        try:
+            core.BackgroundSyncHandler.migrate_legacy_sync_times()
+            regular = core.BackgroundSyncHandler.last_successful_run("regular")
+            large = core.BackgroundSyncHandler.last_successful_run("large")
+            start_of_day = yesterday.replace(hour=0, minute=0, second=0, microsecond=0)
+            core.BackgroundSyncHandler.migrate_legacy_sync_times()
+            records = list(core.BackgroundSyncHandler.run_journal.reversed())
+        finally:
+            core.BackgroundSyncHandler.run_journal = previous_journal
+
+    results = {
+        "seeded": regular is not None and start_of_day.timestamp() <= regular.end,
+        "never_synced": large is None,
+        "migrated_once": len(records) == 1,
+    }
+    results["correct"] = all(results.values())
+    return results
+
+
+def expected_state(load: float, share: int) -> tuple[str, dict[str, int]]:
+    """The bandwidth and options an rc server should have at a load, split `share` ways."""
+    limits = bandwidth.limits_for(load)
+    rate = "off" if limits.bandwidth is None else f"{max(1, limits.bandwidth // share // 1024)}K"
+    return rate, {"Transfers": limits.transfers, "Checkers": limits.checkers}
+
+
+def bandwidth_check() -> dict[str, t.Any]:
+    """
+    Step the bandwidth controller through LOAD_RAMP, with two rclone rc servers attached.
+
+    The second server only comes up partway, so the controller has to retry it. After every
+    step, each server that's up is checked to have the limits for the smoothed load, with
+    the bandwidth split between both. The second is then detached, so the first gets it all.
+    """
+    probe = fakes.ScriptedProbe([0])
+    controller = bandwidth.BandwidthController(lambda interval: probe(), interval=0)
+    servers = [fakes.FakeRcServer().start()]
+    late_address = f"127.0.0.1:{bandwidth.free_port()}"
+    controller.attach(0, servers[0].address)
+    controller.attach(1, late_address)
+
+    correct = True
+    levels = set()
+    try:
+        for step, load in enumerate(LOAD_RAMP):
+            if step == LATE_SERVER_STEP:
+                servers.append(fakes.FakeRcServer(late_address).start())
+            probe.set([load])
+            controller.step()
+            levels.add(controller.limits)
+            expected = expected_state(controller.load, 2)
+            correct &= all(
+                (server.bandwidth, server.options["main"]) == expected for server in servers
+            )
+        controller.detach(1)
+        controller.step()
+        correct &= (servers[0].bandwidth, servers[0].options["main"]) == expected_state(
+            controller.load, 1
+        )
+    finally:
+        for server in servers:
+            server.stop()
+
+    rates = [
+        parameters["rate"] for command, parameters in servers[0].calls if command == "core/bwlimit"
+    ]
+    # Every level is visited, and limits are sent once, then only when they or the share change
+    correct &= len(levels) == len(bandwidth.LOAD_LEVELS)
+    correct &= len(rates) == 1 + controller.adjustments + 1
+    return {
+        "steps": len(LOAD_RAMP) + 1,
+        "adjustments": controller.adjustments,
+        "levels_visited": len(levels),
+        "rates_sent": rates,
+        "late_server_calls": len(servers[1].calls),
+        "correct": bool(correct),
+    }
+
+
+def benchmark(shape: TreeShape, repeat: int, modified: float, rclone_delay: float) -> dict:
+    """Run the initial sync of a synthetic tree, then unchanged and incremental syncs."""
+    runs = []
+    with tempfile.TemporaryDirectory() as workspace:
+        workspace = pathlib.Path(workspace)
+        tree = workspace / "Data"
+        generated = time.perf_counter()
+        files = generate_tree(tree, shape)
+        generated = time.perf_counter() - generated
+        rclone_script = workspace / "rclone.json"
+        rclone_script.write_text(json.dumps({"default": [{"exit_code": 0, "delay": rclone_delay}]}))
+        configure(tree, rclone_script)
+
+        timer = RunTimer()
+        timer.install()
+        try:
+            # Without a previous run in the journal, the job is due as soon as it's added
+            timer.request()
+            core.BackgroundSyncHandler.start(idle_resources())
+            runs.append(timer.wait("initial"))
+            for iteration in range(repeat):
+                timer.request()
+                core.Threads.sync_scheduler.run_now(JOB, force=False)
+                runs.append(timer.wait("unchanged"))
+
+                modify_files(files, modified, seed=iteration)
+                timer.request()
+                core.Threads.sync_scheduler.run_now(JOB, force=False)
+                runs.append(timer.wait("incremental"))
+        finally:
+            core.BackgroundSyncHandler.stop()
+            timer.uninstall()
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shape": shape._asdict(),
+        "files": len(files),
+        "generation_time": generated,
+        "modified_fraction": modified,
+        "rclone_delay": rclone_delay,
+        "runs": runs,
+        "index_check": index_check(),
+        "bandwidth_check": bandwidth_check(),
+        "migration_check": migration_check(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--directories", type=int, default=8, help="top-level directories")
+    parser.add_argument("--depth", type=int, default=3, help="nesting levels per directory")
+    parser.add_argument("--files", type=int, default=20, help="files per directory level")
+    parser.add_argument("--file-size", type=int, default=4096, help="mean file size in bytes")
+    parser.add_argument("--packed", type=int, default=2, help="directories with a node_modules")
+    parser.add_argument("--repeat", type=int, default=3, help="unchanged/incremental rounds")
+    parser.add_argument("--modified", type=float, default=0.05, help="fraction modified per round")
+    parser.add_argument("--rclone-delay", type=float, default=0, help="fake rclone run time")
+    parser.add_argument("--output", type=pathlib.Path, help="JSON file, stdout if omitted")
+    parser.add_argument("--verbose", action="store_true", help="show the sync's logs")
+    arguments = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG" if arguments.verbose else "WARNING")
+
+    shape = TreeShape(
+        arguments.directories, arguments.depth, arguments.files, arguments.file_size, arguments.packed
+    )
+    results = benchmark(shape, arguments.repeat, arguments.modified, arguments.rclone_delay)
+    output = json.dumps(results, indent=2)
+    if arguments.output is None:
+        print(output)
+    else:
+        arguments.output.write_text(output + "\n")
+    if any(run["dirty_files"] for run in results["runs"] if run["scenario"] == "unchanged"):
+        raise SystemExit("An unchanged tree had dirty files, like the sync's own state.")
+    if not results["index_check"]["correct"]:
+        raise SystemExit("A file of a failed shard was recorded as synced.")
+    if not results["bandwidth_check"]["correct"]:
+        raise SystemExit("The bandwidth controller didn't apply the limits for the load.")
+    if not results["migration_check"]["correct"]:
+        raise SystemExit("The legacy last sync times weren't migrated to the journal.")
+
+
+if __name__ == "__main__":
+    main()
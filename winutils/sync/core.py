@@ -2,65 +2,70 @@ import typing as t
 import threading
 from loguru import logger
 import datetime
-import psutil
-import GPUtil
 import pathlib
 import time
 import uuid
-from winutils._helpers import process
-import re
+from winutils.sync import bandwidth, executor, index, journal, packer, predictor, sampler, scheduler
 
-assert len(GPUtil.getGPUs()) == 1
 
 class Threads:
-    sync_thread: t.Optional[threading.Thread] = None
-    sync_thread_id: t.Optional[uuid.UUID] = None
-    gpu_check_thread: t.Optional[threading.Thread] = None
-    ram_check_thread: t.Optional[threading.Thread] = None
+    sync_scheduler: t.Optional[scheduler.Scheduler] = None
+    shard_executor: t.Optional[executor.ShardExecutor] = None
+    resource_sampler: t.Optional[sampler.ResourceSampler] = None
+    idle_predictor: t.Optional[predictor.IdlePredictor] = None
 
 SYNC_LOCK = threading.Lock()
 
-# https://github.com/chalk/ansi-regex/blob/main/index.js
-ANSI_REGEX = re.compile(
-    [
-		'[\\u001B\\u009B][[\\]()#;?]*(?:(?:(?:(?:;[-a-zA-Z\\d\\/#&.:=?%@~_]+)*|[a-zA-Z\\d]+(?:;[-a-zA-Z\\d\\/#&.:=?%@~_]*)*)?\\u0007)',
-		'(?:(?:\\d{1,4}(?:;\\d{0,4})*)?[\\dA-PR-TZcf-nq-uy=><~]))'
-	].join('|')
-)
-
 FILES_HOME = pathlib.Path.home() / "Data"
 LARGE_BACKUPS = FILES_HOME / "Backups" / "Large"
 SCRIPT_FILES = FILES_HOME / "Sync"
 
-LASTSYNC_DATETIME_FORMAT = "%d %b %Y, %:%M:%S %z"
 FILE_DATETIME_FORMAT = "%Y-%m-%d %H-%M-%S"
-# Regular: DATETIME_FORMAT
-# Large: DATETIME_FORMAT
-PREVIOUS_SYNC_FILE  = SCRIPT_FILES / ".last_sync"
-
+JOURNAL_FILE = SCRIPT_FILES / "journal.jsonl"
+IDLE_MODEL_FILE = SCRIPT_FILES / "idle_model.json"
+INDEX_FILE = SCRIPT_FILES / ".index.sqlite3"
+LOGS_DIR = SCRIPT_FILES / "Logs"
+# Last sync times from before the journal, used to seed it
+LEGACY_SYNC_FILE = SCRIPT_FILES / ".last_sync"
+# The format was written with "%:" in place of "%H", which some platforms kept literally
+LEGACY_DATETIME_FORMATS = ["%d %b %Y, %H:%M:%S %z", "%d %b %Y, %H:%M:%S", "%d %b %Y"]
+LEGACY_JOB_NAMES = {"Regular": "regular", "Large": "large"}
+
+SYNC_REMOTE = "backup:Data"
+LARGE_BACKUPS_RELATIVE = LARGE_BACKUPS.relative_to(FILES_HOME).as_posix()
+# The sync's own state changes on every run, and is written to while syncing
+SCRIPT_FILES_RELATIVE = SCRIPT_FILES.relative_to(FILES_HOME).as_posix()
+# name: (source, destination, excludes relative to the source)
+SYNC_TARGETS = {
+    "regular": (FILES_HOME, SYNC_REMOTE, [LARGE_BACKUPS_RELATIVE, SCRIPT_FILES_RELATIVE]),
+    "large": (LARGE_BACKUPS, f"{SYNC_REMOTE}/{LARGE_BACKUPS_RELATIVE}", []),
+}
+
+# Directories with these names are packed into single archives instead of synced file by file
 COMPRESSION_TARGETS = [
-    ".git/",
-    "node_modules/",
-    "venv/",
+    ".git",
+    "node_modules",
+    "venv",
 ]
-SYNC_INTERVAL = 3 * 60 * 60 # 6 hours
+SYNC_INTERVAL = 3 * 60 * 60 # 3 hours
 LARGE_BACKUPS_SYNC_INTERVAL = 7 * 24 * 60 * 60 # 7 days
 
-RAM_NEEDED = 5745
-RAM_POLL_INTERVAL = 5
-RAM_POLLS = 12
+# Syncs postponed past their deadline run even if the machine is busy
+# name: (interval, jitter, deadline)
+SYNC_JOBS = {
+    "regular": (SYNC_INTERVAL, 10 * 60, SYNC_INTERVAL),
+    "large": (LARGE_BACKUPS_SYNC_INTERVAL, 60 * 60, 24 * 60 * 60),
+}
 
+# Resources are sampled continuously, and must have been idle on average over the window
+RAM_NEEDED = 5745  # MiB
 CPU_USAGE_THRESHOLD = 30
-# Poll for 2 seconds, once every 5 seconds, 12 times (1 minute total)
-CPU_POLL_INTERVAL = 5
-CPU_POLL_DURATION = 2
-CPU_POLLS = 12
-
 GPU_USAGE_THRESHOLD = 30
-GPU_POLL_INTERVAL = 5
-GPU_POLLS = 12
+IDLE_WINDOW = 60
 
 POLL_FAIL_WAIT = 5 * 60
+# Failed syncs are retried after this long, rather than waiting for their next interval
+SYNC_FAIL_WAIT = 30 * 60
 
 
 # 0 - success
@@ -76,8 +81,7 @@ POLL_FAIL_WAIT = 5 * 60
 # 10 - Duration exceeded - limit set by --max-duration reached
 
 
-BASE_SYNC_COMMAND = [
-    "rclone",
+BASE_SYNC_ARGUMENTS = [
     "--color=always",
     "sync",
     "--track-renames",
@@ -90,153 +94,250 @@ BASE_SYNC_COMMAND = [
     "--track-renames-strategy=modtime,leaf",
 ]
 
-assert CPU_POLLS * CPU_POLL_INTERVAL == GPU_POLLS * GPU_POLL_INTERVAL == RAM_POLLS * RAM_POLL_INTERVAL
+
+def default_resources() -> list[sampler.Resource]:
+    """Create the resources to be sampled on this machine."""
+    resources = [
+        sampler.Resource("CPU", sampler.cpu_usage, CPU_USAGE_THRESHOLD, below=True, bound=0),
+        sampler.Resource(
+            "RAM", sampler.available_ram, RAM_NEEDED, below=False, bound=sampler.total_ram()
+        ),
+    ]
+    if sampler.has_single_gpu():
+        resources.append(
+            sampler.Resource("GPU", sampler.gpu_usage, GPU_USAGE_THRESHOLD, below=True, bound=0)
+        )
+    else:
+        logger.warning("Exactly one GPU is needed for GPU sampling. Skipping GPU checks.")
+    return resources
+
+
+def read_legacy_sync_times(path: pathlib.Path) -> dict[str, float]:
+    """
+    Read the last sync time of each job from the file used before the journal.
+
+    Times missing their hour are taken as the start of their day, and times that can't be
+    read, like the placeholder for never having synced, are left out.
+    """
+    try:
+        lines = path.read_text().splitlines()
+    except FileNotFoundError:
+        return {}
+
+    times = {}
+    for line in lines:
+        label, _, value = line.partition(":")
+        name = LEGACY_JOB_NAMES.get(label.strip())
+        value = value.strip()
+        if name is None:
+            continue
+        if "%:" in value:
+            value = value.split(",")[0]
+        for format in LEGACY_DATETIME_FORMATS:
+            try:
+                timestamp = datetime.datetime.strptime(value, format).timestamp()
+            except (ValueError, OverflowError, OSError):
+                continue
+            if 0 < timestamp <= time.time():
+                times[name] = timestamp
+            break
+    return times
 
 
 class BackgroundSyncHandler:
     """Handles the entire application logic, and houses global instances."""
 
     running = False
+    rclone_command: list[str] = executor.RCLONE_COMMAND
+    # Measures the foreground load during runs, None for the real CPU and disk load
+    load_probe: t.Optional[t.Callable[[float], float]] = None
+    last_scan: t.Optional[index.ScanResult] = None
+    run_journal = journal.Journal(JOURNAL_FILE)
 
     @staticmethod
-    def cpu_is_idle() -> bool:
-        """Find whether the CPU is sufficiently idle."""
-        cpu_usage = 0
-        for _ in range(CPU_POLLS):
-            current_cpu = psutil.cpu_percent(interval=CPU_POLL_DURATION)
-            logger.trace("CPU Usage: {}%", current_cpu)
-            cpu_usage += current_cpu
-            time.sleep(CPU_POLL_INTERVAL - CPU_POLL_DURATION)
-
-        logger.debug("Average CPU Usage: {}%", cpu_usage / CPU_POLLS)
-        return cpu_usage / CPU_POLLS < CPU_USAGE_THRESHOLD
+    def resources_idle() -> bool:
+        """
+        Find whether the CPU, GPU and RAM have been sufficiently idle.
+
+        This returns immediately once the sampler has a full window of history. If a probe
+        keeps failing, the window never fills, so after POLL_FAIL_WAIT it counts as not idle.
+        """
+        resource_sampler = Threads.resource_sampler
+        is_idle = resource_sampler.wait_until_idle(IDLE_WINDOW, timeout=POLL_FAIL_WAIT)
+        if resource_sampler.running and resource_sampler.is_idle(IDLE_WINDOW) is None:
+            logger.warning("Timed out waiting for resource samples, treating as not idle")
+        logger.debug("Resource usage: {} (idle: {})", resource_sampler.means(IDLE_WINDOW), is_idle)
+        return is_idle
 
     @staticmethod
-    def gpu_is_idle() -> bool:
-        """Find whether the GPU is sufficiently idle."""
-        gpu_usage = 0
-        for _ in range(GPU_POLLS):
-            current_gpu_usage = GPUtil.getGPUs()[0].load
-            gpu_usage += current_gpu_usage
-            time.sleep(GPU_POLL_INTERVAL)
-
-        logger.debug("Average GPU Usage: {}%", gpu_usage / GPU_POLLS)
-        return gpu_usage / GPU_POLLS < GPU_USAGE_THRESHOLD
+    def last_successful_run(name: str) -> t.Optional[journal.RunRecord]:
+        """Find the most recent successful run of a sync job."""
+        return BackgroundSyncHandler.run_journal.latest(
+            name, lambda record: record.exit_code in executor.SUCCESS_EXIT_CODES
+        )
 
     @staticmethod
-    def ram_is_available() -> bool:
-        """Find whether the RAM is sufficiently available."""
-        ram_usage = 0
-        for _ in range(RAM_POLLS):
-            current_ram_usage = psutil.virtual_memory().available / (1024 ** 3)
-            logger.trace("RAM Usage: {}GB", current_ram_usage)
-            ram_usage += current_ram_usage 
-            time.sleep(RAM_POLL_INTERVAL)
-
-        logger.debug("Average RAM Usage: {}GB", ram_usage / RAM_POLLS)
-        return ram_usage / RAM_POLLS < RAM_NEEDED
+    def migrate_legacy_sync_times() -> None:
+        """Seed an empty journal with the last sync times from before it, so jobs aren't due."""
+        run_journal = BackgroundSyncHandler.run_journal
+        if next(run_journal.reversed(), None) is not None:
+            return
+        for name, end in read_legacy_sync_times(LEGACY_SYNC_FILE).items():
+            logger.info("Seeding the {} job's last run from {}", name, LEGACY_SYNC_FILE)
+            run_journal.append(journal.RunRecord(uuid.uuid4().hex, name, end, end, 0, 0, 0))
 
     @staticmethod
-    def read_last_sync_data():
-        """Read the last sync data from the file."""
-        try:
-            previous_sync_data = PREVIOUS_SYNC_FILE.read_text().splitlines()
-        except FileNotFoundError:
-            logger.info("Previous sync data not found. Creating data with defaults")
-            BackgroundSyncHandler.write_last_sync_data(datetime.datetime.min, datetime.datetime.min)
-            return None, None
+    def attempt_sync(job: scheduler.SyncJob, forced: bool) -> t.Optional[float]:
+        """
+        Run a scheduled sync job once the resources are idle.
+
+        Returns the delay after which the job should be retried, if the sync didn't happen or
+        failed. Rather than polling every POLL_FAIL_WAIT, retries are put off until the next
+        window in which the machine is predicted to be idle for as long as the sync usually
+        takes. Failed syncs are retried after SYNC_FAIL_WAIT.
+        """
+        if not forced:
+            logger.debug("Checking resources availability for {} sync", job.name)
+            is_idle = BackgroundSyncHandler.resources_idle()
+            Threads.idle_predictor.record_check(job.name, is_idle)
+            if not is_idle:
+                durations = [
+                    record.duration
+                    for record in BackgroundSyncHandler.run_journal.recent(
+                        job.name, predictor.DURATION_HISTORY
+                    )
+                ]
+                latest = None
+                if job.deadline is not None and job.due_since is not None:
+                    latest = job.due_since + job.deadline
+                expected_duration = predictor.IdlePredictor.expected_duration(durations)
+                delay = Threads.idle_predictor.retry_delay(
+                    job.name, time.time(), expected_duration, latest
+                )
+                logger.debug("Conditions not met. Retrying in {:.0f} seconds.", delay)
+                return delay
 
         try:
-            first_date = previous_sync_data[0].split(":", 1)[1].lstrip()
-            second_date = previous_sync_data[1].split(":", 1)[1].lstrip()
-
-            previous_regular_sync_time = datetime.datetime.strptime(first_date, LASTSYNC_DATETIME_FORMAT)
-            previous_large_sync_time = datetime.datetime.strptime(second_date, LASTSYNC_DATETIME_FORMAT)
-
-            if previous_regular_sync_time > datetime.datetime.now() or previous_large_sync_time > datetime.datetime.now():
-                raise ValueError("Dates in the future")
-        except ValueError:
-            logger.warning("Error reading previous sync time. Resetting.")
-            BackgroundSyncHandler.write_last_sync_data(datetime.datetime.min, datetime.datetime.min)
-            return None, None
-
-        return previous_regular_sync_time, previous_large_sync_time
+            record = BackgroundSyncHandler.perform_sync(job.name)
+        except Exception:
+            logger.exception("{} sync failed. Retrying in {} seconds.", job.name, SYNC_FAIL_WAIT)
+            return SYNC_FAIL_WAIT
+        if record.exit_code not in executor.SUCCESS_EXIT_CODES:
+            logger.warning("{} sync failed. Retrying in {} seconds.", job.name, SYNC_FAIL_WAIT)
+            return SYNC_FAIL_WAIT
+        return None
 
     @staticmethod
-    def write_last_sync_data(regular_sync_time: datetime.datetime, large_sync_time: datetime.datetime):
-        """Write the last sync data to the file."""
-        PREVIOUS_SYNC_FILE.write_text(
-            f"Regular: {regular_sync_time.strftime(LASTSYNC_DATETIME_FORMAT)}\n"
-            f"Large: {large_sync_time.strftime(LASTSYNC_DATETIME_FORMAT)}\n"
-        )
+    def create_jobs() -> list[scheduler.SyncJob]:
+        """Create the scheduled sync jobs, due as per their last successful runs."""
+        jobs = []
+        for name, (interval, jitter, deadline) in SYNC_JOBS.items():
+            last_run = BackgroundSyncHandler.last_successful_run(name)
+            jobs.append(
+                scheduler.SyncJob(
+                    name,
+                    interval,
+                    BackgroundSyncHandler.attempt_sync,
+                    jitter=jitter,
+                    deadline=deadline,
+                    failure_retry=SYNC_FAIL_WAIT,
+                    last_run=last_run and last_run.end,
+                )
+            )
+        return jobs
 
     @staticmethod
-    def sync_watch(id: uuid.UUID):
-        """Queues syncs after appropriate waits."""
-
-        previous_regular_sync_time, previous_large_sync_time = BackgroundSyncHandler.read_last_sync_data()
-
-        while True:
-            regular_sync_wait = large_sync_wait = 0
-
-            if previous_regular_sync_time is not None:
-                regular_sync_wait = SYNC_INTERVAL - (datetime.datetime.now() - previous_regular_sync_time).total_seconds()
-                regular_sync_wait = max(regular_sync_wait, 0)
-                logger.trace("Regular sync wait: {} seconds", regular_sync_wait)
-            if previous_large_sync_time is not None:
-                large_sync_wait = LARGE_BACKUPS_SYNC_INTERVAL - (datetime.datetime.now() - previous_large_sync_time).total_seconds()
-                large_sync_wait = max(large_sync_wait, 0)
-                logger.trace("Large sync wait: {} seconds", large_sync_wait)
-
-            wait_required = min(regular_sync_wait, large_sync_wait)
-            if wait_required > 0:
-                logger.debug("Waiting for {} seconds", wait_required)
-                time.sleep(wait_required)
-                continue
-
-            if Threads.sync_thread_id != id:
-                logger.debug("Sync thread ID changed. Exiting.")
-                break
-
-            logger.debug("Checking resources availability")
-            Threads.gpu_check_thread = threading.Thread(target=BackgroundSyncHandler.gpu_is_idle, daemon=True)
-            Threads.gpu_check_thread.start()
-            Threads.ram_check_thread = threading.Thread(target=BackgroundSyncHandler.ram_is_available, daemon=True)
-            Threads.ram_check_thread.start()
-
-            cpu_idle = BackgroundSyncHandler.cpu_is_idle()
-            gpu_idle = Threads.gpu_check_thread.join()
-            ram_available = Threads.ram_check_thread.join()
+    def sync_now(name: str = "regular") -> None:
+        """Run a sync job right away, without waiting for the resources to be idle."""
+        if not BackgroundSyncHandler.running:
+            logger.warning("Backup process not running.")
+            return
+        Threads.sync_scheduler.run_now(name)
 
-            if cpu_idle and gpu_idle and ram_available:
-                Threads.gpu_check_thread = None
-                Threads.ram_check_thread = None
+    @staticmethod
+    def _perform_sync(name: str) -> journal.RunRecord:
+        """
+        Perform rclone sync operations (thread-unsafe).
+
+        Only files that changed since the last successful sync as per the index are passed to
+        rclone, which isn't run at all if nothing changed. Changes are split into shards by
+        top-level directory, and only files in shards that succeeded are marked as synced.
+        Compression targets are packed and uploaded as archives, if they changed.
+        """
+        logger.info("Performing {} sync", name)
+        run_start = time.time()
+        source, destination, excludes = SYNC_TARGETS[name]
+
+        file_index = index.FileIndex(INDEX_FILE, source, excludes, COMPRESSION_TARGETS)
+        scan = file_index.scan()
+        BackgroundSyncHandler.last_scan = scan
+        logger.info(
+            "Scanned {} files in {:.2f}s: {} changed, {} deleted",
+            len(scan.entries),
+            scan.duration,
+            len(scan.changed),
+            len(scan.deleted),
+        )
 
-                if Threads.sync_thread_id != id:
-                    logger.debug("Sync thread ID changed after checking resources. Exiting.")
-                    break
+        started = datetime.datetime.now().strftime(FILE_DATETIME_FORMAT)
+        transferred = files = 0
+        exit_code = 9
+        if scan.dirty:
+            shards = executor.split_into_shards(source, destination, scan.dirty, excludes)
+            Threads.shard_executor = executor.ShardExecutor(
+                BASE_SYNC_ARGUMENTS,
+                LOGS_DIR,
+                command=BackgroundSyncHandler.rclone_command,
+                controller=bandwidth.BandwidthController(BackgroundSyncHandler.load_probe),
+            )
+            result = Threads.shard_executor.run(shards, f"{name} {started}")
+            file_index.commit(scan, result.synced_files)
+            transferred, files, exit_code = (
+                result.transferred,
+                result.files_transferred,
+                result.exit_code,
+            )
+        else:
+            logger.info("Nothing changed since the last {} sync, skipping rclone", name)
+
+        targets = packer.find_targets(source, COMPRESSION_TARGETS, excludes)
+        report = packer.Packer(file_index, destination, BackgroundSyncHandler.rclone_command).run(
+            targets
+        )
+        if report.failed and exit_code in executor.SUCCESS_EXIT_CODES:
+            exit_code = report.failed[0].exit_code
+        elif report.packed and exit_code == 9:
+            exit_code = 0
 
-                is_regular_sync = regular_sync_wait == 0
-                BackgroundSyncHandler.perform_sync(is_regular_sync=is_regular_sync)
-            else:
-                logger.debug("Conditions not met (CPU {}, GPU {}, RAM {}). Waiting for {} seconds.", cpu_idle, gpu_idle, ram_available, POLL_FAIL_WAIT)
-                time.sleep(POLL_FAIL_WAIT)
+        return journal.RunRecord(
+            uuid.uuid4().hex, name, run_start, time.time(), transferred, files, exit_code
+        )
 
     @staticmethod
-    def _perform_sync(is_regular: bool) -> None:
-        """Perform rclone sync operations (thread-unsafe)."""
-        logger.info("Performing {} sync", "regular" if is_regular else "large")
-
+    def throughput() -> float:
+        """Get the live throughput of the ongoing (or last) sync, in bytes per second."""
+        if Threads.shard_executor is None:
+            return 0
+        return Threads.shard_executor.progress.rate
 
     @staticmethod
-    def perform_sync():
-        """Perform the sync operations (thread-safe)."""
+    def perform_sync(name: str) -> journal.RunRecord:
+        """Perform the sync operations (thread-safe), and record the run in the journal."""
         with SYNC_LOCK:
-            BackgroundSyncHandler._perform_sync()
+            record = BackgroundSyncHandler._perform_sync(name)
+            BackgroundSyncHandler.run_journal.append(record)
+        logger.info(
+            "{} sync finished in {:.1f}s with exit code {}", name, record.duration, record.exit_code
+        )
+        return record
 
     @staticmethod
-    def start():
-        """Start the backup process."""
+    def start(resources: t.Optional[t.Sequence[sampler.Resource]] = None):
+        """
+        Start the backup process.
+
+        The resources to be sampled may be supplied, otherwise the real system probes are used.
+        """
         if BackgroundSyncHandler.running:
             logger.warning("Backup process already running.")
             return
@@ -244,12 +345,19 @@ class BackgroundSyncHandler:
         BackgroundSyncHandler.running = True
         logger.debug("Starting backup process.")
 
-        Threads.sync_thread_id = uuid.uuid4()
-        Threads.sync_thread = threading.Thread(
-            target=BackgroundSyncHandler.sync_watch,
-            args=(Threads.sync_thread_id,),
-            daemon=True)
-        Threads.sync_thread.start()
+        if resources is None:
+            resources = default_resources()
+        Threads.resource_sampler = sampler.ResourceSampler(resources)
+        idle_model = predictor.IdleModel(IDLE_MODEL_FILE)
+        Threads.resource_sampler.listeners.append(idle_model.observe)
+        Threads.idle_predictor = predictor.IdlePredictor(idle_model, POLL_FAIL_WAIT)
+        Threads.resource_sampler.start()
+
+        Threads.sync_scheduler = scheduler.Scheduler()
+        BackgroundSyncHandler.migrate_legacy_sync_times()
+        for job in BackgroundSyncHandler.create_jobs():
+            Threads.sync_scheduler.add(job)
+        Threads.sync_scheduler.start()
 
     @staticmethod
     def stop():
@@ -260,6 +368,9 @@ class BackgroundSyncHandler:
 
         BackgroundSyncHandler.running = False
         logger.debug("Stopping backup process")
-        Threads.sync_thread_id = None
-        Threads.sync_thread = None
+        Threads.sync_scheduler.stop()
+        Threads.sync_scheduler = None
+        Threads.resource_sampler.stop()
+        Threads.resource_sampler = None
+        Threads.idle_predictor = None
 
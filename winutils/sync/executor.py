@@ -0,0 +1,285 @@
+"""Runs a sync as several rclone processes, one per shard of the source tree."""
+
+import concurrent.futures
+import pathlib
+import subprocess
+import tempfile
+import threading
+import time
+import typing as t
+from loguru import logger
+from winutils._helpers import process
+from winutils.sync import bandwidth, index, progress
+
+RCLONE_COMMAND = ["rclone"]
+SHARD_WORKERS = 4
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 30
+ROOT_SHARD = "."
+
+# See https://rclone.org/docs/#exit-code
+SUCCESS_EXIT_CODES = {0, 9}
+RETRYABLE_EXIT_CODES = {5}
+FATAL_EXIT_CODES = {7}
+# Exit code of shards that never ran, because a fatal error happened first
+CANCELLED_EXIT_CODE = -1
+
+
+class Shard(t.NamedTuple):
+    """A part of the source tree, synced by its own rclone process."""
+
+    name: str
+    source: pathlib.Path
+    destination: str
+    files: list[str]
+    # Paths relative to the shard's source which rclone must never touch
+    excludes: tuple[str, ...] = ()
+
+
+class ShardResult(t.NamedTuple):
+    name: str
+    paths: list[str]
+    exit_code: int
+    attempts: int
+    duration: float
+    transferred: int
+    files_transferred: int
+    errors: list[progress.FileError]
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exit_code in SUCCESS_EXIT_CODES
+
+
+class RunResult(t.NamedTuple):
+    """The aggregated outcome of all shards of a run."""
+
+    shards: list[ShardResult]
+    duration: float
+
+    @property
+    def succeeded(self) -> list[ShardResult]:
+        return [shard for shard in self.shards if shard.succeeded]
+
+    @property
+    def failed(self) -> list[ShardResult]:
+        return [shard for shard in self.shards if not shard.succeeded]
+
+    @property
+    def synced_files(self) -> list[str]:
+        """Paths relative to the run's source, which were synced successfully."""
+        return [path for shard in self.succeeded for path in shard.paths]
+
+    @property
+    def transferred(self) -> int:
+        return sum(shard.transferred for shard in self.shards)
+
+    @property
+    def files_transferred(self) -> int:
+        return sum(shard.files_transferred for shard in self.shards)
+
+    @property
+    def exit_code(self) -> int:
+        """The most severe exit code amongst the shards."""
+        codes = {shard.exit_code for shard in self.shards}
+        for severe in (FATAL_EXIT_CODES, {CANCELLED_EXIT_CODE}, RETRYABLE_EXIT_CODES):
+            if codes & severe:
+                return min(codes & severe)
+        failures = codes - SUCCESS_EXIT_CODES
+        if failures:
+            return max(failures)
+        return 0 if 0 in codes else 9
+
+
+def split_into_shards(
+    source: pathlib.Path,
+    destination: str,
+    paths: t.Iterable[str],
+    excludes: t.Iterable[str] = (),
+) -> list[Shard]:
+    """
+    Group paths relative to source into shards by their top-level directory.
+
+    Files directly under the source, or under directories that no longer exist, are synced
+    from the source itself as the root shard. Each shard is given the excludes relative to
+    the source that fall within it, relative to its own source.
+    """
+    excludes = list(excludes)
+    groups: dict[str, list[str]] = {}
+    for path in paths:
+        top, separator, rest = path.partition("/")
+        if separator and (source / top).is_dir():
+            groups.setdefault(top, []).append(rest)
+        else:
+            groups.setdefault(ROOT_SHARD, []).append(path)
+
+    shards = []
+    for top, files in groups.items():
+        if top == ROOT_SHARD:
+            shards.append(Shard(ROOT_SHARD, source, destination, files, tuple(excludes)))
+        else:
+            inside = tuple(
+                path.partition("/")[2] for path in excludes if path.startswith(f"{top}/")
+            )
+            shards.append(Shard(top, source / top, f"{destination}/{top}", files, inside))
+    return shards
+
+
+def exclude_arguments(excludes: t.Iterable[str]) -> list[str]:
+    """Create rclone filter arguments excluding paths relative to the source, and their contents."""
+    arguments = []
+    for path in excludes:
+        arguments += [f"--exclude=/{path}", f"--exclude=/{path}/**"]
+    return arguments
+
+
+class ShardExecutor:
+    """
+    Runs shards in a bounded pool of rclone processes.
+
+    Shards failing with a retryable exit code are retried with exponential backoff, other
+    failures aren't retried. A fatal exit code cancels shards which haven't started yet.
+    """
+
+    def __init__(
+        self,
+        arguments: t.Sequence[str],
+        logs_dir: pathlib.Path,
+        command: t.Sequence[str] = RCLONE_COMMAND,
+        workers: int = SHARD_WORKERS,
+        max_attempts: int = MAX_ATTEMPTS,
+        backoff: float = BACKOFF_BASE,
+        controller: t.Optional[bandwidth.BandwidthController] = None,
+    ) -> None:
+        self.arguments = list(arguments)
+        self.logs_dir = logs_dir
+        self.command = list(command)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.controller = controller
+        self.fatal_error = threading.Event()
+        self.progress = progress.RunProgress()
+
+    def build_command(
+        self, shard: Shard, files_from: pathlib.Path, rc_address: t.Optional[str] = None
+    ) -> list[str]:
+        """Create the rclone command line for a shard, serving the rc API at an address if given."""
+        return [
+            *self.command,
+            *self.arguments,
+            *(bandwidth.rc_arguments(rc_address) if rc_address else []),
+            *exclude_arguments(shard.excludes),
+            # Only the listed files are synced, although sync still lists both sides
+            "--files-from-raw",
+            str(files_from),
+            str(shard.source),
+            shard.destination,
+        ]
+
+    def run_once(
+        self,
+        shard: Shard,
+        files_from: pathlib.Path,
+        log_file: pathlib.Path,
+        parser: progress.ProgressParser,
+    ) -> int:
+        """Run rclone for a shard a single time, returning the exit code."""
+        rc_address = None
+        if self.controller is not None:
+            rc_address = f"127.0.0.1:{bandwidth.free_port()}"
+        rclone = subprocess.Popen(
+            self.build_command(shard, files_from, rc_address),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        if rc_address is not None:
+            self.controller.attach(rclone.pid, rc_address)
+        try:
+            process.sync_process_output(rclone, log_file, on_line=parser.feed)
+            return rclone.wait()
+        finally:
+            if rc_address is not None:
+                self.controller.detach(rclone.pid)
+
+    def run_shard(self, shard: Shard, workspace: pathlib.Path, label: str) -> ShardResult:
+        """Run a shard, retrying it on retryable errors."""
+        started = time.perf_counter()
+        safe_name = "(root)" if shard.name == ROOT_SHARD else shard.name
+        files_from = index.write_files_from(shard.files, workspace / f"{safe_name}.files")
+
+        exit_code = CANCELLED_EXIT_CODE
+        parser = progress.ProgressParser()
+        attempts = 0
+        while attempts < self.max_attempts and not self.fatal_error.is_set():
+            if attempts:
+                delay = self.backoff * 2 ** (attempts - 1)
+                logger.info("Retrying shard {!r} in {} seconds", shard.name, delay)
+                if self.fatal_error.wait(delay):
+                    break
+
+            attempts += 1
+            log_file = self.logs_dir / f"{label} {safe_name} {attempts}.log"
+            parser = self.progress.parser(shard.name)
+            exit_code = self.run_once(shard, files_from, log_file, parser)
+            self.progress.finish(shard.name)
+            logger.debug("Shard {!r} exited with code {}", shard.name, exit_code)
+
+            if exit_code in FATAL_EXIT_CODES:
+                self.fatal_error.set()
+            if exit_code not in RETRYABLE_EXIT_CODES:
+                break
+
+        if shard.name == ROOT_SHARD:
+            paths = shard.files
+        else:
+            paths = [f"{shard.name}/{file}" for file in shard.files]
+        return ShardResult(
+            shard.name,
+            paths,
+            exit_code,
+            attempts,
+            time.perf_counter() - started,
+            parser.transferred,
+            parser.files_transferred,
+            list(parser.errors),
+        )
+
+    def run(self, shards: t.Sequence[Shard], label: str) -> RunResult:
+        """Run all shards, and aggregate their results."""
+        started = time.perf_counter()
+        self.fatal_error.clear()
+        self.progress = progress.RunProgress()
+        self.logs_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.controller is not None:
+            self.controller.start()
+        try:
+            with tempfile.TemporaryDirectory() as workspace:
+                with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                    futures = [
+                        pool.submit(self.run_shard, shard, pathlib.Path(workspace), label)
+                        for shard in shards
+                    ]
+                    results = [future.result() for future in futures]
+        finally:
+            if self.controller is not None:
+                self.controller.stop()
+
+        result = RunResult(results, time.perf_counter() - started)
+        logger.info(
+            "{}: {}/{} shards succeeded in {:.1f}s ({} attempts, {} files, {} bytes), exit code {}",
+            label,
+            len(result.succeeded),
+            len(results),
+            result.duration,
+            sum(shard.attempts for shard in results),
+            result.files_transferred,
+            result.transferred,
+            result.exit_code,
+        )
+        for shard in result.failed:
+            logger.error("Shard {!r} failed with exit code {}", shard.name, shard.exit_code)
+            for error in shard.errors:
+                logger.error("{}: {}", error.path, error.message)
+        return result
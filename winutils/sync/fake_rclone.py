@@ -0,0 +1,104 @@
+"""
+A stand-in for the rclone executable, which follows a script instead of transferring files.
+
+The script is a JSON file named by the FAKE_RCLONE_SCRIPT environment variable, mapping
+destinations to the outcome of each successive attempt, with a "default" fallback:
+
+    {"default": [{"exit_code": 0, "delay": 0.1}], "backup:Data/Photos": [{"exit_code": 5}]}
+
+The last outcome listed for a destination is repeated for further attempts. Every call is
+appended to "<script>.calls" as a JSON line, which is also used to count attempts.
+For `rcat`, standard input is read to the end and its size is recorded. With --rc-addr,
+the remote control endpoints are served by a FakeRcServer while the fake runs.
+"""
+
+import json
+import os
+import pathlib
+import sys
+import time
+import typing as t
+from winutils.sync import fakes
+
+SCRIPT_VARIABLE = "FAKE_RCLONE_SCRIPT"
+DEFAULT_OUTCOME = {"exit_code": 0, "delay": 0}
+
+
+def read_files_from(arguments: list[str]) -> list[str]:
+    """Read the files listed by the --files-from-raw argument, if any."""
+    if "--files-from-raw" not in arguments:
+        return []
+    path = pathlib.Path(arguments[arguments.index("--files-from-raw") + 1])
+    return path.read_text(encoding="utf-8").splitlines()
+
+
+def file_size(arguments: list[str], file: str) -> int:
+    """Find the size of a listed file under the source, which is the second to last argument."""
+    try:
+        return (pathlib.Path(arguments[-2]) / file).stat().st_size
+    except (IndexError, OSError):
+        return 0
+
+
+def serve_rc(arguments: list[str]) -> t.Optional[fakes.FakeRcServer]:
+    """Serve the fake rc endpoints at the address given by --rc-addr, if any."""
+    for argument in arguments:
+        if argument.startswith("--rc-addr="):
+            return fakes.FakeRcServer(argument.partition("=")[2]).start()
+    return None
+
+
+def main(arguments: list[str]) -> int:
+    script_path = os.environ.get(SCRIPT_VARIABLE)
+    script = json.loads(pathlib.Path(script_path).read_text()) if script_path else {}
+    calls_path = pathlib.Path(f"{script_path}.calls") if script_path else None
+
+    destination = arguments[-1] if arguments else ""
+    attempt = 0
+    if calls_path is not None and calls_path.exists():
+        with open(calls_path, encoding="utf-8") as f:
+            attempt = sum(json.loads(line)["destination"] == destination for line in f)
+
+    outcomes = script.get(destination) or script.get("default") or [DEFAULT_OUTCOME]
+    outcome = {**DEFAULT_OUTCOME, **outcomes[min(attempt, len(outcomes) - 1)]}
+    files = read_files_from(arguments)
+    received = 0
+    if "rcat" in arguments:
+        while chunk := sys.stdin.buffer.read(1024 * 1024):
+            received += len(chunk)
+
+    if calls_path is not None:
+        call = {
+            "destination": destination,
+            "arguments": arguments,
+            "files": len(files),
+            "received": received,
+        }
+        with open(calls_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(call) + "\n")
+
+    rc_server = serve_rc(arguments)
+    delay = outcome["delay"]
+    failed = outcome["exit_code"] not in (0, 9)
+    sizes = [file_size(arguments, file) for file in files]
+    started = time.monotonic()
+    for number, file in enumerate(files, start=1):
+        time.sleep(delay / max(1, len(files)))
+        if failed:
+            print(f"ERROR : {file}: Failed to copy: scripted failure")
+            continue
+        done = sum(sizes[:number])
+        rate = done / max(time.monotonic() - started, 1e-3)
+        percent = done * 100 // max(1, sum(sizes))
+        print(f"INFO  : {file}: Copied (new)")
+        print(f"Transferred:   \t{done} B / {sum(sizes)} B, {percent}%, {rate:.0f} B/s, ETA 0s")
+        print(f"Transferred:   {number} / {len(files)}, {number * 100 // len(files)}%", flush=True)
+    if not files:
+        time.sleep(delay)
+    if rc_server is not None:
+        rc_server.stop()
+    return outcome["exit_code"]
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,103 @@
+"""Stand-ins for the real tools and probes, so the sync can be driven without them."""
+
+import http.server
+import itertools
+import json
+import sys
+import threading
+import typing as t
+
+# Replaces the rclone command, see fake_rclone for how its behaviour is scripted
+FAKE_RCLONE_COMMAND = [sys.executable, "-m", "winutils.sync.fake_rclone"]
+
+
+class ScriptedProbe:
+    """A resource probe returning scripted values, repeating the last one forever."""
+
+    def __init__(self, values: t.Iterable[float]) -> None:
+        self.set(values)
+        self.calls = 0
+
+    def set(self, values: t.Iterable[float]) -> None:
+        """Replace the values to be returned from now on."""
+        values = list(values)
+        self._values = itertools.chain(values, itertools.repeat(values[-1]))
+
+    def __call__(self) -> float:
+        self.calls += 1
+        return next(self._values)
+
+
+class FakeRcServer:
+    """
+    A local HTTP server mimicking the rclone remote control endpoints used for throttling.
+
+    Every call is recorded as (command, parameters), and the state it sets is kept like
+    rclone would, so it can be inspected.
+    """
+
+    def __init__(self, address: str = "127.0.0.1:0") -> None:
+        host, port = address.rsplit(":", 1)
+        self.calls: list[tuple[str, dict]] = []
+        self.bandwidth = "off"
+        self.options: dict[str, dict] = {"main": {"Transfers": 4, "Checkers": 8}}
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer((host, int(port)), self._handler())
+        self._thread: t.Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def handle(self, command: str, parameters: dict) -> t.Optional[dict]:
+        """Handle an rc command, returning None for unknown commands."""
+        with self._lock:
+            self.calls.append((command, parameters))
+            if command == "core/bwlimit":
+                if "rate" in parameters:
+                    self.bandwidth = parameters["rate"]
+                return {"rate": self.bandwidth}
+            if command == "options/set":
+                for block, values in parameters.items():
+                    self.options.setdefault(block, {}).update(values)
+                return {}
+            if command == "options/get":
+                return self.options
+        return None
+
+    def _handler(self) -> type[http.server.BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    parameters = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    parameters = None
+                result = None
+                if isinstance(parameters, dict):
+                    result = server.handle(self.path.strip("/"), parameters)
+                status = 200 if result is not None else 404
+                body = json.dumps(result if result is not None else {"error": "unknown"})
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args: t.Any) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeRcServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread = None
@@ -0,0 +1,238 @@
+"""A persistent index of the files under a sync root, used to find what changed."""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import pathlib
+import sqlite3
+import time
+import typing as t
+
+SCAN_WORKERS = 8
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash BLOB,
+    PRIMARY KEY (root, path)
+) WITHOUT ROWID
+"""
+
+
+class FileEntry(t.NamedTuple):
+    size: int
+    mtime_ns: int
+
+
+class ScanResult(t.NamedTuple):
+    """The outcome of comparing a directory tree against the index."""
+
+    entries: dict[str, FileEntry]
+    changed: list[str]
+    deleted: list[str]
+    duration: float
+
+    @property
+    def dirty(self) -> list[str]:
+        """All paths that need to be synced, including deletions."""
+        return self.changed + self.deleted
+
+
+def hash_file(path: pathlib.Path) -> bytes:
+    """Hash the contents of a file."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def walk(
+    top: str, root: str, excludes: frozenset[str], excluded_names: frozenset[str]
+) -> dict[str, FileEntry]:
+    """Recursively list the files under top, keyed by their posix path relative to root."""
+    entries = {}
+    stack = [top]
+    while stack:
+        directory = stack.pop()
+        try:
+            iterator = os.scandir(directory)
+        except (FileNotFoundError, PermissionError):
+            continue
+        with iterator:
+            for entry in iterator:
+                relative = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                if relative in excludes:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in excluded_names:
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        entries[relative] = FileEntry(stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+    return entries
+
+
+class FileIndex:
+    """
+    An SQLite index of path, size, mtime and optionally a content hash per file.
+
+    Excludes are paths relative to the root, of files or directories. Excluded names are
+    names of directories, wherever they are, files with those names are still indexed.
+    Scans walk the top-level directories of the root in parallel. If hashing is enabled,
+    files whose mtime changed but whose contents didn't are not reported as changed.
+    """
+
+    def __init__(
+        self,
+        database: pathlib.Path,
+        root: pathlib.Path,
+        excludes: t.Iterable[str] = (),
+        excluded_names: t.Iterable[str] = (),
+        hash_files: bool = False,
+        workers: int = SCAN_WORKERS,
+    ) -> None:
+        self.database = database
+        self.root = root
+        self.excludes = frozenset(excludes)
+        self.excluded_names = frozenset(excluded_names)
+        self.hash_files = hash_files
+        self.workers = workers
+        database.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as connection:
+            connection.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self) -> t.Iterator[sqlite3.Connection]:
+        """Open a connection to the index database, committing on success."""
+        with contextlib.closing(sqlite3.connect(self.database)) as connection:
+            with connection:
+                yield connection
+
+    def walk(self) -> dict[str, FileEntry]:
+        """List every file under the root, walking top-level directories in parallel."""
+        root = str(self.root)
+        entries = {}
+        tops = []
+        try:
+            iterator = os.scandir(root)
+        except FileNotFoundError:
+            return entries
+        with iterator:
+            for entry in iterator:
+                if entry.name in self.excludes:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in self.excluded_names:
+                        tops.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    entries[entry.name] = FileEntry(stat.st_size, stat.st_mtime_ns)
+
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            for result in executor.map(
+                lambda top: walk(top, root, self.excludes, self.excluded_names), tops
+            ):
+                entries.update(result)
+        return entries
+
+    def stored(self) -> dict[str, tuple[int, int, t.Optional[bytes]]]:
+        """Read the stored entries for the root."""
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT path, size, mtime_ns, hash FROM files WHERE root = ?", (str(self.root),)
+            )
+            return {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+
+    def scan(self) -> ScanResult:
+        """Compare the files under the root with the index."""
+        started = time.perf_counter()
+        entries = self.walk()
+        stored = self.stored()
+
+        changed = []
+        touched = []
+        for path, entry in entries.items():
+            previous = stored.get(path)
+            if previous is None or previous[0] != entry.size:
+                changed.append(path)
+            elif previous[1] != entry.mtime_ns:
+                if self.hash_files and previous[2] is not None:
+                    touched.append((path, previous[2]))
+                else:
+                    changed.append(path)
+
+        if touched:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+                digests = executor.map(self._try_hash, (path for path, _ in touched))
+                changed.extend(path for (path, old), new in zip(touched, digests) if old != new)
+
+        deleted = [path for path in stored if path not in entries]
+        return ScanResult(entries, changed, deleted, time.perf_counter() - started)
+
+    def commit(self, result: ScanResult, paths: t.Optional[t.Iterable[str]] = None) -> None:
+        """
+        Record the scanned state of the given paths (all dirty paths by default) as synced.
+
+        Other files whose mtime changed are only updated when hashing shows their contents
+        didn't, as a changed file outside the given paths (like one in a failed shard) still
+        needs syncing.
+        """
+        paths = set(result.dirty if paths is None else paths)
+        stored = self.stored()
+        synced = [path for path in result.entries if path in paths]
+        touched = []
+        if self.hash_files:
+            touched = [
+                path
+                for path, entry in result.entries.items()
+                if path not in paths
+                and path in stored
+                and stored[path][2] is not None
+                and stored[path][:2] != entry
+            ]
+
+        rows = []
+        if self.hash_files:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+                rows.extend(zip(synced, executor.map(self._try_hash, synced)))
+                for path, digest in zip(touched, executor.map(self._try_hash, touched)):
+                    if digest == stored[path][2]:
+                        rows.append((path, digest))
+        else:
+            rows.extend((path, None) for path in synced)
+
+        root = str(self.root)
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                ((root, path, *result.entries[path], digest) for path, digest in rows),
+            )
+            connection.executemany(
+                "DELETE FROM files WHERE root = ? AND path = ?",
+                ((root, path) for path in result.deleted if path in paths),
+            )
+
+    def _try_hash(self, path: str) -> t.Optional[bytes]:
+        try:
+            return hash_file(self.root / path)
+        except OSError:
+            return None
+
+
+def write_files_from(paths: t.Iterable[str], file: pathlib.Path) -> pathlib.Path:
+    """Write paths in the format expected by rclone's --files-from."""
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with open(file, "w", encoding="utf-8") as f:
+        for path in paths:
+            f.write(path)
+            f.write("\n")
+    return file
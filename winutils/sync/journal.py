@@ -0,0 +1,122 @@
+"""An append-only journal of sync runs, stored as JSON lines."""
+
+import json
+import os
+import pathlib
+import typing as t
+from loguru import logger
+
+READ_CHUNK_SIZE = 4096
+
+
+class RunRecord(t.NamedTuple):
+    """A finished sync run, with times as POSIX timestamps."""
+
+    id: str
+    job: str
+    start: float
+    end: float
+    bytes: int
+    files: int
+    exit_code: int
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Journal:
+    """
+    Records every sync run by appending a line to a file.
+
+    Each record is written with a single append and fsynced, so a crash can at worst leave
+    a partial last line, which readers skip. The latest records are read by seeking
+    backwards from the end of the file, without reading the whole history.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+
+    def append(self, record: RunRecord) -> None:
+        """Durably append a record to the journal."""
+        line = json.dumps(record._asdict(), separators=(",", ":")).encode() + b"\n"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        fd = os.open(self.path, flags)
+        try:
+            # Terminate a line left partially written by a crash, so it isn't joined to ours
+            size = os.fstat(fd).st_size
+            if size and not self._ends_with_newline(size):
+                line = b"\n" + line
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _ends_with_newline(self, size: int) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(size - 1)
+            return f.read(1) == b"\n"
+
+    @staticmethod
+    def parse(line: bytes) -> t.Optional[RunRecord]:
+        """Parse a journal line, returning None if it's malformed."""
+        try:
+            return RunRecord(**json.loads(line))
+        except (ValueError, TypeError):
+            return None
+
+    def reversed(self) -> t.Iterator[RunRecord]:
+        """Iterate over the records from newest to oldest, reading the file in chunks."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            remainder = b""
+            while position > 0:
+                step = min(READ_CHUNK_SIZE, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + remainder).split(b"\n")
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    if line and (record := self.parse(line)) is not None:
+                        yield record
+            if remainder and (record := self.parse(remainder)) is not None:
+                yield record
+
+    def __iter__(self) -> t.Iterator[RunRecord]:
+        """Iterate over the records from oldest to newest."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if (record := self.parse(line)) is not None:
+                    yield record
+                else:
+                    logger.warning("Skipping a malformed journal line")
+
+    def latest(
+        self,
+        job: t.Optional[str] = None,
+        predicate: t.Callable[[RunRecord], bool] = lambda record: True,
+    ) -> t.Optional[RunRecord]:
+        """Find the most recent record, optionally of a given job and matching a predicate."""
+        for record in self.reversed():
+            if (job is None or record.job == job) and predicate(record):
+                return record
+        return None
+
+    def recent(self, job: str, limit: int) -> list[RunRecord]:
+        """Find up to limit of the most recent records of a job, newest first."""
+        records = []
+        for record in self.reversed():
+            if record.job == job:
+                records.append(record)
+                if len(records) == limit:
+                    break
+        return records
@@ -0,0 +1,238 @@
+"""Packs trees of many small files into archives, streamed straight into the remote."""
+
+import concurrent.futures
+import hashlib
+import os
+import pathlib
+import subprocess
+import tarfile
+import time
+import typing as t
+from loguru import logger
+import zstandard
+from winutils.sync import index
+
+PACK_WORKERS = 4
+COMPRESSION_LEVEL = 3
+ARCHIVE_SUFFIX = ".tar.zst"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    fingerprint BLOB NOT NULL,
+    files INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+) WITHOUT ROWID
+"""
+
+
+class PackResult(t.NamedTuple):
+    path: str
+    fingerprint: bytes
+    files: int
+    size: int
+    duration: float
+    exit_code: t.Optional[int]
+
+    @property
+    def skipped(self) -> bool:
+        """Whether the tree was unchanged, and wasn't packed again."""
+        return self.exit_code is None
+
+
+class PackReport(t.NamedTuple):
+    """The aggregated outcome of packing all targets under a root."""
+
+    results: list[PackResult]
+    duration: float
+
+    @property
+    def packed(self) -> list[PackResult]:
+        return [result for result in self.results if not result.skipped]
+
+    @property
+    def failed(self) -> list[PackResult]:
+        return [result for result in self.packed if result.exit_code != 0]
+
+    @property
+    def throughput(self) -> float:
+        """Bytes packed per second, across all workers."""
+        return sum(result.size for result in self.packed) / self.duration if self.duration else 0
+
+    @property
+    def files_saved(self) -> int:
+        """Files which were uploaded as part of an archive, instead of individually."""
+        return sum(result.files for result in self.packed if result.exit_code == 0)
+
+
+def find_targets(
+    root: pathlib.Path, names: t.Collection[str], excludes: t.Collection[str] = ()
+) -> list[str]:
+    """
+    Find directories under root with any of the names, relative to root in posix form.
+
+    Excludes are paths relative to root, which aren't searched.
+    """
+    targets = []
+    for directory, subdirectories, _ in os.walk(root):
+        relative = pathlib.Path(directory).relative_to(root)
+        kept = []
+        for name in subdirectories:
+            path = (relative / name).as_posix()
+            if path in excludes:
+                continue
+            if name in names:
+                targets.append(path)
+            else:
+                kept.append(name)
+        subdirectories[:] = kept
+    return targets
+
+
+def list_tree(directory: pathlib.Path) -> list[tuple[str, int, int]]:
+    """List the files in a tree as sorted (path, size, mtime) entries."""
+    entries = []
+    for current, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(current, name)
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue
+            relative = os.path.relpath(path, directory).replace(os.sep, "/")
+            entries.append((relative, stat.st_size, stat.st_mtime_ns))
+    entries.sort()
+    return entries
+
+
+def fingerprint_tree(entries: t.Iterable[tuple[str, int, int]]) -> bytes:
+    """Fingerprint a tree by the paths, sizes and modification times of its files."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path, size, mtime_ns in entries:
+        digest.update(f"{path}\0{size}\0{mtime_ns}\n".encode())
+    return digest.digest()
+
+
+def pack_target(
+    root: pathlib.Path,
+    path: str,
+    destination: str,
+    command: t.Sequence[str],
+    previous_fingerprint: t.Optional[bytes],
+) -> PackResult:
+    """
+    Pack a tree into a tar+zstd stream, piped into `rclone rcat` so nothing is staged on disk.
+
+    Packing is skipped if the fingerprint of the tree matches the previous one.
+    This runs in a worker process.
+    """
+    started = time.perf_counter()
+    directory = root / path
+    entries = list_tree(directory)
+    fingerprint = fingerprint_tree(entries)
+    size = sum(entry[1] for entry in entries)
+    if fingerprint == previous_fingerprint:
+        return PackResult(path, fingerprint, len(entries), size, 0, None)
+
+    rcat = subprocess.Popen(
+        [*command, "rcat", f"{destination}/{path}{ARCHIVE_SUFFIX}"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    try:
+        with compressor.stream_writer(rcat.stdin, closefd=True) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as archive:
+                for relative, _, _ in entries:
+                    try:
+                        archive.add(directory / relative, arcname=relative, recursive=False)
+                    except OSError:
+                        continue
+    except (BrokenPipeError, OSError):
+        logger.warning("rclone stopped reading the archive for {}", path)
+    exit_code = rcat.wait()
+    duration = time.perf_counter() - started
+    return PackResult(path, fingerprint, len(entries), size, duration, exit_code)
+
+
+class Packer:
+    """
+    Packs the compression targets under a root in parallel worker processes.
+
+    Fingerprints of packed trees are kept in the index database, alongside the file index.
+    """
+
+    def __init__(
+        self,
+        file_index: index.FileIndex,
+        destination: str,
+        command: t.Sequence[str],
+        workers: int = PACK_WORKERS,
+    ) -> None:
+        self.connect = file_index.connect
+        self.root = file_index.root
+        self.destination = destination
+        self.command = list(command)
+        self.workers = workers
+        with self.connect() as connection:
+            connection.execute(SCHEMA)
+
+    def stored(self) -> dict[str, bytes]:
+        """Read the fingerprints of the archives uploaded for this root."""
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT path, fingerprint FROM archives WHERE root = ?", (str(self.root),)
+            )
+            return dict(rows.fetchall())
+
+    def remove_stale(self, paths: t.Iterable[str]) -> None:
+        """Delete the archives of targets which no longer exist."""
+        for path in paths:
+            target = f"{self.destination}/{path}{ARCHIVE_SUFFIX}"
+            exit_code = subprocess.run([*self.command, "deletefile", target]).returncode
+            if exit_code != 0:
+                logger.error("Could not delete stale archive {} ({})", target, exit_code)
+                continue
+            with self.connect() as connection:
+                connection.execute(
+                    "DELETE FROM archives WHERE root = ? AND path = ?", (str(self.root), path)
+                )
+
+    def run(self, targets: t.Sequence[str]) -> PackReport:
+        """Pack and upload the targets that changed, recording the new fingerprints."""
+        started = time.perf_counter()
+        stored = self.stored()
+        self.remove_stale(set(stored) - set(targets))
+
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            futures = [
+                pool.submit(
+                    pack_target, self.root, path, self.destination, self.command, stored.get(path)
+                )
+                for path in targets
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if result.skipped or result.exit_code != 0:
+                    continue
+                with self.connect() as connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?)",
+                        (str(self.root), result.path, result.fingerprint, result.files),
+                    )
+
+        report = PackReport(results, time.perf_counter() - started)
+        logger.info(
+            "Packed {}/{} targets at {:.1f} MiB/s, {} files not uploaded individually",
+            len(report.packed),
+            len(results),
+            report.throughput / 1024**2,
+            report.files_saved,
+        )
+        for result in report.failed:
+            logger.error("Uploading the archive of {} failed ({})", result.path, result.exit_code)
+        return report
@@ -0,0 +1,220 @@
+"""Predicts when the machine will next be idle, from its hour-of-week usage history."""
+
+import array
+import datetime
+import json
+import pathlib
+import statistics
+import threading
+import typing as t
+from loguru import logger
+
+HOURS_PER_WEEK = 7 * 24
+# Weight of the latest week when folding an hour's idle fraction into its bucket
+WEEKLY_SMOOTHING = 0.3
+IDLE_PROBABILITY_THRESHOLD = 0.6
+PREDICTION_HORIZON = 7 * 24 * 60 * 60
+DEFAULT_SYNC_DURATION = 10 * 60
+DURATION_HISTORY = 10
+
+
+def hour_of_week(timestamp: float) -> int:
+    """Find the local hour of the week (0 is Monday 00:00) of a timestamp."""
+    moment = datetime.datetime.fromtimestamp(timestamp)
+    return moment.weekday() * 24 + moment.hour
+
+
+def hour_start(timestamp: float) -> float:
+    """Find the timestamp of the start of the hour containing a timestamp."""
+    moment = datetime.datetime.fromtimestamp(timestamp)
+    return moment.replace(minute=0, second=0, microsecond=0).timestamp()
+
+
+class IdleModel:
+    """
+    The probability of the machine being idle in each hour of the week.
+
+    Samples are counted for the current hour, and the idle fraction is folded into that
+    hour's bucket once it ends, so each bucket is smoothed across weeks.
+    """
+
+    def __init__(self, path: t.Optional[pathlib.Path] = None) -> None:
+        self.path = path
+        self.probabilities = array.array("d", [0.0] * HOURS_PER_WEEK)
+        self.weeks = array.array("l", [0] * HOURS_PER_WEEK)
+        self._hour: t.Optional[float] = None
+        self._idle_samples = 0
+        self._samples = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """Load a previously saved model, if any."""
+        if self.path is None:
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            probabilities, weeks = data["probabilities"], data["weeks"]
+            if len(probabilities) != HOURS_PER_WEEK or len(weeks) != HOURS_PER_WEEK:
+                raise ValueError("Wrong number of buckets")
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Error reading the idle model. Starting afresh.")
+            return
+        self.probabilities = array.array("d", probabilities)
+        self.weeks = array.array("l", weeks)
+
+    def save(self) -> None:
+        """Save the model, replacing the previous file atomically."""
+        if self.path is None:
+            return
+        data = {"probabilities": list(self.probabilities), "weeks": list(self.weeks)}
+        temporary = self.path.with_suffix(".tmp")
+        temporary.parent.mkdir(parents=True, exist_ok=True)
+        temporary.write_text(json.dumps(data))
+        temporary.replace(self.path)
+
+    def observe(self, timestamp: float, idle: bool) -> None:
+        """Record whether the machine was idle at a point in time."""
+        with self._lock:
+            start = hour_start(timestamp)
+            if self._hour is not None and start != self._hour:
+                self._fold()
+            self._hour = start
+            self._samples += 1
+            self._idle_samples += idle
+
+    def _fold(self) -> None:
+        """Fold the finished hour's samples into its bucket."""
+        bucket = hour_of_week(self._hour)
+        fraction = self._idle_samples / self._samples
+        if self.weeks[bucket]:
+            self.probabilities[bucket] += WEEKLY_SMOOTHING * (fraction - self.probabilities[bucket])
+        else:
+            self.probabilities[bucket] = fraction
+        self.weeks[bucket] += 1
+        self._samples = self._idle_samples = 0
+        self.save()
+
+    def probability(self, timestamp: float) -> t.Optional[float]:
+        """The probability of being idle at a time, None if that hour was never observed."""
+        bucket = hour_of_week(timestamp)
+        if not self.weeks[bucket]:
+            return None
+        return self.probabilities[bucket]
+
+    def prior(self) -> t.Optional[float]:
+        """The mean probability of the observed hours, None if none were observed."""
+        observed = [p for p, weeks in zip(self.probabilities, self.weeks) if weeks]
+        if not observed:
+            return None
+        return statistics.fmean(observed)
+
+    def next_window(
+        self,
+        now: float,
+        duration: float,
+        threshold: float = IDLE_PROBABILITY_THRESHOLD,
+        horizon: float = PREDICTION_HORIZON,
+    ) -> t.Optional[float]:
+        """
+        Find the start of the next window of at least duration, where every hour is likely idle.
+
+        Hours never observed are taken to be as likely idle as the observed ones on average.
+        None is returned if there's no such window within the horizon, or if no hour was
+        observed yet, since the model has nothing to go by.
+        """
+        prior = self.prior()
+        if prior is None:
+            return None
+        window_start: t.Optional[float] = None
+        moment = now
+        while moment < now + horizon:
+            probability = self.probability(moment)
+            if probability is None:
+                probability = prior
+            if probability >= threshold:
+                if window_start is None:
+                    window_start = moment
+                next_hour = hour_start(moment) + 60 * 60
+                if next_hour - window_start >= duration:
+                    return window_start
+            else:
+                window_start = None
+            moment = hour_start(moment) + 60 * 60
+        return None
+
+
+class IdlePredictor:
+    """
+    Decides when a busy machine should next be checked, and tracks how well that works.
+
+    The prediction error is the mean absolute difference between the predicted idle
+    probability at a check and whether the machine turned out to be idle.
+    """
+
+    def __init__(self, model: IdleModel, poll_interval: float) -> None:
+        self.model = model
+        self.poll_interval = poll_interval
+        self.skipped_polls = 0
+        self.predictions = 0
+        self.total_error = 0.0
+        self._pending: dict[str, float] = {}
+
+    @property
+    def mean_error(self) -> t.Optional[float]:
+        if not self.predictions:
+            return None
+        return self.total_error / self.predictions
+
+    @staticmethod
+    def expected_duration(durations: t.Sequence[float]) -> float:
+        """Estimate how long a sync will take from past run durations."""
+        if not durations:
+            return DEFAULT_SYNC_DURATION
+        return statistics.median(durations[:DURATION_HISTORY])
+
+    def record_check(self, job: str, idle: bool) -> None:
+        """Compare the outcome of a check with the probability predicted for it."""
+        predicted = self._pending.pop(job, None)
+        if predicted is None:
+            return
+        self.predictions += 1
+        self.total_error += abs(predicted - idle)
+        logger.debug(
+            "Predicted idle probability {:.2f} for {}, was idle: {} (mean error {:.2f})",
+            predicted,
+            job,
+            idle,
+            self.mean_error,
+        )
+
+    def retry_delay(
+        self, job: str, now: float, duration: float, latest: t.Optional[float] = None
+    ) -> float:
+        """
+        Find how long to wait before checking a busy machine again.
+
+        This is the start of the next predicted idle window long enough for the sync, but no
+        sooner than the regular poll interval, and no later than `latest` if given.
+        """
+        window = self.model.next_window(now + self.poll_interval, duration)
+        if window is None:
+            return self.poll_interval
+
+        check_at = window if latest is None else min(window, latest)
+        delay = max(self.poll_interval, check_at - now)
+        skipped = int(delay // self.poll_interval) - 1
+        self.skipped_polls += skipped
+        probability = self.model.probability(now + delay)
+        if probability is not None:
+            self._pending[job] = probability
+        logger.debug(
+            "Next idle window for {} in {:.0f} seconds, skipping {} polls ({} in total)",
+            job,
+            delay,
+            skipped,
+            self.skipped_polls,
+        )
+        return delay
@@ -0,0 +1,200 @@
+"""Parses rclone's --progress and --verbose output into structured events."""
+
+import collections
+import re
+import threading
+import time
+import typing as t
+
+MAX_KEPT_ERRORS = 100
+# Weight of the newest rate measurement in the smoothed throughput
+GAUGE_SMOOTHING = 0.3
+
+# https://github.com/chalk/ansi-regex/blob/main/index.js
+ANSI_REGEX = re.compile(
+    "|".join(
+        [
+            r"[\u001B\u009B][\[\]()#;?]*(?:(?:(?:(?:;[-a-zA-Z\d\/#&.:=?%@~_]+)*|[a-zA-Z\d]+(?:;[-a-zA-Z\d\/#&.:=?%@~_]*)*)?\u0007)",
+            r"(?:(?:\d{1,4}(?:;\d{0,4})*)?[\dA-PR-TZcf-nq-uy=><~]))",
+        ]
+    )
+)
+SIZE = r"([\d.]+)\s*([KMGTPE]i?)?B"
+BYTES_REGEX = re.compile(
+    rf"^Transferred:\s+{SIZE}\s*/\s*{SIZE},\s*(\d+%|-),\s*{SIZE}/s,\s*ETA\s*(\S+)"
+)
+FILES_REGEX = re.compile(r"^Transferred:\s+(\d+)\s*/\s*(\d+),\s*(\d+%|-)\s*$")
+ERROR_REGEX = re.compile(r"ERROR\s*:\s*(?:(.*?):\s+)?(.*)$")
+ETA_REGEX = re.compile(r"(\d+(?:\.\d+)?)([dhms])")
+
+UNITS = {None: 1, "K": 1000, "M": 1000**2, "G": 1000**3, "T": 1000**4, "P": 1000**5, "E": 1000**6}
+UNITS.update({f"{prefix}i": 1024 ** (power + 1) for power, prefix in enumerate("KMGTPE")})
+ETA_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+class TransferStats(t.NamedTuple):
+    """A byte progress report, sizes are in bytes and the ETA in seconds."""
+
+    transferred: int
+    total: int
+    rate: float
+    eta: t.Optional[float]
+
+
+class FileStats(t.NamedTuple):
+    transferred: int
+    total: int
+
+
+class FileError(t.NamedTuple):
+    path: t.Optional[str]
+    message: str
+
+
+Event = t.Union[TransferStats, FileStats, FileError]
+
+
+def parse_size(value: str, unit: t.Optional[str]) -> int:
+    return round(float(value) * UNITS[unit])
+
+
+def parse_eta(value: str) -> t.Optional[float]:
+    """Parse an rclone duration like 1h2m3s, returning None if it's unknown."""
+    parts = ETA_REGEX.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * ETA_UNITS[unit] for amount, unit in parts)
+
+
+def parse_line(line: str) -> t.Optional[Event]:
+    """Parse a line of rclone output, already stripped of ANSI codes."""
+    line = line.strip()
+    if line.startswith("Transferred:"):
+        if match := BYTES_REGEX.match(line):
+            done, done_unit, total, total_unit, _, rate, rate_unit, eta = match.groups()
+            return TransferStats(
+                parse_size(done, done_unit),
+                parse_size(total, total_unit),
+                parse_size(rate, rate_unit),
+                parse_eta(eta),
+            )
+        if match := FILES_REGEX.match(line):
+            return FileStats(int(match[1]), int(match[2]))
+    elif match := ERROR_REGEX.search(line):
+        return FileError(match[1], match[2])
+    return None
+
+
+class ThroughputGauge:
+    """A smoothed transfer rate, derived from the transferred byte counts reported."""
+
+    def __init__(self, smoothing: float = GAUGE_SMOOTHING) -> None:
+        self.smoothing = smoothing
+        self.rate = 0.0
+        self._last: t.Optional[tuple[float, int]] = None
+
+    def update(self, transferred: int, now: t.Optional[float] = None) -> float:
+        """Record the total bytes transferred so far, returning the new rate."""
+        now = time.monotonic() if now is None else now
+        if self._last is not None:
+            elapsed = now - self._last[0]
+            if elapsed > 0:
+                measured = max(0, transferred - self._last[1]) / elapsed
+                self.rate += self.smoothing * (measured - self.rate)
+        self._last = (now, transferred)
+        return self.rate
+
+
+class ProgressParser:
+    """
+    Turns a stream of rclone output into events, keeping only the latest state.
+
+    Memory use is bounded no matter how long the run is, as only the most recent
+    errors are kept alongside running counts.
+    """
+
+    def __init__(
+        self,
+        on_event: t.Optional[t.Callable[[Event], None]] = None,
+        max_errors: int = MAX_KEPT_ERRORS,
+    ) -> None:
+        self.on_event = on_event
+        self.stats: t.Optional[TransferStats] = None
+        self.files: t.Optional[FileStats] = None
+        self.errors: collections.deque[FileError] = collections.deque(maxlen=max_errors)
+        self.error_count = 0
+        self.gauge = ThroughputGauge()
+
+    @property
+    def transferred(self) -> int:
+        return self.stats.transferred if self.stats else 0
+
+    @property
+    def files_transferred(self) -> int:
+        return self.files.transferred if self.files else 0
+
+    def feed(self, data: t.Union[bytes, str]) -> None:
+        """Parse a chunk of output, which may hold several carriage-return separated lines."""
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        for line in ANSI_REGEX.sub("", data).replace("\r", "\n").split("\n"):
+            event = parse_line(line)
+            if event is None:
+                continue
+            if isinstance(event, TransferStats):
+                self.stats = event
+                self.gauge.update(event.transferred)
+            elif isinstance(event, FileStats):
+                self.files = event
+            else:
+                self.errors.append(event)
+                self.error_count += 1
+            if self.on_event is not None:
+                self.on_event(event)
+
+
+class RunProgress:
+    """Live progress across all concurrently running shards of a run."""
+
+    def __init__(self) -> None:
+        # The time.monotonic() at which bytes were first reported as transferred
+        self.first_transfer: t.Optional[float] = None
+        self._parsers: dict[str, ProgressParser] = {}
+        self._lock = threading.Lock()
+
+    def _on_event(self, event: Event) -> None:
+        if self.first_transfer is None and isinstance(event, TransferStats) and event.transferred:
+            self.first_transfer = time.monotonic()
+
+    def parser(self, name: str) -> ProgressParser:
+        """Create the parser for a shard's attempt, replacing the one of any previous attempt."""
+        parser = ProgressParser(self._on_event)
+        with self._lock:
+            self._parsers[name] = parser
+        return parser
+
+    def finish(self, name: str) -> None:
+        """Mark a shard's attempt as finished, so it no longer counts towards the rate."""
+        with self._lock:
+            self._parsers[name].gauge.rate = 0.0
+
+    def _all(self) -> list[ProgressParser]:
+        with self._lock:
+            return list(self._parsers.values())
+
+    @property
+    def transferred(self) -> int:
+        return sum(parser.transferred for parser in self._all())
+
+    @property
+    def files_transferred(self) -> int:
+        return sum(parser.files_transferred for parser in self._all())
+
+    @property
+    def rate(self) -> float:
+        """The current throughput of the run, in bytes per second."""
+        return sum(parser.gauge.rate for parser in self._all())
+
+    @property
+    def error_count(self) -> int:
+        return sum(parser.error_count for parser in self._all())
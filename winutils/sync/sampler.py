@@ -0,0 +1,226 @@
+"""Continuous sampling of system resource usage."""
+
+import array
+import threading
+import time
+import typing as t
+from loguru import logger
+import psutil
+import GPUtil
+
+SAMPLE_INTERVAL = 5
+HISTORY_DURATION = 60 * 60
+
+
+class Resource(t.NamedTuple):
+    """
+    A sampled resource, and the condition it must meet for the machine to be idle.
+
+    If `below` is set, the mean of the samples must stay under the threshold (usage),
+    otherwise it must stay above it (availability). `bound` is the most favourable value
+    the probe can report, used to give up early on a window that can no longer pass.
+    """
+
+    name: str
+    probe: t.Callable[[], float]
+    threshold: float
+    below: bool
+    bound: float
+
+
+class RingBuffer:
+    """
+    A fixed-size buffer of samples, backed by an array of running totals.
+
+    Keeping running totals instead of the samples themselves makes the mean of any
+    recent window a single subtraction.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.count = 0
+        self._totals = array.array("d", bytes(8 * (capacity + 1)))
+
+    def append(self, value: float) -> None:
+        """Append a sample, evicting the oldest one if the buffer is full."""
+        total = self._totals[self.count % (self.capacity + 1)]
+        self.count += 1
+        self._totals[self.count % (self.capacity + 1)] = total + value
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def sum(self, samples: int) -> float:
+        """Return the sum of the most recent samples."""
+        samples = min(samples, len(self))
+        slots = self.capacity + 1
+        return self._totals[self.count % slots] - self._totals[(self.count - samples) % slots]
+
+    def latest(self) -> t.Optional[float]:
+        """Return the most recent sample, if any."""
+        if not self.count:
+            return None
+        return self.sum(1)
+
+
+def cpu_usage() -> float:
+    """Return the CPU usage since the previous call, as a percentage."""
+    return psutil.cpu_percent(interval=None)
+
+
+def gpu_usage() -> float:
+    """Return the load of the first GPU, as a percentage."""
+    return GPUtil.getGPUs()[0].load * 100
+
+
+def available_ram() -> float:
+    """Return the available RAM in MiB."""
+    return psutil.virtual_memory().available / 1024**2
+
+
+def total_ram() -> float:
+    """Return the total RAM in MiB."""
+    return psutil.virtual_memory().total / 1024**2
+
+
+def has_single_gpu() -> bool:
+    """Return whether exactly one GPU can be probed."""
+    try:
+        return len(GPUtil.getGPUs()) == 1
+    except Exception:
+        return False
+
+
+class ResourceSampler:
+    """
+    Samples resources on a long-lived thread, and answers whether the machine is idle.
+
+    Samples are kept in ring buffers, so idleness over the last few seconds is known
+    without blocking, as long as the sampler has been running for that long.
+    """
+
+    def __init__(
+        self,
+        resources: t.Sequence[Resource],
+        interval: float = SAMPLE_INTERVAL,
+        history: float = HISTORY_DURATION,
+    ) -> None:
+        self.resources = list(resources)
+        self.interval = interval
+        capacity = max(1, int(history // interval))
+        self.buffers = {resource.name: RingBuffer(capacity) for resource in self.resources}
+        self.condition = threading.Condition()
+        self.running = False
+        # Called with the time of each sample, and whether that sample alone was idle
+        self.listeners: list[t.Callable[[float, bool], None]] = []
+        self._thread: t.Optional[threading.Thread] = None
+
+    def samples_for(self, duration: float) -> int:
+        """Return the number of samples covering a duration."""
+        return max(1, round(duration / self.interval))
+
+    def sample(self) -> None:
+        """Take one sample of every resource, and wake up any waiters."""
+        values = []
+        for resource in self.resources:
+            try:
+                values.append(resource.probe())
+            except Exception:
+                logger.exception("Probing {} failed", resource.name)
+                values.append(None)
+
+        with self.condition:
+            for resource, value in zip(self.resources, values):
+                if value is None:
+                    continue
+                logger.trace("{} sample: {:.1f}", resource.name, value)
+                self.buffers[resource.name].append(value)
+            is_idle = self._verdict(1)
+            self.condition.notify_all()
+
+        if is_idle is not None:
+            now = time.time()
+            for listener in self.listeners:
+                listener(now, is_idle)
+
+    def _run(self) -> None:
+        while True:
+            self.sample()
+            with self.condition:
+                if self.running:
+                    self.condition.wait(self.interval)
+                if not self.running:
+                    break
+
+    def start(self) -> None:
+        """Start sampling on a background thread."""
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling, waking up any waiters."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self._thread = None
+
+    def mean(self, name: str, duration: float) -> t.Optional[float]:
+        """Return the mean of a resource over the last duration, if it has been sampled."""
+        buffer = self.buffers[name]
+        samples = min(self.samples_for(duration), len(buffer))
+        if not samples:
+            return None
+        return buffer.sum(samples) / samples
+
+    def _verdict(self, samples: int) -> t.Optional[bool]:
+        """
+        Decide whether every resource meets its threshold over the last samples.
+
+        None is returned if the window isn't filled yet, and could still go either way.
+        """
+        undecided = False
+        for resource in self.resources:
+            buffer = self.buffers[resource.name]
+            window = min(samples, buffer.capacity)
+            taken = min(window, len(buffer))
+            total = buffer.sum(taken)
+            best_mean = (total + (window - taken) * resource.bound) / window
+
+            if resource.below and best_mean >= resource.threshold:
+                return False
+            if not resource.below and best_mean <= resource.threshold:
+                return False
+            if taken < window:
+                undecided = True
+        return None if undecided else True
+
+    def is_idle(self, duration: float) -> t.Optional[bool]:
+        """
+        Find whether the machine was idle over the last duration, in O(1).
+
+        None is returned if there isn't enough history to decide yet.
+        """
+        with self.condition:
+            return self._verdict(self.samples_for(duration))
+
+    def wait_until_idle(self, duration: float, timeout: t.Optional[float] = None) -> bool:
+        """
+        Find whether the machine is idle over the last duration, waiting for samples if needed.
+
+        This returns as soon as the outcome is known, including when a partially sampled
+        window can no longer meet the thresholds.
+        """
+        samples = self.samples_for(duration)
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self._verdict(samples) is not None or not self.running, timeout
+            )
+            return bool(self._verdict(samples))
+
+    def means(self, duration: float) -> dict[str, t.Optional[float]]:
+        """Return the mean of every resource over the last duration."""
+        with self.condition:
+            return {resource.name: self.mean(resource.name, duration) for resource in self.resources}
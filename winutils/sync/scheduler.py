@@ -0,0 +1,172 @@
+"""A single-threaded scheduler for any number of periodic sync jobs."""
+
+import dataclasses
+import heapq
+import itertools
+import random
+import threading
+import time
+import typing as t
+from loguru import logger
+
+# Jobs whose action raised are retried after this long
+FAILURE_RETRY = 30 * 60
+
+
+@dataclasses.dataclass(eq=False)
+class SyncJob:
+    """
+    A periodic job, run every `interval` seconds plus up to `jitter` seconds.
+
+    The action is called with the job and whether the run is forced. It returns None once
+    the job is done, or a delay after which it should be retried (e.g. the machine is busy).
+    If it raises, the job is retried after `failure_retry` seconds, and doesn't count as run.
+    Once a job has been postponed for `deadline` seconds past its due time, runs are forced.
+    """
+
+    name: str
+    interval: float
+    action: t.Callable[["SyncJob", bool], t.Optional[float]]
+    jitter: float = 0
+    deadline: t.Optional[float] = None
+    failure_retry: float = FAILURE_RETRY
+    last_run: t.Optional[float] = None
+    due: float = 0
+    due_since: t.Optional[float] = None
+    force_next: bool = False
+
+    def next_due(self, now: float) -> float:
+        """Find when the job is next due, given that it last ran at `last_run`."""
+        if self.last_run is None:
+            return now
+        return self.last_run + self.interval + random.uniform(0, self.jitter)
+
+    def is_forced(self, now: float) -> bool:
+        """Find whether the job has been postponed past its deadline."""
+        if self.force_next:
+            return True
+        if self.deadline is None or self.due_since is None:
+            return False
+        return now - self.due_since >= self.deadline
+
+
+class Scheduler:
+    """
+    Runs jobs from a priority queue on a single thread.
+
+    The thread waits on a condition, so stopping, rescheduling and running a job right
+    away take effect immediately instead of after the current wait.
+    """
+
+    def __init__(self, clock: t.Callable[[], float] = time.time) -> None:
+        self.clock = clock
+        self.jobs: dict[str, SyncJob] = {}
+        self.running = False
+        self._heap: list[tuple[float, int, SyncJob]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: t.Optional[threading.Thread] = None
+
+    def _push(self, job: SyncJob, due: float) -> None:
+        """Queue a job, invalidating any entry it already has in the heap."""
+        job.due = due
+        heapq.heappush(self._heap, (due, next(self._counter), job))
+        self._condition.notify_all()
+
+    def add(self, job: SyncJob) -> None:
+        """Add a job, due as per its last run."""
+        with self._condition:
+            if job.name in self.jobs:
+                raise ValueError(f"A job named {job.name!r} is already scheduled.")
+            self.jobs[job.name] = job
+            self._push(job, job.next_due(self.clock()))
+
+    def remove(self, name: str) -> None:
+        """Remove a job, its heap entry is discarded once it surfaces."""
+        with self._condition:
+            del self.jobs[name]
+            self._condition.notify_all()
+
+    def reschedule(self, name: str, due: float) -> None:
+        """Move a job to a new due time."""
+        with self._condition:
+            self._push(self.jobs[name], due)
+
+    def run_now(self, name: str, force: bool = True) -> None:
+        """Run a job as soon as possible, by default skipping its idle checks."""
+        with self._condition:
+            job = self.jobs[name]
+            job.force_next = force
+            self._push(job, self.clock())
+
+    def _is_stale(self, due: float, job: SyncJob) -> bool:
+        return self.jobs.get(job.name) is not job or job.due != due
+
+    def _next_job(self) -> t.Optional[SyncJob]:
+        """Wait for the next due job, returning None once the scheduler is stopped."""
+        with self._condition:
+            while self.running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due, _, job = self._heap[0]
+                if self._is_stale(due, job):
+                    heapq.heappop(self._heap)
+                    continue
+
+                delay = due - self.clock()
+                if delay > 0:
+                    logger.trace("Next job {!r} in {:.0f} seconds", job.name, delay)
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                job.due = float("inf")
+                return job
+        return None
+
+    def _run_job(self, job: SyncJob) -> None:
+        now = self.clock()
+        if job.due_since is None:
+            job.due_since = now
+        forced = job.is_forced(now)
+        job.force_next = False
+
+        try:
+            retry_after = job.action(job, forced)
+        except Exception:
+            logger.exception("Job {!r} failed, retrying in {} seconds", job.name, job.failure_retry)
+            retry_after = job.failure_retry
+
+        with self._condition:
+            if self.jobs.get(job.name) is not job or job.due != float("inf"):
+                # The job was removed or rescheduled while running
+                return
+            now = self.clock()
+            if retry_after is None:
+                job.last_run = now
+                job.due_since = None
+                self._push(job, job.next_due(now))
+            else:
+                self._push(job, now + retry_after)
+
+    def _run(self) -> None:
+        while (job := self._next_job()) is not None:
+            self._run_job(job)
+
+    def start(self) -> None:
+        """Start running jobs on a background thread."""
+        with self._condition:
+            if self.running:
+                return
+            self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop running jobs, the thread exits once any ongoing job finishes."""
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+        self._thread = None
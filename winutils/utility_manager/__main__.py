@@ -10,17 +10,17 @@ if getattr(sys, "frozen", False):
         if process.info["exe"] == sys.executable and process.pid != current_pid:
             sys.exit(0)
 
-import keyboard
+import os
 import pystray
 import json
 import platformdirs
-from winutils.fn_lock import core as fn_core
+from winutils.fn_lock import core as fn_core, keymap
 from winutils.toggle_rainmeter import core as rain_core
 from winutils.toggle_click import core as click_core
-from winutils.mechvibes_volume import core as mech_core
+from winutils.mechvibes_volume import core as mech_core, targets as mech_targets
 from winutils.monitor_brightness import core as monitor_core
 from winutils.clear_ram import core as clear_ram_core
-from winutils._helpers import path, overlay
+from winutils._helpers import actions, chords, hooks, latency, path, overlay
 from PIL import Image
 
 ICON_PATH = path.ICON_DIR / "settings.ico"
@@ -29,6 +29,9 @@ RAIN_HOTKEY = "ctrl+alt+shift+r"
 RAM_HOTKEY = "ctrl+alt+shift+t"
 CONFIG_PATH = platformdirs.user_config_path("Winutils", appauthor=False)
 SETTINGS_PATH = CONFIG_PATH / "settings.json"
+LATENCY_REPORT_PATH = CONFIG_PATH / "latency.txt"
+KEYMAP_PATH = CONFIG_PATH / "keymap.json"
+VOLUME_TARGETS_PATH = CONFIG_PATH / "volume_targets.json"
 
 ram_next_action_is_quit = True
 
@@ -72,91 +75,78 @@ def mech_start_hook() -> None:
     settings["mechvibes_enabled"] = True
     SETTINGS_PATH.write_text(json.dumps(settings))
 
-    if settings["suppressive_key_events"]:
-        Hooks.increase_mech_hotkey = keyboard.add_hotkey(
-            mech_core.INCREASE_HOTKEY, mech_core.Handler.increment_scaling, suppress=True
-        )
-        Hooks.decrease_mech_hotkey = keyboard.add_hotkey(
-            mech_core.DECREASE_HOTKEY, mech_core.Handler.decrement_scaling, suppress=True
-        )
-    else:
-        Hooks.increase_mech_hotkey = keyboard.add_hotkey(
-            mech_core.INCREASE_HOTKEY, mech_core.Handler.increment_scaling
-        )
-        Hooks.decrease_mech_hotkey = keyboard.add_hotkey(
-            mech_core.DECREASE_HOTKEY, mech_core.Handler.decrement_scaling
-        )
+    hooks.registry.declare(
+        "mechvibes",
+        hotkeys={
+            mech_core.INCREASE_HOTKEY: hooks.Hotkey(mech_core.Handler.increment_scaling),
+            mech_core.DECREASE_HOTKEY: hooks.Hotkey(mech_core.Handler.decrement_scaling),
+        },
+    )
+    hooks.registry.reconcile()
 
 
 def mech_stop_hook() -> None:
     settings["mechvibes_enabled"] = False
     SETTINGS_PATH.write_text(json.dumps(settings))
 
-    keyboard.remove_hotkey(Hooks.increase_mech_hotkey)
-    Hooks.increase_mech_hotkey = None
-    keyboard.remove_hotkey(Hooks.decrease_mech_hotkey)
-    Hooks.decrease_mech_hotkey = None
+    hooks.registry.retract("mechvibes")
+    hooks.registry.reconcile()
 
 
 def toggle_monitor_brightness() -> None:
     """Toggle the monitor brightness tool."""
-    monitor_core.Handler.toggle(suppress=settings["suppressive_key_events"])
+    monitor_core.Handler.toggle()
     settings["monitor_brightness_enabled"] = monitor_core.Handler.running
     SETTINGS_PATH.write_text(json.dumps(settings))
 
 
-class Hooks:
-    """Store keyboard hooks used by this tool."""
-
-    fn_hook = None
-    click_hotkey = None
-    rain_hotkey = None
-    ram_hotkey = None
-    increase_mech_hotkey = None
-    decrease_mech_hotkey = None
-
-
 def initialize_hooks() -> None:
     """
-    Start all keyboard hooks, keeping in mind the suppression configuration.
+    Declare the hotkeys, and install the keyboard hook as per the suppression configuration.
+
+    Every tool is routed through the same hook, fn lock only when using suppressive events.
     """
+    hooks.registry.declare(
+        "utility manager",
+        hotkeys={
+            CLICK_HOTKEY: hooks.Hotkey(invoke_click),
+            # Presses made while these are still running are most likely repeats, and are ignored
+            RAIN_HOTKEY: hooks.Hotkey(invoke_rainmeter, actions.DROP),
+            RAM_HOTKEY: hooks.Hotkey(invoke_ram_toggle, actions.DROP),
+        },
+    )
+    hooks.registry.suppress = settings["suppressive_key_events"]
     if settings["suppressive_key_events"]:
-        Hooks.fn_hook = keyboard.hook(fn_core.handle_events, suppress=True)
-        Hooks.click_hotkey = keyboard.add_hotkey(CLICK_HOTKEY, invoke_click, suppress=True)
-        Hooks.rain_hotkey = keyboard.add_hotkey(RAIN_HOTKEY, invoke_rainmeter, suppress=True)
-        Hooks.ram_hotkey = keyboard.add_hotkey(RAM_HOTKEY, invoke_ram_toggle, suppress=True)
-    else:
-        Hooks.click_hotkey = keyboard.add_hotkey(CLICK_HOTKEY, invoke_click)
-        Hooks.rain_hotkey = keyboard.add_hotkey(RAIN_HOTKEY, invoke_rainmeter)
-        Hooks.ram_hotkey = keyboard.add_hotkey(RAM_HOTKEY, invoke_ram_toggle)
+        fn_core.declare()
+    hooks.registry.reconcile()
 
 
 def change_key_supression() -> None:
     """
     Switch between using suppressive and non-suppressive keyboard hooks.
 
-    When using non-suppressive keyboard hooks, fn lock is disabled completely.
+    When using non-suppressive keyboard hooks, fn lock is disabled completely. Only fn lock's
+    hooks and the keyboard hook itself change, the other tools' hotkeys are left in place.
     """
     settings["suppressive_key_events"] = not settings["suppressive_key_events"]
     SETTINGS_PATH.write_text(json.dumps(settings))
 
-    if Hooks.fn_hook:
-        keyboard.unhook(Hooks.fn_hook)
-        Hooks.fn_hook = None
-    keyboard.remove_hotkey(Hooks.click_hotkey)
-    Hooks.click_hotkey = None
-    keyboard.remove_hotkey(Hooks.rain_hotkey)
-    Hooks.rain_hotkey = None
-    keyboard.remove_hotkey(Hooks.ram_hotkey)
-    Hooks.ram_hotkey = None
+    hooks.registry.suppress = settings["suppressive_key_events"]
+    if settings["suppressive_key_events"]:
+        fn_core.declare()
+    else:
+        fn_core.retract()
+    hooks.registry.reconcile()
 
-    if settings["mechvibes_enabled"]:
-        mech_stop_hook()
-        mech_start_hook()
-    if settings["monitor_brightness_enabled"]:
-        monitor_core.Handler.sync_hooks(suppress=settings["suppressive_key_events"])
 
-    initialize_hooks()
+def dump_latencies() -> None:
+    """Write the latencies and counters of the keyboard hooks and actions to a file, and open it."""
+    LATENCY_REPORT_PATH.write_text(
+        f"{latency.registry.report()}\n\n{actions.executor.report()}\n\n"
+        f"{hooks.registry.report()}\n",
+        encoding="utf-8",
+    )
+    os.startfile(LATENCY_REPORT_PATH)
 
 
 def teardown_app() -> None:
@@ -165,6 +155,23 @@ def teardown_app() -> None:
     overlay.root.after(1, overlay.root.destroy)
 
 
+HOTKEYS = [
+    CLICK_HOTKEY,
+    RAIN_HOTKEY,
+    RAM_HOTKEY,
+    fn_core.TOGGLE_HOTKEY,
+    mech_core.INCREASE_HOTKEY,
+    mech_core.DECREASE_HOTKEY,
+    monitor_core.INCREASE_HOTKEY,
+    monitor_core.DECREASE_HOTKEY,
+]
+# Some are only registered when their tool is enabled, so check them all upfront
+conflicts = chords.find_conflicts(HOTKEYS)
+if conflicts:
+    raise SystemExit(
+        "Conflicting hotkeys: " + ", ".join(f"{first} and {second}" for first, second in conflicts)
+    )
+
 CONFIG_PATH.mkdir(parents=True, exist_ok=True)
 SETTINGS_PATH.touch(exist_ok=True)
 
@@ -184,13 +191,21 @@ else:
         "mechvibes_enabled": False,
         "monitor_brightness_enabled": False,
     }
+mech_core.Handler.volume_targets = mech_targets.load_targets(
+    VOLUME_TARGETS_PATH, mech_core.Handler.volume_targets
+)
 if settings["mechvibes_enabled"]:
     mech_core.Handler.start()
 if settings["monitor_brightness_enabled"]:
-    monitor_core.Handler.start(suppress=settings["suppressive_key_events"])
+    monitor_core.Handler.start()
 fn_core.State.enabled = settings["fn_lock_enabled"]
+try:
+    fn_core.load_keymap(keymap.load_keymap(KEYMAP_PATH, fn_core.DEFAULT_KEYMAP))
+except ValueError as error:  # Malformed JSON or an invalid keymap, the default is kept
+    fn_core.show_keymap_error(error)
 
 initialize_hooks()
+keymap.KeymapWatcher(KEYMAP_PATH, fn_core.load_keymap, fn_core.show_keymap_error).start()
 
 icon = Image.open(ICON_PATH)
 icon.size = (64, 64)
@@ -214,6 +229,11 @@ monitor_item = pystray.MenuItem(
     toggle_monitor_brightness,
     checked=lambda item: monitor_core.Handler.running,
 )
+rescan_monitors_item = pystray.MenuItem(
+    "Rescan monitors",
+    monitor_core.Handler.rescan_monitors,
+    enabled=lambda item: monitor_core.Handler.running,
+)
 
 quit_apps_item = pystray.MenuItem("Quit target apps", clear_ram_core.quit_apps)
 start_apps_item = pystray.MenuItem("Start target apps", clear_ram_core.start_apps)
@@ -223,6 +243,7 @@ suppress_item = pystray.MenuItem(
     change_key_supression,
     checked=lambda item: settings["suppressive_key_events"],
 )
+latency_item = pystray.MenuItem("Dump key latencies", dump_latencies)
 quit_item = pystray.MenuItem("Quit", teardown_app)
 
 menu = pystray.Menu(
@@ -231,11 +252,13 @@ menu = pystray.Menu(
     fn_lock_item,
     mechvibes_item,
     monitor_item,
+    rescan_monitors_item,
     pystray.Menu.SEPARATOR,
     start_apps_item,
     quit_apps_item,
     pystray.Menu.SEPARATOR,
     suppress_item,
+    latency_item,
     quit_item,
 )
 tray_icon = pystray.Icon("Winutils", icon=icon, menu=menu)